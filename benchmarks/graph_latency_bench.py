@@ -0,0 +1,211 @@
+"""工作流的逐节点延迟基准, 不需要真实的大模型和MCP服务:
+- ScriptedChatModel: 按问题语料返回预先写好的工具调用, 每次调用固定延迟 --llm-latency 毫秒
+- db_query_tool / get_list_table_tool: 在进程内直接调用 mcpserver.mcp_tools 里的实现, 查询仓库里真实的 chinook.db
+语料在 benchmarks/questions.jsonl: sql 是正确的查询, first_sql 是第一次生成的有错误的查询(用来覆盖修复阶段), sqls 是拆分成多个子查询的问题。
+输出每个节点的 p50/p95/p99、每个问题的大模型调用次数、每次调用的 prompt token 数和总耗时, 结果写入 JSON 文件, 提交后回归就能在diff里看到。
+用法: python benchmarks/graph_latency_bench.py [--rounds 5] [--llm-latency 50] [--output benchmarks/results/graph_latency.json]"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import Any, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 在导入 sql_graph 之前设置: 关闭问题->SQL缓存, 每一轮都走完整的生成流程; 不修改仓库里 chinook.db 的 journal_mode
+os.environ.setdefault("QUESTION_CACHE_MAX_SIZE", "0")
+os.environ["QUESTION_CACHE_PATH"] = ""
+os.environ.setdefault("SQLITE_ENABLE_WAL", "0")
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(ROOT, "chinook.db"))
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import StructuredTool
+from langgraph.checkpoint.memory import MemorySaver
+
+import sql_graph.text2sql_graph as text2sql_graph
+from mcpserver import mcp_tools
+from sql_graph.message_compactor import get_encoding, message_tokens
+from sql_graph.sql_state import is_error_result, message_text
+
+
+CHECK_PROMPT_MARKER = "SQL专家"  # check_query 的 system prompt
+
+
+def load_corpus(path: str) -> dict[str, dict]:
+    with open(path, encoding="utf-8") as f:
+        return {entry["question"]: entry for entry in map(json.loads, filter(str.strip, f))}
+
+
+def _tool_call(sql: str) -> dict:
+    return {"name": "db_query_tool", "args": {"query": sql}, "id": uuid.uuid4().hex, "type": "tool_call"}
+
+
+class ScriptedChatModel(BaseChatModel):
+    corpus: dict
+    latency: float = 0.05
+    calls: int = 0
+    prompt_tokens: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages: list[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        self.prompt_tokens.append(sum(message_tokens(message) for message in messages))
+        last = messages[-1]
+        if messages[0].type == "system" and CHECK_PROMPT_MARKER in message_text(messages[0]):
+            return AIMessage(content="", tool_calls=[_tool_call(message_text(last).split("\n\n")[0])])
+        turn = messages[max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage)):]
+        entry = self.corpus[message_text(turn[0])]
+        if isinstance(last, ToolMessage) and last.name == "db_query_tool" and not is_error_result(last):
+            return AIMessage(content=f"查询结果如下: {message_text(last)[:200]}")
+        if "sqls" in entry:
+            return AIMessage(content="", tool_calls=[_tool_call(sql) for sql in entry["sqls"]])
+        attempted = any(isinstance(m, ToolMessage) and m.name == "db_query_tool" for m in turn)
+        return AIMessage(content="", tool_calls=[_tool_call(entry.get("first_sql") if not attempted and
+                                                             "first_sql" in entry else entry["sql"])])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages)
+        for word in message.content.split(" ") if message.content else []:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        for index, tool_call in enumerate(message.tool_calls):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                "name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": index}]))
+
+
+async def get_list_table_tool() -> str:
+    """列出数据库中的所有表"""
+    return await mcp_tools.get_list_table_tool()
+
+
+async def db_query_tool(query: str) -> str:
+    """执行sql查询query,返回结果"""
+    return await mcp_tools.db_query_tool(query)
+
+
+IN_PROCESS_TOOLS = [StructuredTool.from_function(coroutine=get_list_table_tool, name="get_list_table_tool"),
+                    StructuredTool.from_function(coroutine=db_query_tool, name="db_query_tool")]
+
+
+class NodeTimer(BaseCallbackHandler):
+    """按 langgraph_node 记录每个节点每次执行的耗时"""
+    run_inline = True
+
+    def __init__(self):
+        self.timings: dict[str, list[float]] = {}
+        self._started: dict[Any, tuple[str, float]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started:
+            self.timings.setdefault(started[0], []).append(time.perf_counter() - started[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+
+def percentiles(values: list[float], scale: float = 1.0) -> dict:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * scale, 2)
+
+    return {"n": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(statistics.mean(ordered) * scale, 2)}
+
+
+async def run(corpus: dict[str, dict], rounds: int, llm_latency: float) -> dict:
+    model = ScriptedChatModel(corpus=corpus, latency=llm_latency)
+    text2sql_graph.get_llm = lambda llm_type="basic": model
+    registry = text2sql_graph.GraphRegistry({}, text2sql_graph.build_graph)
+
+    async def load_tools():
+        return IN_PROCESS_TOOLS
+
+    registry._load_tools = load_tools
+    graph = await registry.get_graph(MemorySaver())
+    timer = NodeTimer()
+    question_latencies, calls_per_question, answers = [], {}, {}
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        for question, entry in corpus.items():
+            calls_before = model.calls
+            question_start = time.perf_counter()
+            state = await graph.ainvoke({"messages": [{"role": "user", "content": question}]},
+                                        config={"configurable": {"thread_id": uuid.uuid4().hex},
+                                                "callbacks": [timer], "recursion_limit": 50})
+            question_latencies.append(time.perf_counter() - question_start)
+            calls_per_question[entry["id"]] = model.calls - calls_before
+            answers[entry["id"]] = message_text(state["messages"][-1])[:60]
+    wall_time = time.perf_counter() - start_time
+    await registry.close()
+    return {
+        "config": {"rounds": rounds, "questions": len(corpus), "llm_latency_ms": llm_latency * 1000,
+                   "tokenizer": "tiktoken" if get_encoding() is not None else "estimate"},
+        "wall_time_s": round(wall_time, 3),
+        "question_latency_ms": percentiles(question_latencies, 1000),
+        "nodes_ms": {node: percentiles(values, 1000) for node, values in sorted(timer.timings.items())},
+        "llm_calls_per_question": dict(sorted(calls_per_question.items())),
+        "llm_calls_total": model.calls,
+        "prompt_tokens_per_call": percentiles(model.prompt_tokens),
+        "answers": dict(sorted(answers.items())),
+    }
+
+
+def print_report(result: dict):
+    print(f"{'node':<26} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)")
+    for node, stats in result["nodes_ms"].items():
+        print(f"{node:<26} {stats['n']:>5} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f}")
+    latency = result["question_latency_ms"]
+    print(f"{'question':<26} {latency['n']:>5} {latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f}")
+    print(f"LLM calls per question: {result['llm_calls_per_question']}")
+    tokens = result["prompt_tokens_per_call"]
+    print(f"prompt tokens per call: p50={tokens['p50']} p95={tokens['p95']} max={tokens['p99']}")
+    print(f"wall time {result['wall_time_s']}s for {latency['n']} questions")
+
+
+def main(args: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "benchmarks", "questions.jsonl"))
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=50, help="每次大模型调用的模拟延迟(毫秒)")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "graph_latency.json"))
+    args = parser.parse_args(args)
+    logging.getLogger().setLevel(logging.WARNING)  # FastMCP 导入时把日志级别设成了 INFO
+    result = asyncio.run(run(load_corpus(args.corpus), args.rounds, args.llm_latency / 1000))
+    print_report(result)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
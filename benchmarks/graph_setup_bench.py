@@ -0,0 +1,104 @@
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_mcp_adapters.client import MultiServerMCPClient
+
+from sql_graph.graph_registry import GraphRegistry
+from sql_graph.text2sql_graph import build_graph, mcp_server_config
+
+"""对比每个请求的准备开销：
+- per_request: 以前 make_graph_context 的做法, 每次新建 MultiServerMCPClient + get_tools() + bind_tools + 编译工作流,
+  而且 get_tools() 返回的工具每次调用都要重新建立一次MCP连接
+- registry: 进程级 GraphRegistry, 只在第一次请求时建立会话和编译, 之后直接复用
+用法: python benchmarks/graph_setup_bench.py [请求次数]
+没有运行中的MCP服务时, 会用仓库 chinook.db 的临时副本在 8000 端口启动一个。"""
+
+QUERY = "SELECT Name FROM artists LIMIT 3"
+
+
+def _server_running() -> bool:
+    try:
+        with httpx.stream("GET", mcp_server_config["url"], timeout=1) as response:
+            return response.status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+def start_server(tmp_dir: str):
+    """启动MCP服务子进程, 数据库用临时副本, 开启WAL不会改动仓库里的数据库"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(tmp_dir, "chinook.db")
+    shutil.copy(os.path.join(root, "chinook.db"), db_path)
+    process = subprocess.Popen([sys.executable, "-m", "mcpserver.start_server"], cwd=root,
+                               env={**os.environ, "SQLITE_DB_PATH": db_path},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if _server_running():
+            return process
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("MCP服务启动失败")
+
+
+async def per_request(n: int) -> list[float]:
+    latencies = []
+    for _ in range(n):
+        start_time = time.perf_counter()
+        tools = await MultiServerMCPClient({"sql_mcp": mcp_server_config}).get_tools()
+        build_graph(tools)
+        db_query_tool = next(tool for tool in tools if tool.name == "db_query_tool")
+        await db_query_tool.ainvoke({"query": QUERY})
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+async def registry(n: int) -> tuple[list[float], float]:
+    graph_registry = GraphRegistry({"sql_mcp": mcp_server_config}, build_graph)
+    latencies = []
+    try:
+        for _ in range(n):
+            start_time = time.perf_counter()
+            await graph_registry.get_graph()
+            db_query_tool = next(tool for tool in graph_registry.tools if tool.name == "db_query_tool")
+            await db_query_tool.ainvoke({"query": QUERY})
+            latencies.append(time.perf_counter() - start_time)
+        return latencies, graph_registry.setup_time
+    finally:
+        await graph_registry.close()
+
+
+def report(name: str, latencies: list[float]):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<12} n={len(latencies):<4} mean={statistics.mean(latencies) * 1000:8.2f}ms "
+          f"p50={statistics.median(latencies) * 1000:8.2f}ms p95={p95 * 1000:8.2f}ms "
+          f"first={latencies[0] * 1000:8.2f}ms")
+
+
+async def main(n: int):
+    report("per_request", await per_request(n))
+    latencies, setup_time = await registry(n)
+    report("registry", latencies)
+    print(f"registry 一次性初始化耗时 {setup_time * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = None if _server_running() else start_server(tmp_dir)
+        try:
+            asyncio.run(main(requests))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
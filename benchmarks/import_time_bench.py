@@ -0,0 +1,50 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+"""冷启动基准：每次在新的子进程里计时导入各个模块, 以及第一次获取schema快照(现场读取数据库 vs 加载预先构建的快照文件)。
+导入模块不应该再连接数据库或者创建大模型客户端, 这些开销都推迟到第一次使用。
+用法: python benchmarks/import_time_bench.py [每项重复次数]
+查看具体是哪个依赖慢: python -X importtime -c "import sql_graph.text2sql_graph" 2> importtime.log"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["sql_graph.my_llm", "sql_graph.schema_catalog", "sql_graph.tool_node", "sql_graph.text2sql_graph",
+           "mcpserver.mcp_tools"]
+
+_IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+_SCHEMA_SNIPPET = ("import time; from sql_graph.schema_catalog import get_schema_catalog; "
+                   "t = time.perf_counter(); get_schema_catalog().get(); print(time.perf_counter() - t)")
+
+
+def run_timed(snippet: str, env: dict, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, env=env, capture_output=True, text=True,
+                                check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    print(f"{name:<40} median={statistics.median(timings) * 1000:8.2f}ms min={min(timings) * 1000:8.2f}ms "
+          f"max={max(timings) * 1000:8.2f}ms")
+
+
+def main(repeat: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, "chinook.db.schema.json")
+        env = {**os.environ, "PYTHONPATH": ROOT, "SCHEMA_SNAPSHOT_PATH": ""}
+        for module in MODULES:
+            report(f"import {module}", run_timed(_IMPORT_SNIPPET.format(module=module), env, repeat))
+
+        report("schema snapshot (live)", run_timed(_SCHEMA_SNIPPET, env, repeat))
+        subprocess.run([sys.executable, "-m", "sql_graph.schema_catalog", snapshot_path], cwd=ROOT, env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        report("schema snapshot (file)", run_timed(_SCHEMA_SNIPPET, {**env, "SCHEMA_SNAPSHOT_PATH": snapshot_path},
+                                                   repeat))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from sql_graph.message_compactor import compact_messages, message_tokens
+from sql_graph.schema_catalog import get_schema_catalog
+from sql_graph.table_retriever import get_table_retriever
+
+"""会话变长时每次调用 generate_sql_query 的 prompt 大小：模拟一个多轮会话, 每轮都是
+问题 -> schema -> 一次失败的SQL -> 重新生成后执行成功(结果较大) -> 回答, 对比压缩前后发送给模型的 token 数。
+用法: python benchmarks/prompt_size_bench.py [轮数]"""
+
+QUESTIONS = ["每个流派有多少首歌曲?", "销售额最高的10位客户是谁?", "每个员工负责多少客户?", "哪些专辑的曲目最多?"]
+
+
+def tool_pair(name: str, args: dict, content: str, status: str = "success") -> list:
+    tool_call_id = uuid.uuid4().hex
+    return [AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": tool_call_id, "type": "tool_call"}]),
+            ToolMessage(content=content, name=name, tool_call_id=tool_call_id, status=status)]
+
+
+def simulate_turn(question: str, conn: sqlite3.Connection) -> list:
+    snapshot = get_schema_catalog().get()
+    tables = get_table_retriever().search(question)
+    rows = conn.execute("SELECT t.Name, a.Title, t.Milliseconds FROM tracks t JOIN albums a USING (AlbumId) "
+                        "LIMIT 200").fetchall()
+    return [
+        HumanMessage(content=question),
+        *tool_pair("sql_db_schema", {"table_names": ", ".join(tables)}, snapshot.render(tables)),
+        *tool_pair("db_query_tool", {"query": "SELECT Name, COUNT(*) FROM genre GROUP BY Name"},
+                   "Error: (sqlite3.OperationalError) no such table: genre", status="error"),
+        *tool_pair("db_query_tool", {"query": "SELECT t.Name, a.Title, t.Milliseconds FROM tracks t JOIN albums a"},
+                   str(rows)),
+        AIMessage(content=f"{question} 的查询结果如下: " + str(rows[:5])),
+    ]
+
+
+def main(turns: int):
+    conn = sqlite3.connect(get_schema_catalog().db_path)
+    messages = []
+    print(f"{'turn':>4} {'messages':>8} {'full prompt':>12} {'compacted':>10}")
+    for turn in range(turns):
+        turn_messages = simulate_turn(QUESTIONS[turn % len(QUESTIONS)], conn)
+        messages.extend(turn_messages[:-1])  # 生成最终回答之前的那一次调用
+        full = sum(message_tokens(message) for message in messages)
+        compacted = sum(message_tokens(message) for message in compact_messages(messages))
+        print(f"{turn + 1:>4} {len(messages):>8} {full:>12} {compacted:>10}")
+        messages.append(turn_messages[-1])
+    conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
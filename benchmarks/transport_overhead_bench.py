@@ -0,0 +1,145 @@
+"""SQL工具各传输方式的单次调用开销: inprocess / stdio / sse。
+查询是 SELECT 1, 第二次起命中服务端的查询结果缓存, 测到的基本就是传输本身(HTTP、JSON-RPC、SSE分帧)的开销;
+另外对比 --batch 条不同的查询逐条发送、一次 db_query_batch_tool 调用、以及并发调用时 QueryBatcher 自动合并的耗时。
+sse 模式会在一个空闲端口上启动 mcpserver.start_server 子进程。
+用法: python benchmarks/transport_overhead_bench.py [--calls 200] [--batch 8] [--output benchmarks/results/transport_overhead.json]"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SQLITE_ENABLE_WAL", "0")  # 子进程和进程内都不修改仓库里 chinook.db 的 journal_mode
+
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+from sql_graph.mcp_transport import QueryBatcher, load_inprocess_tools, stdio_connection
+
+
+TRANSPORTS = ("inprocess", "stdio", "sse")
+
+
+def percentiles(values: list[float]) -> dict:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3)
+
+    return {"n": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(statistics.mean(ordered) * 1000, 3)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_sse_server(port: int) -> subprocess.Popen:
+    env = {**os.environ, "MCP_SERVER_PORT": str(port), "MCP_LOG_LEVEL": "WARNING"}
+    process = subprocess.Popen([sys.executable, "-m", "mcpserver.start_server", "sse"], cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"MCP server did not start on port {port}")
+
+
+async def load_tools(transport: str, stack: AsyncExitStack, url: Optional[str]) -> dict:
+    if transport == "inprocess":
+        tools = load_inprocess_tools()
+    else:
+        connection = stdio_connection() if transport == "stdio" else {"url": url, "transport": "sse"}
+        session = await stack.enter_async_context(MultiServerMCPClient({"sql_mcp": connection}).session("sql_mcp"))
+        tools = await load_mcp_tools(session)
+    return {tool.name: tool for tool in tools}
+
+
+async def measure(transport: str, calls: int, batch: int, url: Optional[str]) -> dict:
+    async with AsyncExitStack() as stack:
+        start_time = time.perf_counter()
+        tools = await load_tools(transport, stack, url)
+        setup = time.perf_counter() - start_time
+        query_tool, batch_tool = tools["db_query_tool"], tools["db_query_batch_tool"]
+        for _ in range(10):  # 预热: 建立连接、填充结果缓存
+            await query_tool.ainvoke({"query": "SELECT 1"})
+
+        latencies = []
+        for _ in range(calls):
+            start_time = time.perf_counter()
+            await query_tool.ainvoke({"query": "SELECT 1"})
+            latencies.append(time.perf_counter() - start_time)
+
+        queries = [f"SELECT {i}" for i in range(batch)]
+        start_time = time.perf_counter()
+        for query in queries:
+            await query_tool.ainvoke({"query": query})
+        sequential = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        await batch_tool.ainvoke({"queries": queries})
+        batched = time.perf_counter() - start_time
+        batcher = QueryBatcher(query_tool, batch_tool)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(batcher.query(query) for query in queries))
+        coalesced = time.perf_counter() - start_time
+    return {
+        "setup_ms": round(setup * 1000, 3),
+        "call_ms": percentiles(latencies),
+        f"{batch}_queries_ms": {"sequential": round(sequential * 1000, 3), "batch_tool": round(batched * 1000, 3),
+                                "concurrent_coalesced": round(coalesced * 1000, 3),
+                                "coalesced_round_trips": batcher.round_trips},
+    }
+
+
+async def run(transports: list[str], calls: int, batch: int) -> dict:
+    results = {"config": {"calls": calls, "batch": batch}}
+    server, url = None, None
+    if "sse" in transports:
+        port = free_port()
+        server, url = start_sse_server(port), f"http://127.0.0.1:{port}/sse"
+    try:
+        for transport in transports:
+            results[transport] = await measure(transport, calls, batch, url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def main(args: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transports", nargs="+", default=list(TRANSPORTS), choices=TRANSPORTS)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "transport_overhead.json"))
+    args = parser.parse_args(args)
+    result = asyncio.run(run(args.transports, args.calls, args.batch))
+    print(f"{'transport':<10} {'setup':>9} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)   "
+          f"{args.batch} queries: sequential / batch tool / coalesced")
+    for transport in args.transports:
+        stats = result[transport]
+        call, batched = stats["call_ms"], stats[f"{args.batch}_queries_ms"]
+        print(f"{transport:<10} {stats['setup_ms']:>9.2f} {call['p50']:>8.3f} {call['p95']:>8.3f} {call['p99']:>8.3f}"
+              f"        {batched['sequential']:.2f} / {batched['batch_tool']:.2f} / {batched['concurrent_coalesced']:.2f}"
+              f" ({batched['coalesced_round_trips']} round trips)")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""分析型查询的吞吐量: 只读线程池(一个进程) 对比 多进程查询工作池, 工作数分别为 --workers 里的每个值。
+每种配置同时保持 2 * 工作数 个查询在执行, 不经过查询结果缓存, 输出每秒查询数和相对单个工作者的加速比。
+多进程能不能接近线性扩展取决于机器的核数, 结果里记录了 cpu_count; 要在多核机器上跑, 单核机器上看不出扩展效果。
+用法: python benchmarks/worker_pool_bench.py [--workers 1 2 4] [--queries 16] [--output benchmarks/results/worker_pool.json]"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mcpserver.db_pool import ReadOnlyPool, fetch_page
+from mcpserver.worker_pool import ProcessQueryPool
+
+
+DB_PATH = os.getenv("SQLITE_DB_PATH", os.path.join(ROOT, "chinook.db"))
+# 按流派自连接 tracks 再聚合, 大约两百多万行的中间结果, 主要是CPU开销
+ANALYTICAL_QUERY = ("SELECT g.Name, COUNT(*), SUM(a.Milliseconds % 1000 * (b.Bytes % 1000)) FROM tracks a "
+                    "JOIN tracks b ON a.GenreId = b.GenreId JOIN genres g ON g.GenreId = a.GenreId "
+                    "WHERE a.TrackId % {shard} = 0 GROUP BY g.Name ORDER BY 2 DESC")
+
+
+async def throughput(pool, queries: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            # 每条SQL稍有不同, 热点查询的亲和性不会把所有查询固定到同一个进程
+            result, _ = await pool.run(fetch_page, ANALYTICAL_QUERY.format(shard=1 + i % 3), 0, 100)
+            assert not isinstance(result, str), result
+
+    await one(0)  # 预热: 打开连接
+    start_time = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(queries)))
+    return queries / (time.perf_counter() - start_time)
+
+
+async def run(workers: list[int], queries: int) -> dict:
+    results = {"config": {"cpu_count": os.cpu_count(), "queries": queries}, "threads": {}, "processes": {}}
+    for n in workers:
+        pool = ReadOnlyPool(DB_PATH, max_workers=n, enable_wal=False)
+        results["threads"][n] = round(await throughput(pool, queries, 2 * n), 3)
+        pool.close()
+        pool = ProcessQueryPool(DB_PATH, processes=n)
+        results["processes"][n] = round(await throughput(pool, queries, 2 * n), 3)
+        pool.close()
+    return results
+
+
+def main(args: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "worker_pool.json"))
+    args = parser.parse_args(args)
+    result = asyncio.run(run(args.workers, args.queries))
+    print(f"cpu_count={result['config']['cpu_count']}")
+    print(f"{'workers':>7} {'threads q/s':>12} {'processes q/s':>14} {'speedup':>8}")
+    base = result["processes"][args.workers[0]]
+    for n in args.workers:
+        print(f"{n:>7} {result['threads'][n]:>12.2f} {result['processes'][n]:>14.2f} {result['processes'][n] / base:>8.2f}")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,110 @@
-def get_llm_by_type(llm_type: str) -> BaseLLM:
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Literal
+
+import yaml
+
+"""按 llm/config.yaml 创建大模型客户端：
+- 配置里的 "$变量名" 从环境变量读取, 环境变量 BASIC_MODEL__API_KEY 这样的写法可以覆盖配置文件里的单个字段
+- 每种类型的模型只创建一次, 多线程/多个会话同时第一次使用时也只创建一个实例
+- LLM_CONFIG_PATH 可以指定别的配置文件"""
+
+LLMType = Literal["basic", "small", "reasoning"]
+
+# 模型类型 -> 配置文件里的键
+_LLM_TYPE_CONFIG_KEYS = {
+    "basic": "BASIC_MODEL",
+    "small": "SMALL_MODEL",
+    "reasoning": "REASONING_MODEL",
+}
+# 没有配置时退回使用的类型: 没有单独配置小模型时所有步骤都用基础模型
+_FALLBACK_TYPES = {"small": "basic", "reasoning": "basic"}
+
+_llm_cache: dict[str, Any] = {}
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def _get_config_file_path() -> str:
+    return os.getenv("LLM_CONFIG_PATH") or str(Path(__file__).parent / "config.yaml")
+
+
+def _replace_env_vars(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith("$"):
+        if value[1:] not in os.environ:
+            # 保留原值: 没有配置密钥时创建模型不报错, 真正请求时才会收到服务端的鉴权错误
+            logger.warning(f"Environment variable {value[1:]} is not set")
+            return value
+        return os.environ[value[1:]]
+    if isinstance(value, dict):
+        return {k: _replace_env_vars(v) for k, v in value.items()}
+    return value
+
+
+def load_yaml_config(path: str) -> dict[str, Any]:
+    """读取配置文件; 文件不存在时返回空配置, 只用环境变量也可以工作"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return _replace_env_vars(yaml.safe_load(f) or {})
+
+
+def _get_env_llm_conf(llm_type: str) -> dict[str, Any]:
+    """环境变量 <配置键>__<字段> 覆盖配置文件, 例如 SMALL_MODEL__MODEL=glm-4-flash-250414"""
+    prefix = f"{_LLM_TYPE_CONFIG_KEYS[llm_type]}__"
+    return {key[len(prefix):].lower(): value for key, value in os.environ.items() if key.startswith(prefix)}
+
+
+def _create_llm_use_conf(llm_type: str, conf: dict[str, Any]):
+    config_key = _LLM_TYPE_CONFIG_KEYS.get(llm_type)
+    if not config_key:
+        raise ValueError(f"Unknown LLM type: {llm_type}")
+    llm_conf = conf.get(config_key) or {}
+    if not isinstance(llm_conf, dict):
+        raise ValueError(f"Invalid LLM configuration for {config_key}: {llm_conf}")
+    merged_conf = {**llm_conf, **_get_env_llm_conf(llm_type)}
+    if not merged_conf:
+        raise ValueError(f"No configuration found for LLM type: {llm_type}")
+
+    from langchain_openai import ChatOpenAI  # 导入比较慢, 第一次创建模型时才导入
+    merged_conf.setdefault("temperature", 0)
+    if "max_retries" in merged_conf:
+        merged_conf["max_retries"] = int(merged_conf["max_retries"])
+    verify_ssl = merged_conf.pop("verify_ssl", True)
+    if str(verify_ssl).lower() in ("false", "0"):
+        import httpx
+        merged_conf["http_client"] = httpx.Client(verify=False)
+        merged_conf["http_async_client"] = httpx.AsyncClient(verify=False)
+    return ChatOpenAI(**merged_conf)
+
+
+def _has_config(llm_type: str, conf: dict[str, Any]) -> bool:
+    return bool(conf.get(_LLM_TYPE_CONFIG_KEYS[llm_type]) or _get_env_llm_conf(llm_type))
+
+
+def get_llm_by_type(llm_type: LLMType = "basic"):
     """
     Get LLM instance by type. Returns cached instance if available.
     """
     if llm_type in _llm_cache:
         return _llm_cache[llm_type]
+    with _lock:
+        if llm_type in _llm_cache:  # 等锁期间别的线程已经创建好了
+            return _llm_cache[llm_type]
+        conf = load_yaml_config(_get_config_file_path())
+        if llm_type in _FALLBACK_TYPES and not _has_config(llm_type, conf):
+            logger.info(f"{_LLM_TYPE_CONFIG_KEYS[llm_type]} is not configured, using {_FALLBACK_TYPES[llm_type]} model")
+            llm = _llm_cache.get(_FALLBACK_TYPES[llm_type]) or _create_llm_use_conf(_FALLBACK_TYPES[llm_type], conf)
+            _llm_cache[_FALLBACK_TYPES[llm_type]] = llm
+        else:
+            llm = _create_llm_use_conf(llm_type, conf)
+        _llm_cache[llm_type] = llm
+        return llm
+
 
-    conf = load_yaml_config(_get_config_file_path())
-    llm = _create_llm_use_conf(llm_type, conf)
-    _llm_cache[llm_type] = llm
-    return llm
+def clear_llm_cache():
+    """修改配置之后重新创建模型"""
+    with _lock:
+        _llm_cache.clear()
@@ -1,57 +1,271 @@
-import requests
+import asyncio
+import codecs
+import email.utils
 import json
+import logging
+import random
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm.provider.errors import APIConnectionError, APIStatusError, APITimeoutError, status_error
+from llm.provider.sse import SSEParser
+
+"""OpenAI 兼容接口的轻量客户端：
+- 同步请求共用一个带连接池的 requests.Session, 异步请求共用一个 httpx.AsyncClient, 连接保持 keep-alive, 不再每次都重新握手
+- 连接超时和读取超时分开配置
+- 429 和 5xx、连接失败、超时按带抖动的指数退避重试, 服务端返回 Retry-After 时按它等待
+- 失败时抛出 llm.provider.errors 里的具体异常类型
+- stream=True 时按 SSE 增量返回 chunk, 首个 token 到达就可以开始处理"""
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 60.0  # Retry-After 最多等待的秒数, 防止服务端给出一个特别长的值把调用方卡住
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    """Retry-After 可以是秒数也可以是 HTTP 日期"""
+    value = headers.get("retry-after") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 class CompatibleOpenAI:
-    def __init__(self, api_key, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"):
+    def __init__(self, api_key, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0, max_retries: int = 3,
+                 backoff_base: float = 0.5, max_backoff: float = 20.0, pool_maxsize: int = 32, verify_ssl: bool = True):
         self.api_key = api_key
-        self.base_url = base_url
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize  # 同一个服务商最多保持的连接数
+        self.verify_ssl = verify_ssl
+        self._session: Optional[requests.Session] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    @property
+    def session(self) -> requests.Session:
+        """第一次使用时创建, 之后所有同步请求复用同一个连接池"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update(self.headers)
+                    session.verify = self.verify_ssl
+                    self._session = session
+        return self._session
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """异步请求复用的连接池; httpx.AsyncClient 绑定创建它的事件循环, 换了事件循环需要先 aclose()"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers, verify=self.verify_ssl,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize),
+            )
+        return self._async_client
+
+    def _backoff(self, attempt: int, headers=None) -> float:
+        retry_after = _retry_after_seconds(headers)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+        return min(self.max_backoff, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _request(self, path: str, payload: dict, stream: bool = False) -> requests.Response:
+        """同步 POST, 失败时按配置重试; 流式请求只在收到响应头之前重试, 开始读取内容之后不再重发"""
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, json=payload, stream=stream,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except requests.Timeout as e:
+                error = APITimeoutError(f"请求超时: {e}")
+                headers = None
+            except requests.ConnectionError as e:
+                error = APIConnectionError(f"连接失败: {e}")
+                headers = None
+            else:
+                if response.status_code < 300:
+                    return response
+                error = status_error(response.status_code, response.headers, response.text)
+                headers = response.headers
+                response.close()
+            if not self._should_retry(error, attempt):
+                raise error
+            delay = self._backoff(attempt, headers)
+            logger.warning(f"{error}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    async def _arequest(self, path: str, payload: dict, stream: bool = False) -> httpx.Response:
+        """异步 POST, 重试逻辑和 _request 一致; stream=True 时调用方负责 aclose() 返回的响应"""
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            try:
+                request = self.async_client.build_request("POST", url, json=payload)
+                response = await self.async_client.send(request, stream=stream)
+            except httpx.TimeoutException as e:
+                error = APITimeoutError(f"请求超时: {e!r}")
+                headers = None
+            except httpx.TransportError as e:
+                error = APIConnectionError(f"连接失败: {e!r}")
+                headers = None
+            else:
+                if response.status_code < 300:
+                    return response
+                await response.aread()
+                await response.aclose()
+                error = status_error(response.status_code, response.headers, response.text)
+                headers = response.headers
+            if not self._should_retry(error, attempt):
+                raise error
+            delay = self._backoff(attempt, headers)
+            logger.warning(f"{error}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def post(self, path: str, payload: dict) -> dict:
+        return self._request(path, payload).json()
+
+    async def apost(self, path: str, payload: dict) -> dict:
+        return (await self._arequest(path, payload)).json()
+
+    def post_stream(self, path: str, payload: dict) -> Iterator[dict]:
+        """流式 POST: 逐个产出 SSE 里的 JSON chunk, 收到 [DONE] 结束"""
+        response = self._request(path, payload, stream=True)
+        parser = SSEParser()
+        try:
+            # SSE 规定使用 UTF-8; 增量解码, 多字节字符被拆在两个数据块里也不会乱码
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            for data in response.iter_content(chunk_size=None):
+                for event in parser.feed(decoder.decode(data)):
+                    if event.data == "[DONE]":
+                        return
+                    yield json.loads(event.data)
+            for event in parser.close():
+                if event.data != "[DONE]":
+                    yield json.loads(event.data)
+        except requests.RequestException as e:
+            raise APIConnectionError(f"读取流式响应失败: {e}") from e
+        finally:
+            response.close()
+
+    async def apost_stream(self, path: str, payload: dict) -> AsyncIterator[dict]:
+        """异步版本的 post_stream"""
+        response = await self._arequest(path, payload, stream=True)
+        parser = SSEParser()
+        try:
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            async for data in response.aiter_bytes():
+                for event in parser.feed(decoder.decode(data)):
+                    if event.data == "[DONE]":
+                        return
+                    yield json.loads(event.data)
+            for event in parser.close():
+                if event.data != "[DONE]":
+                    yield json.loads(event.data)
+        except httpx.TimeoutException as e:
+            raise APITimeoutError(f"读取流式响应超时: {e!r}") from e
+        except httpx.TransportError as e:
+            raise APIConnectionError(f"读取流式响应失败: {e!r}") from e
+        finally:
+            await response.aclose()
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, APIStatusError):
+            return error.status_code in RETRY_STATUS_CODES
+        return isinstance(error, APIConnectionError)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
 
     class ChatCompletions:
         def __init__(self, client):
             self.client = client
 
-        def create(self, model, messages, **kwargs):
-            url = f"{self.client.base_url}/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.client.api_key}",
-                "Content-Type": "application/json"
-            }
+        def create(self, model, messages, stream: bool = False, **kwargs):
+            """stream=True 时返回 chunk 的迭代器, 每个 chunk 的 choices[0].delta 是增量内容"""
             data = {
                 "model": model,
                 "messages": messages,
                 **kwargs
             }
+            if stream:
+                return self.client.post_stream("/chat/completions", {**data, "stream": True})
+            return self.client.post("/chat/completions", data)
 
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise Exception(f"API请求失败: {response.status_code} - {response.text}")
+        async def acreate(self, model, messages, stream: bool = False, **kwargs):
+            """stream=True 时返回 chunk 的异步迭代器"""
+            data = {
+                "model": model,
+                "messages": messages,
+                **kwargs
+            }
+            if stream:
+                return self.client.apost_stream("/chat/completions", {**data, "stream": True})
+            return await self.client.apost("/chat/completions", data)
 
     @property
     def chat_completions(self):
         return self.ChatCompletions(self)
 
 
-# 使用方式与OpenAI SDK类似
-client = CompatibleOpenAI(api_key="xxxxx")
+if __name__ == "__main__":
+    # 使用方式与OpenAI SDK类似
+    client = CompatibleOpenAI(api_key="xxxxx")
 
-try:
-    completion = client.chat_completions.create(
-        model="qwen3-coder-plus",
-        messages=[
-            {'role': 'system', 'content': 'You are a helpful assistant.'},
-            {'role': 'user',
-             'content': '请编写一个Python函数 find_prime_numbers，该函数接受一个整数 n 作为参数，并返回一个包含所有小于 n 的质数（素数）的列表。'}
-        ]
-    )
+    try:
+        completion = client.chat_completions.create(
+            model="qwen3-coder-plus",
+            messages=[
+                {'role': 'system', 'content': 'You are a helpful assistant.'},
+                {'role': 'user',
+                 'content': '请编写一个Python函数 find_prime_numbers，该函数接受一个整数 n 作为参数，并返回一个包含所有小于 n 的质数（素数）的列表。'}
+            ]
+        )
 
-    print("=" * 20 + "回复内容" + "=" * 20)
-    print(completion['choices'][0]['message']['content'])
-    print("=" * 20 + "Token消耗" + "=" * 20)
-    print(completion['usage'])
+        print("=" * 20 + "回复内容" + "=" * 20)
+        print(completion['choices'][0]['message']['content'])
+        print("=" * 20 + "Token消耗" + "=" * 20)
+        print(completion['usage'])
 
-except Exception as e:
-    print(f"发生错误: {e}")
+    except Exception as e:
+        print(f"发生错误: {e}")
+    finally:
+        client.close()
@@ -0,0 +1,67 @@
+from typing import Mapping, Optional
+
+"""provider 客户端的异常类型：调用方可以按类型区分 限流/鉴权/参数错误/服务端错误/网络错误，
+而不是只拿到一个带状态码文本的 Exception。带 HTTP 响应的异常都有 status_code 和 response.headers，
+和 openai/httpx 的异常一样可以直接交给 sql_graph.rate_limiter.is_rate_limited / retry_after 判断。"""
+
+
+class ProviderError(Exception):
+    """provider 客户端所有异常的基类"""
+
+
+class APIConnectionError(ProviderError):
+    """连接失败(DNS、拒绝连接、TLS握手失败等), 请求没有到达服务端"""
+
+
+class APITimeoutError(APIConnectionError):
+    """连接或者读取超时"""
+
+
+class _Response:
+    """只保留异常里用得到的响应信息, 不持有连接"""
+
+    def __init__(self, status_code: int, headers: Mapping[str, str], text: str):
+        self.status_code = status_code
+        self.headers = {k.lower(): v for k, v in headers.items()}
+        self.text = text
+
+
+class APIStatusError(ProviderError):
+    """服务端返回了非 2xx 状态码"""
+
+    def __init__(self, status_code: int, message: str, headers: Optional[Mapping[str, str]] = None, body: str = ""):
+        super().__init__(f"API请求失败: {status_code} - {message}")
+        self.status_code = status_code
+        self.body = body
+        self.response = _Response(status_code, headers or {}, body)
+
+
+class BadRequestError(APIStatusError):
+    """400/404/422: 参数或者模型名错误, 重试没有意义"""
+
+
+class AuthenticationError(APIStatusError):
+    """401/403: api_key 错误或者没有权限"""
+
+
+class RateLimitError(APIStatusError):
+    """429: 超出服务商的限流配额"""
+
+
+class InternalServerError(APIStatusError):
+    """5xx: 服务端错误, 通常可以重试"""
+
+
+def status_error(status_code: int, headers: Mapping[str, str], body: str) -> APIStatusError:
+    """按状态码构造对应类型的异常"""
+    if status_code == 429:
+        error_type = RateLimitError
+    elif status_code in (401, 403):
+        error_type = AuthenticationError
+    elif status_code >= 500:
+        error_type = InternalServerError
+    elif status_code in (400, 404, 422):
+        error_type = BadRequestError
+    else:
+        error_type = APIStatusError
+    return error_type(status_code, body[:500], headers, body)
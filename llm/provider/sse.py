@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+"""OpenAI 兼容接口流式输出(stream=True)的解析：SSEParser 增量解析 text/event-stream,
+网络上收到的数据块可以在任意位置被截断, 只有完整的事件才会被产出。
+工作流里按工具调用拼接流式分片由 LangChain 的 AIMessageChunk 完成, 见 text2sql_graph.generate_sql_query。"""
+
+
+@dataclass
+class SSEEvent:
+    data: str
+    event: Optional[str] = None
+    id: Optional[str] = None
+
+
+class SSEParser:
+    def __init__(self):
+        self._buffer = ""
+        self._data: list[str] = []
+        self._event: Optional[str] = None
+        self._id: Optional[str] = None
+
+    def feed(self, chunk: str) -> Iterator[SSEEvent]:
+        """喂入一段文本, 产出其中已经完整的事件; 不完整的行留在缓冲区等下一段"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line:
+                # 空行表示一个事件结束
+                if self._data:
+                    yield SSEEvent(data="\n".join(self._data), event=self._event, id=self._id)
+                self._data, self._event = [], None
+                continue
+            if line.startswith(":"):
+                continue  # 注释/心跳
+            name, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if name == "data":
+                self._data.append(value)
+            elif name == "event":
+                self._event = value
+            elif name == "id":
+                self._id = value
+
+    def close(self) -> Iterator[SSEEvent]:
+        """流结束时, 最后一个事件后面可能没有空行"""
+        yield from self.feed("\n\n")
+
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Union
+
+"""只读sqlite连接池：每个工作线程持有一个 mode=ro 的连接，查询放到有界线程池里执行，
+不再阻塞 FastMCP 的事件循环，多个客户端的 db_query_tool / get_list_table_tool 调用可以真正并行。
+每次调用由 QueryGuard 看管: 通过 sqlite 的进度回调检查截止时间和VM指令数, 读取结果时检查行数和字节数,
+调用方取消(客户端断开、调度器超时)时用 Connection.interrupt() 中断正在执行的语句, 一条失控的查询不会一直占着工作线程。"""
+
+MAX_STRING_LENGTH = 300  # 和 SQLDatabase.run 一样截断过长的字符串字段
+PROGRESS_INTERVAL = 1000  # 每执行这么多条VM指令调用一次进度回调
+_INTERRUPT_RE = re.compile(r"^Error: \((limit_exceeded|cancelled)\) (\w+)")
+_LIMIT_DESCRIPTIONS = {
+    "timeout": "执行时间超过 {} 秒",
+    "vm_steps": "执行的VM指令数超过 {}",
+    "rows": "读取的结果行数超过 {}",
+    "result_bytes": "结果大小超过 {} 字节",
+}
+_active = threading.local()  # 当前线程正在执行的调用的 QueryGuard
+
+
+@dataclass
+class QueryTiming:
+    queue_wait: float  # 提交到线程池到真正开始执行的等待时间
+    execution: float  # 在sqlite里执行的时间
+
+
+@dataclass(frozen=True)
+class QueryLimits:
+    """单次调用的资源上限, 0 表示不限制; 可以 pickle, 随任务一起发给查询工作进程"""
+    timeout: float = 0.0  # 从提交开始算的截止时间(秒), 包括排队时间
+    max_vm_steps: int = 0
+    max_rows: int = 0  # 读取的结果行数, 包括分页时跳过的行
+    max_result_bytes: int = 0  # 返回的结果行的大致字节数
+
+
+class QueryInterrupted(Exception):
+    """查询超过了资源上限(reason 是 QueryLimits 里对应的上限)或者被调用方取消(reason=cancelled)"""
+
+    def __init__(self, reason: str, limit: Any = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.limit = limit
+
+    def message(self, sql: str) -> str:
+        """结构化的报错: Error: (limit_exceeded) <上限>: 说明, 工作流用 interrupt_reason 识别"""
+        if self.reason == "cancelled":
+            return f"Error: (cancelled) cancelled: 查询已被取消\n[SQL: {sql}]"
+        description = _LIMIT_DESCRIPTIONS[self.reason].format(self.limit)
+        return (f"Error: (limit_exceeded) {self.reason}: {description}, 查询已被中断。"
+                f"请增加过滤条件、先聚合或者加上 LIMIT 缩小查询范围\n[SQL: {sql}]")
+
+
+def interrupt_reason(text: str) -> Optional[str]:
+    """查询结果是 QueryInterrupted 的报错时返回原因(timeout / vm_steps / rows / result_bytes / cancelled), 否则为 None"""
+    match = _INTERRUPT_RE.match(text)
+    return match.group(2) if match else None
+
+
+def result_size(rows: list[tuple]) -> int:
+    """结果行的大致字节数: 字符串和二进制按长度, 其它值按 8 字节"""
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for row in rows for value in row)
+
+
+class QueryGuard:
+    """看管一次调用: run() 期间给连接装上进度回调, 每 PROGRESS_INTERVAL 条VM指令检查一次截止时间和指令数,
+    超过时让 sqlite 中断语句; cancel() 可以在其它线程调用, 立即中断正在执行的语句"""
+
+    def __init__(self, limits: QueryLimits, deadline: Optional[float] = None):
+        self.limits = limits
+        # time.monotonic() 的截止时间; 查询工作进程里执行时由前端进程在提交时算好传过来
+        self.deadline = deadline if deadline is not None or not limits.timeout else time.monotonic() + limits.timeout
+        self.steps = 0
+        self.rows = 0
+        self.result_bytes = 0
+        self.interrupted: Optional[QueryInterrupted] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _progress(self) -> int:
+        self.steps += PROGRESS_INTERVAL
+        if self.interrupted is None:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.interrupted = QueryInterrupted("timeout", self.limits.timeout)
+            elif self.limits.max_vm_steps and self.steps > self.limits.max_vm_steps:
+                self.interrupted = QueryInterrupted("vm_steps", self.limits.max_vm_steps)
+        return 1 if self.interrupted is not None else 0  # 返回非零时 sqlite 中断当前语句
+
+    def run(self, conn: sqlite3.Connection, func: Callable[..., Any], *args) -> Any:
+        """在当前线程里执行 func(conn, *args)"""
+        with self._lock:
+            if self.interrupted is not None and self.interrupted.reason == "cancelled":
+                raise self.interrupted  # 还没开始执行就被取消了
+            self._conn = conn
+        _active.guard = self
+        conn.set_progress_handler(self._progress, PROGRESS_INTERVAL)
+        try:
+            return func(conn, *args)
+        finally:
+            conn.set_progress_handler(None, 0)
+            _active.guard = None
+            with self._lock:
+                self._conn = None
+            if conn.in_transaction:  # 被中断的查询可能没有结束显式开启的读事务
+                conn.rollback()
+
+    def cancel(self):
+        with self._lock:
+            if self.interrupted is None:
+                self.interrupted = QueryInterrupted("cancelled")
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def count(self, rows: list[tuple], returned: bool = True):
+        """累计读取的行数和返回的字节数, 超过上限时抛出 QueryInterrupted"""
+        self.rows += len(rows)
+        if returned and self.limits.max_result_bytes:
+            self.result_bytes += result_size(rows)
+        if self.interrupted is None and self.limits.max_rows and self.rows > self.limits.max_rows:
+            self.interrupted = QueryInterrupted("rows", self.limits.max_rows)
+        elif self.interrupted is None and self.limits.max_result_bytes and \
+                self.result_bytes > self.limits.max_result_bytes:
+            self.interrupted = QueryInterrupted("result_bytes", self.limits.max_result_bytes)
+        if self.interrupted is not None:
+            raise self.interrupted
+
+
+def current_guard() -> Optional[QueryGuard]:
+    return getattr(_active, "guard", None)
+
+
+def _count(rows: list[tuple], returned: bool = True):
+    guard = current_guard()
+    if guard is not None:
+        guard.count(rows, returned)
+
+
+def _truncate(value: Any, length: int = MAX_STRING_LENGTH, suffix: str = "...") -> Any:
+    if not isinstance(value, str) or len(value) <= length:
+        return value
+    return value[: length - len(suffix)].rsplit(" ", 1)[0] + suffix
+
+
+def format_error(error: Exception, sql: str) -> str:
+    """错误信息格式和 SQLDatabase.run_no_throw 保持一致, 都以 Error: 开头; 被 QueryGuard 中断的查询返回结构化的报错"""
+    if isinstance(error, QueryInterrupted):
+        return error.message(sql)
+    guard = current_guard()
+    if guard is not None and guard.interrupted is not None and isinstance(error, sqlite3.OperationalError):
+        return guard.interrupted.message(sql)
+    return f"Error: ({type(error).__module__}.{type(error).__name__}) {error}\n[SQL: {sql}]"
+
+
+def format_rows(rows: list[tuple]) -> str:
+    """和 SQLDatabase.run 相同的结果格式: 元组列表的字符串, 没有结果时为空字符串"""
+    if not rows:
+        return ""
+    return str([tuple(_truncate(v) for v in row) for row in rows])
+
+
+def run_query(conn: sqlite3.Connection, sql: str) -> str:
+    """执行查询并返回和 SQLDatabase.run_no_throw 相同格式的字符串, 出错时不抛异常"""
+    try:
+        rows = conn.execute(sql).fetchall()
+        _count(rows)
+    except (sqlite3.Error, QueryInterrupted) as e:
+        return format_error(e, sql)
+    return format_rows(rows)
+
+
+def fetch_page(conn: sqlite3.Connection, sql: str, offset: int, limit: int) -> Union[tuple[list[tuple], bool], str]:
+    """只取 [offset, offset + limit) 这一页, 返回 (rows, 是否还有下一页); 出错时返回错误字符串。
+    用游标逐批跳过和读取, 内存里最多只有一页数据"""
+    try:
+        cursor = conn.execute(sql)
+    except sqlite3.Error as e:
+        return format_error(e, sql)
+    try:
+        skipped = 0
+        while skipped < offset:
+            batch = cursor.fetchmany(min(offset - skipped, 1000))
+            if not batch:
+                return [], False
+            _count(batch, returned=False)
+            skipped += len(batch)
+        rows = cursor.fetchmany(limit + 1)  # 多取一行用来判断是否还有下一页
+        _count(rows[:limit])
+    except (sqlite3.Error, QueryInterrupted) as e:
+        return format_error(e, sql)
+    finally:
+        cursor.close()
+    return rows[:limit], len(rows) > limit
+
+
+def stream_rows(conn: sqlite3.Connection, sql: str, chunk_size: int, max_rows: int,
+                emit: Callable[[list[tuple]], None]) -> Union[int, str]:
+    """按 chunk_size 分批读取结果并交给 emit 发送, 返回发送的总行数; 出错时返回错误字符串"""
+    try:
+        cursor = conn.execute(sql)
+    except sqlite3.Error as e:
+        return format_error(e, sql)
+    sent = 0
+    try:
+        while sent < max_rows:
+            rows = cursor.fetchmany(min(chunk_size, max_rows - sent))
+            if not rows:
+                break
+            _count(rows)
+            emit(rows)
+            sent += len(rows)
+    except (sqlite3.Error, QueryInterrupted) as e:
+        return format_error(e, sql)
+    finally:
+        cursor.close()
+    return sent
+
+
+def open_readonly(db_path: str) -> sqlite3.Connection:
+    """mode=ro 的只读连接, 连接池的工作线程和查询工作进程都用它"""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def list_tables(conn: sqlite3.Connection) -> list[str]:
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+class ReadOnlyPool:
+    def __init__(self, db_path: str, max_workers: int = 4, enable_wal: bool = True):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlite-ro")
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.total_queue_wait = 0.0
+        self.total_execution = 0.0
+        self.max_queue_wait = 0.0
+        self.max_execution = 0.0
+        self.logger = logging.getLogger(__name__)
+        if enable_wal:
+            self._enable_wal()
+
+    def _enable_wal(self):
+        """WAL 模式下读不阻塞写、写不阻塞读; journal_mode 是持久化在数据库文件里的, 只需要设置一次"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to enable WAL on {self.db_path}: {e}")
+
+    def connection(self) -> sqlite3.Connection:
+        """当前工作线程专属的只读连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_readonly(self.db_path)
+            self._local.conn = conn
+            with self._stats_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def run(self, func: Callable[..., Any], *args,
+                  limits: Optional[QueryLimits] = None) -> tuple[Any, QueryTiming]:
+        """在线程池里执行 func(conn, *args), 返回结果以及排队和执行各自的耗时; limits 是这次调用的资源上限"""
+        submitted = time.perf_counter()
+        guard = QueryGuard(limits or QueryLimits())
+
+        def call():
+            started = time.perf_counter()
+            result = guard.run(self.connection(), func, *args)
+            return result, started, time.perf_counter()
+
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except asyncio.CancelledError:
+            guard.cancel()  # 调用方已经不等结果了(客户端断开、调度器超时), 中断还在执行的语句, 让出工作线程
+            raise
+        timing = QueryTiming(queue_wait=started - submitted, execution=finished - started)
+        self._record(timing)
+        return result, timing
+
+    def _record(self, timing: QueryTiming):
+        with self._stats_lock:
+            self.calls += 1
+            self.total_queue_wait += timing.queue_wait
+            self.total_execution += timing.execution
+            self.max_queue_wait = max(self.max_queue_wait, timing.queue_wait)
+            self.max_execution = max(self.max_execution, timing.execution)
+        self.logger.debug(f"queue wait {timing.queue_wait * 1000:.2f}ms, execution {timing.execution * 1000:.2f}ms")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "pool_size": self.max_workers,
+                "calls": self.calls,
+                "avg_queue_wait_ms": self.total_queue_wait / self.calls * 1000 if self.calls else 0.0,
+                "max_queue_wait_ms": self.max_queue_wait * 1000,
+                "avg_execution_ms": self.total_execution / self.calls * 1000 if self.calls else 0.0,
+                "max_execution_ms": self.max_execution * 1000,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
@@ -1,19 +1,258 @@
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
 
-from langchain_community.utilities import SQLDatabase
 from mcp.server import FastMCP
-mcp_server = FastMCP(name='sql-mcp', instructions='我自己的MCP服务', port=8000)
-db = SQLDatabase.from_uri('sqlite:///../chinook.db')
+from mcp.server.fastmcp import Context
+from mcp.types import CallToolResult, TextContent
+from starlette.requests import Request
+from starlette.responses import Response
 
-@mcp_server.tool(name='get_list_table_tool', description='SQL数据库工具')
-def get_list_table_tool() -> str:
-    return ", ".join(db.get_usable_table_names())  #   ['emp': “这是一个员工表，”, '']
+from mcpserver.db_pool import (QueryInterrupted, QueryLimits, ReadOnlyPool, fetch_page, format_error, format_rows,
+                               interrupt_reason, list_tables, stream_rows)
+from mcpserver.metrics import CONTENT_TYPE, DB_TIME_META_KEY, MetricsRegistry
+from mcpserver.pagination import decode_cursor, encode_cursor
+from mcpserver.query_cache import QueryResultCache
+from mcpserver.worker_pool import ProcessQueryPool
 
+# sqlite数据库文件路径, 默认使用仓库根目录下的 chinook.db
+DB_PATH = os.getenv('SQLITE_DB_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chinook.db'))
+# 查询结果缓存的内存预算(字节)
+QUERY_CACHE_MAX_BYTES = int(os.getenv('QUERY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# 只读连接池大小, 也就是最多同时执行的查询数
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '4'))
+SQLITE_ENABLE_WAL = os.getenv('SQLITE_ENABLE_WAL', '1') == '1'
+# 多进程模式: 大于0时 db_query_tool 的查询分发给这么多个工作进程执行(每个进程一个只读连接), 重的分析查询可以用满多个核;
+# 流式查询仍然在本进程的只读连接池里执行
+SQLITE_WORKER_PROCESSES = int(os.getenv('SQLITE_WORKER_PROCESSES', '0'))
+# db_query_tool 默认每页行数和每页行数上限, 避免一个 SELECT * 把整张大表塞进大模型上下文
+DB_QUERY_PAGE_SIZE = int(os.getenv('DB_QUERY_PAGE_SIZE', '200'))
+DB_QUERY_MAX_PAGE_SIZE = int(os.getenv('DB_QUERY_MAX_PAGE_SIZE', '5000'))
+# 流式模式每批推送的行数和最多推送的行数
+DB_QUERY_STREAM_CHUNK_ROWS = int(os.getenv('DB_QUERY_STREAM_CHUNK_ROWS', '500'))
+DB_QUERY_STREAM_MAX_ROWS = int(os.getenv('DB_QUERY_STREAM_MAX_ROWS', '1000000'))
+# 单条查询的资源上限(0 表示不限制): 截止时间(秒, 包括排队时间)、VM指令数、读取的行数(包括分页跳过的行)、返回结果的字节数;
+# 超过时查询被中断, 返回以 Error: (limit_exceeded) 开头的报错。流式结果不在服务端累积, 不限制字节数, 截止时间包括等待客户端消费的时间
+DB_QUERY_TIMEOUT = float(os.getenv('DB_QUERY_TIMEOUT', '30'))
+DB_QUERY_MAX_VM_STEPS = int(os.getenv('DB_QUERY_MAX_VM_STEPS', '2000000000'))
+DB_QUERY_MAX_ROWS = int(os.getenv('DB_QUERY_MAX_ROWS', '1000000'))
+DB_QUERY_MAX_RESULT_BYTES = int(os.getenv('DB_QUERY_MAX_RESULT_BYTES', str(32 * 1024 * 1024)))
+# db_query_batch_tool 一次最多执行的查询数
+DB_QUERY_BATCH_MAX_SIZE = int(os.getenv('DB_QUERY_BATCH_MAX_SIZE', '32'))
+# SSE 模式监听的端口, 以及 FastMCP 配置的日志级别(工作流在进程内调用或者以 stdio 子进程启动时用 WARNING)
+MCP_SERVER_PORT = int(os.getenv('MCP_SERVER_PORT', '8000'))
+MCP_LOG_LEVEL = os.getenv('MCP_LOG_LEVEL', 'INFO')
+# 指标: 为 1 时在 /metrics 输出 Prometheus 指标, 并且在工具调用结果的 _meta 里带上这次调用的数据库耗时,
+# 客户端用它把工具调用的耗时拆分成传输时间和数据库时间; 关闭时工具直接返回文本, 没有额外开销
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', '0') == '1'
 
-@mcp_server.tool(name='db_query_tool', description='执行sql查询query,返回结果')
-def db_query_tool(query:str) -> str:
+mcp_server = FastMCP(name='sql-mcp', instructions='我自己的MCP服务', port=MCP_SERVER_PORT, log_level=MCP_LOG_LEVEL)
+QUERY_LIMITS = QueryLimits(timeout=DB_QUERY_TIMEOUT, max_vm_steps=DB_QUERY_MAX_VM_STEPS, max_rows=DB_QUERY_MAX_ROWS,
+                           max_result_bytes=DB_QUERY_MAX_RESULT_BYTES)
+_db_seconds: ContextVar[Optional[list[float]]] = ContextVar('db_seconds', default=None)  # 当前工具调用累计的数据库耗时
+
+
+@lru_cache(maxsize=1)
+def get_db_pool() -> ReadOnlyPool:
+    """只读连接池, 第一次执行查询时才创建, 导入模块时不打开数据库"""
+    return ReadOnlyPool(DB_PATH, max_workers=SQLITE_POOL_SIZE, enable_wal=SQLITE_ENABLE_WAL)
+
+
+@lru_cache(maxsize=1)
+def get_worker_pool() -> Optional[ProcessQueryPool]:
+    """查询工作进程池, 没有开启多进程模式时为 None"""
+    if SQLITE_WORKER_PROCESSES <= 0:
+        return None
+    get_db_pool()  # 由本进程的连接池负责开启 WAL
+    return ProcessQueryPool(DB_PATH, processes=SQLITE_WORKER_PROCESSES)
+
+
+@lru_cache(maxsize=1)
+def get_query_cache() -> QueryResultCache:
+    """查询结果缓存, 第一次执行查询时才创建"""
+    return QueryResultCache(DB_PATH, max_bytes=QUERY_CACHE_MAX_BYTES)
+
+
+@lru_cache(maxsize=1)
+def get_metrics() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+async def run_db(func, *args, key: Optional[str] = None, limits: Optional[QueryLimits] = None):
+    """执行 func(conn, *args): 传了 key(一般是SQL)并且开启了多进程模式时发给查询工作进程, 否则在只读连接池里执行;
+    limits 是这次调用的资源上限。打开指标时记录排队和执行时间、被中断的查询, 并计入当前工具调用的数据库耗时"""
+    workers = get_worker_pool() if key is not None else None
+    try:
+        if workers is not None:
+            result, timing = await workers.run(func, *args, key=key, limits=limits)
+        else:
+            result, timing = await get_db_pool().run(func, *args, limits=limits)
+    except QueryInterrupted as e:  # 工作进程过了截止时间还没有响应中断, 已经被结束
+        result, timing = format_error(e, key or ""), None
+    if TELEMETRY_ENABLED and isinstance(result, str) and (reason := interrupt_reason(result)):
+        get_metrics().counter('sql_mcp_query_interrupted_total', '超过资源上限或者被取消而中断的查询数').inc(reason=reason)
+    if TELEMETRY_ENABLED and timing is not None:
+        db_seconds = get_metrics().histogram('sql_mcp_db_seconds', '只读连接池里排队和执行的时间')
+        db_seconds.observe(timing.queue_wait, phase='queue')
+        db_seconds.observe(timing.execution, phase='execution')
+        spent = _db_seconds.get()
+        if spent is not None:
+            spent[0] += timing.queue_wait + timing.execution
+    return result, timing
+
+
+def _record_cache(hit: bool):
+    if TELEMETRY_ENABLED:
+        get_metrics().counter('sql_mcp_query_cache_requests_total', '查询结果缓存的命中和未命中次数').inc(
+            result='hit' if hit else 'miss')
+
+
+def report_db_time(func):
+    """打开指标时记录工具的执行时间, 并把数据库耗时放进结果的 _meta; 结构化结果和原来自动生成的一样"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not TELEMETRY_ENABLED:
+            return await func(*args, **kwargs)
+        token = _db_seconds.set([0.0])
+        start_time = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+            db_seconds = _db_seconds.get()[0]
+        finally:
+            _db_seconds.reset(token)
+        get_metrics().histogram('sql_mcp_tool_seconds', '服务端处理工具调用的时间').observe(
+            time.perf_counter() - start_time, tool=func.__name__)
+        return CallToolResult(content=[TextContent(type='text', text=result)], structuredContent={'result': result},
+                              _meta={DB_TIME_META_KEY: db_seconds})
+    return wrapper
+
+
+def mcp_tool(name: str, description: str):
+    """注册MCP工具: 注册的是 report_db_time 包装后的函数, 模块里的函数保持原样, 进程内可以直接调用"""
+    def decorator(func):
+        mcp_server.tool(name=name, description=description)(report_db_time(func))
+        return func
+    return decorator
+
+
+@mcp_server.custom_route('/metrics', methods=['GET'])
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(get_metrics().render(), media_type=CONTENT_TYPE)
+
+
+@mcp_tool(name='get_list_table_tool', description='SQL数据库工具')
+async def get_list_table_tool() -> str:
+    tables, _ = await run_db(list_tables)
+    return ", ".join(tables)  #   ['emp': “这是一个员工表，”, '']
+
+
+@mcp_tool(name='db_query_tool',
+                 description='执行sql查询query,返回结果。结果较多时分页返回: limit 指定每页行数, 把上一页返回的 cursor 传回来获取下一页; '
+                             'stream=True 时通过进度通知分批推送结果')
+async def db_query_tool(query:str, limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False,
+                        ctx: Optional[Context] = None) -> str:
     """执行sql查询query,返回结果"""
-    result = db.run_no_throw(query)  # 执行查询（不抛出异常）
-    if result is None:
-        return "没有查询结果"
+    offset = 0
+    if cursor:
+        try:
+            page = decode_cursor(cursor)
+        except ValueError:
+            return "Error: 无效的 cursor"
+        if page["data"] != get_query_cache().data_token():
+            return "Error: 数据已经发生变化, cursor 已失效, 请重新查询"
+        query, offset, limit = page["sql"], page["offset"], page["limit"]
+    stream_max_rows = limit or DB_QUERY_STREAM_MAX_ROWS
+    limit = max(1, min(limit or DB_QUERY_PAGE_SIZE, DB_QUERY_MAX_PAGE_SIZE))
+
+    if stream and ctx is not None and ctx.request_context.meta and ctx.request_context.meta.progressToken is not None:
+        return await _stream_query(query, stream_max_rows, ctx)
+
+    variant = f"{offset}:{limit}"
+    cached = get_query_cache().get(query, variant)  # 只读查询先查结果缓存, 数据变化后缓存自动失效
+    _record_cache(cached is not None)
+    if cached is not None:
+        return cached
+    data_token = get_query_cache().data_token()
+    # 在只读连接池的线程里执行, 不阻塞事件循环, 并且只读取当前这一页（不抛出异常）
+    page, _ = await run_db(fetch_page, query, offset, limit, key=query, limits=QUERY_LIMITS)
+    if isinstance(page, str):
+        return page
+    rows, has_more = page
+    result = format_rows(rows)
+    if has_more:
+        next_cursor = encode_cursor(query, offset + limit, limit, data_token)
+        result += f'\n[本页返回 {len(rows)} 行, 还有更多结果, 使用 cursor="{next_cursor}" 获取下一页]'
+    get_query_cache().put(query, result, data_token, variant)
     return result
 
+
+async def _stream_query(query: str, max_rows: int, ctx: Context) -> str:
+    """边读边推: 读取线程每读到一批行就放进有界队列, 由事件循环通过进度通知发给客户端, 服务端不保存完整结果"""
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=4)  # 客户端消费慢时读取线程会在这里等待, 形成背压
+    aborted = threading.Event()
+
+    def emit(rows: list[tuple]):
+        if aborted.is_set():
+            raise RuntimeError("stream aborted")
+        asyncio.run_coroutine_threadsafe(chunks.put(rows), loop).result()
+
+    async def produce():
+        try:
+            result, _ = await run_db(stream_rows, query, DB_QUERY_STREAM_CHUNK_ROWS, max_rows, emit,
+                                     limits=dataclasses.replace(QUERY_LIMITS, max_result_bytes=0))
+            return result
+        finally:
+            await chunks.put(None)
+
+    producer = asyncio.create_task(produce())
+    batches = 0
+    try:
+        sent = 0
+        while (rows := await chunks.get()) is not None:
+            sent += len(rows)
+            batches += 1
+            await ctx.report_progress(progress=sent, message=format_rows(rows))
+        result = await producer
+    finally:
+        if not producer.done():  # 推送失败(比如客户端断开)时让读取线程尽快退出
+            aborted.set()
+            while not chunks.empty():
+                chunks.get_nowait()
+            with contextlib.suppress(Exception):
+                await producer
+    if isinstance(result, str):
+        return result
+    return f"已通过进度通知分 {batches} 批推送 {result} 行结果"
+
+
+@mcp_tool(name='db_query_batch_tool',
+          description='一次执行多条sql查询, 返回和 queries 顺序一致的JSON数组, 每一项和 db_query_tool 的结果相同; '
+                      '多条相互独立的查询只需要一次往返')
+async def db_query_batch_tool(queries: list[str], limit: Optional[int] = None) -> str:
+    """批量查询在只读连接池里并发执行, 各自走结果缓存和分页"""
+    if len(queries) > DB_QUERY_BATCH_MAX_SIZE:
+        return f"Error: 一次最多执行 {DB_QUERY_BATCH_MAX_SIZE} 条查询"
+    results = await asyncio.gather(*(db_query_tool(query, limit) for query in queries))
+    return json.dumps(results, ensure_ascii=False)
+
+
+@mcp_server.tool(name='query_cache_stats_tool', description='查看查询结果缓存的命中率、占用字节数等统计信息')
+def query_cache_stats_tool() -> str:
+    return json.dumps(get_query_cache().stats(), ensure_ascii=False)
+
+
+@mcp_server.tool(name='db_pool_stats_tool', description='查看只读连接池(多进程模式下还有各查询工作进程)的排队等待时间和执行时间统计')
+def db_pool_stats_tool() -> str:
+    stats = get_db_pool().stats()
+    if get_worker_pool() is not None:
+        stats["workers"] = get_worker_pool().stats()
+    return json.dumps(stats, ensure_ascii=False)
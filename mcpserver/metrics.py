@@ -0,0 +1,103 @@
+import math
+import threading
+from typing import Optional
+
+"""进程内的指标注册表, 按 Prometheus 文本格式输出, 给 /metrics 接口使用(没有依赖 prometheus_client)。
+只有计数器和直方图两种指标, 标签按关键字参数传入; MCP服务和工作流进程各自有一个注册表。"""
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DB_TIME_META_KEY = "sql-mcp/db_seconds"  # 工具调用结果 _meta 里的数据库耗时(秒), 客户端用它区分传输时间和数据库时间
+
+
+def _labels_text(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, lock: threading.Lock):
+        self.name = name
+        self.documentation = documentation
+        self._lock = lock
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines.extend(f"{self.name}{_labels_text(key)} {_number(value)}" for key, value in sorted(self._values.items()))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, lock: threading.Lock, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._lock = lock
+        self._values: dict[tuple, list[float]] = {}  # 标签 -> 每个桶的计数(不累加) + [总和, 次数]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(tuple(sorted(labels.items())))
+        return int(counts[-1]) if counts else 0
+
+    def sum(self, **labels) -> float:
+        counts = self._values.get(tuple(sorted(labels.items())))
+        return counts[-2] if counts else 0.0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in sorted(self._values.items())]
+        for key, counts in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels_text(key, ('le', _number(bound)))} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels_text(key)} {_number(counts[-2])}")
+            lines.append(f"{self.name}_count{_labels_text(key)} {_number(counts[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, self._lock))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, self._lock, buckets))
+
+    def render(self) -> str:
+        """Prometheus 文本格式(text/plain; version=0.0.4)"""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
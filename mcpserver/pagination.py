@@ -0,0 +1,24 @@
+import base64
+import json
+
+"""db_query_tool 的分页游标：把SQL、偏移量、每页行数和数据版本编码成一个不透明的字符串。
+客户端只需要把上一页返回的 cursor 原样传回来就能取下一页，数据发生变化后旧游标自动失效。"""
+
+
+def encode_cursor(sql: str, offset: int, limit: int, data_token: tuple) -> str:
+    payload = {"sql": sql, "offset": offset, "limit": limit, "data": list(data_token)}
+    return base64.urlsafe_b64encode(json.dumps(payload, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """解析游标, 格式不对时抛出 ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return {
+            "sql": str(payload["sql"]),
+            "offset": int(payload["offset"]),
+            "limit": int(payload["limit"]),
+            "data": tuple(payload["data"]),
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
@@ -0,0 +1,138 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+"""db_query_tool 的查询结果缓存：以规范化后的SQL文本为键，只缓存只读的SELECT。
+PRAGMA data_version 或数据库文件的 mtime 变化时自动整体失效；按结果的总字节数而不是条目数淘汰，
+这样一个很大的结果也不会撑爆内存预算。"""
+
+# 字符串常量和带引号的标识符原样保留, 其余部分统一小写并压缩空白
+_SQL_TOKEN_RE = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/|[^'"`\[\-/]+|.""",
+    re.S,
+)
+_WRITE_KEYWORDS_RE = re.compile(
+    r"\b(insert|update|delete|replace|create|drop|alter|attach|detach|pragma|vacuum|reindex|analyze)\b")
+# 结果会随时间变化的函数, 即使是只读查询也不能缓存
+_VOLATILE_RE = re.compile(r"\b(random|randomblob|current_timestamp|current_date|current_time)\b|'now'")
+
+
+def canonicalize_sql(sql: str) -> str:
+    """去掉注释、压缩空白、统一关键字大小写、去掉末尾分号, 让等价的SQL文本得到相同的键"""
+    parts, code = [], []
+    for token in _SQL_TOKEN_RE.findall(sql):
+        if token.startswith(("--", "/*")):
+            code.append(" ")
+        elif token[0] in "'\"`[":
+            parts.append(re.sub(r"\s+", " ", "".join(code)))
+            parts.append(token)
+            code = []
+        else:
+            code.append(token.lower())
+    parts.append(re.sub(r"\s+", " ", "".join(code)))
+    return "".join(parts).strip().rstrip("; ").strip()
+
+
+def is_cacheable(canonical_sql: str) -> bool:
+    """只缓存单条只读查询; 字符串常量已经在检查前去掉, 避免 'delete' 这类值造成误判"""
+    code = re.sub(r"'(?:[^']|'')*'", "''", canonical_sql)
+    if not code.startswith(("select", "with", "values")) or ";" in code:
+        return False
+    return not _WRITE_KEYWORDS_RE.search(code) and not _VOLATILE_RE.search(code)
+
+
+class QueryResultCache:
+    def __init__(self, db_path: str, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: Optional[int] = None):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4  # 单个结果最多占用预算的四分之一
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # (规范化SQL, 分页等附加参数) -> (结果, 字节数)
+        self._entries: OrderedDict[tuple[str, str], tuple[str, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        # 专门用来读 data_version 的连接: 其它连接(包括其它进程)提交写入后, 这个值就会变化
+        self._version_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._data_token = self._current_data_token()
+
+    def _current_data_token(self) -> tuple:
+        stat = os.stat(self.db_path)
+        data_version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, stat.st_mtime_ns, stat.st_size
+
+    def _check_data_version(self):
+        """数据发生变化时清空全部缓存, 调用方需要持有锁"""
+        token = self._current_data_token()
+        if token != self._data_token:
+            self._data_token = token
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def get(self, sql: str, variant: str = "") -> Optional[str]:
+        """返回缓存的结果; 不可缓存的查询和未命中都返回 None。variant 用来区分同一条SQL的不同分页"""
+        canonical = canonicalize_sql(sql)
+        key = (canonical, variant)
+        if not is_cacheable(canonical):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        with self._lock:
+            self._check_data_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def data_token(self) -> tuple:
+        """执行查询前记下数据版本, put 时用来判断执行期间数据有没有变化"""
+        with self._lock:
+            self._check_data_version()
+            return self._data_token
+
+    def put(self, sql: str, result: str, data_token: Optional[tuple] = None, variant: str = ""):
+        canonical = canonicalize_sql(sql)
+        key = (canonical, variant)
+        size = len(result.encode("utf-8"))
+        if not is_cacheable(canonical) or size > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._check_data_version()
+            if data_token is not None and data_token != self._data_token:
+                return  # 执行期间数据发生了变化, 这个结果可能已经过期
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (result, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "data_version": self._data_token[0],
+            }
@@ -1,4 +1,4 @@
-from langchain_community.utilities import SQLDatabase
+import sys
 
 from mcpserver.mcp_tools import mcp_server
 
@@ -7,4 +7,5 @@ if __name__ == "__main__":
     # print(db.get_usable_table_names())
     #
     # res=db.run("SELECT * FROM artists LIMIT 10")
-    mcp_server.run (transport='sse')
\ No newline at end of file
+    # 用法: python -m mcpserver.start_server [sse|stdio], 默认 sse; 工作流以子进程方式启动时使用 stdio
+    mcp_server.run(transport=sys.argv[1] if len(sys.argv) > 1 else 'sse')
@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from mcpserver.db_pool import QueryGuard, QueryInterrupted, QueryLimits, QueryTiming, open_readonly
+
+"""多进程查询工作池：FastMCP 前端进程把 db_query_tool 的查询分发给 N 个工作进程, 每个进程持有自己的只读连接,
+分析型的重查询不再挤在一个进程里(把结果行转换成 Python 对象的部分要持有GIL)。
+- 分发: 发给排队任务最少的进程; 同一条SQL出现 HOT_QUERY_THRESHOLD 次以上后固定发给同一个进程,
+  复用那个连接里已经编译好的语句和缓存的数据页, 只有它比最空闲的进程多排队 AFFINITY_SLACK 个以上任务时才改发别的进程
+- 传输: 任务和结果都用最高协议 pickle 后通过管道收发, 工作进程只返回原始的结果行(元组列表), 格式化在前端进程里做
+- 工作进程意外退出时, 它上面的任务报错返回, 下一次分发时重新启动
+- 取消: 调用方取消时给工作进程发 cancel 消息, 工作进程的接收线程中断正在执行的语句或者跳过还在排队的任务;
+  截止时间过后 KILL_GRACE 秒还没有返回(语句卡在不检查中断的地方)的工作进程直接结束, 不会被一条查询一直占住
+工作进程用 spawn 方式启动, 不会从带着事件循环和线程的前端进程 fork。"""
+
+HOT_QUERY_THRESHOLD = 2
+AFFINITY_SLACK = 1
+MAX_TRACKED_QUERIES = 4096
+KILL_GRACE = 5.0
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(db_path: str, conn):
+    """工作进程: 接收线程把 run 任务放进队列、处理 cancel 消息, 主线程按顺序执行 func(db, *args) 并把结果发回前端进程"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C 由前端进程处理, 再由它关闭工作进程
+    db = open_readonly(db_path)
+    tasks: queue.Queue = queue.Queue()
+    lock = threading.Lock()
+    cancelled: set[int] = set()  # 还在排队时就被取消的任务
+    running: list = [None, None]  # 正在执行的 [task_id, QueryGuard]
+
+    def receive():
+        while True:
+            try:
+                message = pickle.loads(conn.recv_bytes())
+            except EOFError:
+                message = None
+            if message is None:
+                tasks.put(None)
+                return
+            if message[0] == "cancel":
+                with lock:
+                    task_id, guard = running
+                    if task_id == message[1]:
+                        guard.cancel()
+                    else:
+                        cancelled.add(message[1])
+            else:
+                tasks.put(message[1:])
+
+    threading.Thread(target=receive, name="receiver", daemon=True).start()
+    try:
+        while (task := tasks.get()) is not None:
+            task_id, func, args, limits, deadline = task
+            guard = QueryGuard(limits, deadline)
+            with lock:
+                if task_id in cancelled:
+                    guard.cancel()
+                # 任务按编号顺序执行, 更早的任务不会再出现
+                cancelled.difference_update([i for i in cancelled if i <= task_id])
+                running[:] = [task_id, guard]
+            started = time.monotonic()
+            try:
+                ok, result = True, guard.run(db, func, *args)
+            except Exception as e:
+                ok, result = False, f"{type(e).__name__}: {e}"
+            with lock:
+                running[:] = [None, None]
+            conn.send_bytes(pickle.dumps((task_id, ok, result, started, time.monotonic()),
+                                         protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        db.close()
+
+
+@dataclass
+class _Worker:
+    index: int
+    process: Any
+    conn: Any
+    send_lock: threading.Lock = field(default_factory=threading.Lock)
+    alive: bool = True
+    inflight: int = 0
+    calls: int = 0
+    pending: dict = field(default_factory=dict)  # task_id -> (future, loop, 提交时间)
+
+
+class ProcessQueryPool:
+    def __init__(self, db_path: str, processes: int = 4):
+        self.db_path = db_path
+        self.processes = processes
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()  # 保护各进程的 pending/inflight, 读取结果的线程也会修改
+        self._task_ids = itertools.count()
+        self._query_counts: OrderedDict[str, int] = OrderedDict()  # SQL -> 最近出现的次数
+        self._affinity: dict[str, int] = {}  # 热点SQL -> 固定的工作进程
+        self.calls = 0
+        self.affinity_hits = 0
+        self.result_bytes = 0
+        self.total_queue_wait = 0.0
+        self.total_execution = 0.0
+        self.max_queue_wait = 0.0
+        self.max_execution = 0.0
+        self._workers = [self._start_worker(i) for i in range(processes)]
+
+    def _start_worker(self, index: int) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(self.db_path, child_conn),
+                                        name=f"sqlite-worker-{index}", daemon=True)
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+        threading.Thread(target=self._read_results, args=(worker,), name=f"sqlite-worker-{index}-reader",
+                         daemon=True).start()
+        return worker
+
+    def _read_results(self, worker: _Worker):
+        """每个工作进程一个读取线程, 收到结果后交给提交任务的事件循环"""
+        while True:
+            try:
+                data = worker.conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            task_id, ok, result, started, finished = pickle.loads(data)
+            with self._lock:
+                self.result_bytes += len(data)
+                future, loop, submitted = worker.pending.pop(task_id, (None, None, None))
+                worker.inflight -= 1
+            if future is not None:
+                timing = QueryTiming(queue_wait=max(0.0, started - submitted), execution=finished - started)
+                loop.call_soon_threadsafe(self._resolve, future, ok, result, timing)
+        with self._lock:
+            worker.alive = False
+            pending, worker.pending, worker.inflight = worker.pending, {}, 0
+        if pending:
+            logger.warning(f"Query worker {worker.index} exited with {len(pending)} pending queries")
+        for future, loop, _ in pending.values():
+            loop.call_soon_threadsafe(self._resolve, future, False, f"query worker {worker.index} exited", None)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, result: Any, timing: Optional[QueryTiming]):
+        if future.done():  # 调用方已经取消
+            return
+        if ok:
+            future.set_result((result, timing))
+        else:
+            future.set_exception(RuntimeError(result))
+
+    def _choose(self, key: Optional[str]) -> _Worker:
+        """最空闲的进程, 热点查询优先发给固定的进程; 调用时持有 self._lock"""
+        for i, worker in enumerate(self._workers):
+            if not worker.alive:
+                worker.conn.close()
+                self._workers[i] = self._start_worker(i)
+        least = min(self._workers, key=lambda w: (w.inflight, w.calls))
+        if key is None:
+            return least
+        count = self._query_counts.pop(key, 0) + 1
+        self._query_counts[key] = count
+        if len(self._query_counts) > MAX_TRACKED_QUERIES:
+            evicted, _ = self._query_counts.popitem(last=False)
+            self._affinity.pop(evicted, None)
+        owner = self._affinity.get(key)
+        if owner is not None and self._workers[owner].inflight <= least.inflight + AFFINITY_SLACK:
+            self.affinity_hits += 1
+            return self._workers[owner]
+        if count >= HOT_QUERY_THRESHOLD:
+            self._affinity[key] = least.index
+        return least
+
+    def _send(self, worker: _Worker, message: tuple):
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        with worker.send_lock:  # 同一个管道可能有多个线程里的事件循环在发送
+            worker.conn.send_bytes(data)
+
+    async def run(self, func: Callable[..., Any], *args, key: Optional[str] = None,
+                  limits: Optional[QueryLimits] = None) -> tuple[Any, QueryTiming]:
+        """在工作进程里执行 func(conn, *args); func 必须是模块级函数, 参数和结果都要能 pickle; key 一般是SQL本身。
+        截止时间过后 KILL_GRACE 秒还没有结果时结束这个工作进程并抛出 QueryInterrupted"""
+        limits = limits or QueryLimits()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        submitted = time.monotonic()
+        deadline = submitted + limits.timeout if limits.timeout else None
+        with self._lock:
+            worker = self._choose(key)
+            task_id = next(self._task_ids)
+            worker.pending[task_id] = (future, loop, submitted)
+            worker.inflight += 1
+            worker.calls += 1
+        try:
+            self._send(worker, ("run", task_id, func, args, limits, deadline))
+        except OSError as e:
+            with self._lock:
+                worker.pending.pop(task_id, None)
+                worker.inflight -= 1
+            raise RuntimeError(f"query worker {worker.index} is not available: {e}") from e
+        try:
+            if deadline is None:
+                result, timing = await future
+            else:
+                result, timing = await asyncio.wait_for(asyncio.shield(future), deadline - time.monotonic() + KILL_GRACE)
+        except asyncio.CancelledError:
+            future.cancel()  # 结果回来时直接丢掉
+            with contextlib.suppress(OSError):
+                self._send(worker, ("cancel", task_id))
+            raise
+        except asyncio.TimeoutError:
+            future.cancel()
+            logger.warning(f"Query worker {worker.index} did not stop {KILL_GRACE}s after the deadline, killing it")
+            with self._lock:
+                worker.alive = False  # 下一次分发时重新启动
+            worker.process.kill()  # 读取线程收到 EOF 后让这个进程上的其它任务报错返回
+            raise QueryInterrupted("timeout", limits.timeout) from None
+        with self._lock:
+            self.calls += 1
+            self.total_queue_wait += timing.queue_wait
+            self.total_execution += timing.execution
+            self.max_queue_wait = max(self.max_queue_wait, timing.queue_wait)
+            self.max_execution = max(self.max_execution, timing.execution)
+        return result, timing
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "calls": self.calls,
+                "calls_per_worker": [worker.calls for worker in self._workers],
+                "affinity_hits": self.affinity_hits,
+                "hot_queries": len(self._affinity),
+                "avg_result_bytes": self.result_bytes / self.calls if self.calls else 0.0,
+                "avg_queue_wait_ms": self.total_queue_wait / self.calls * 1000 if self.calls else 0.0,
+                "max_queue_wait_ms": self.max_queue_wait * 1000,
+                "avg_execution_ms": self.total_execution / self.calls * 1000 if self.calls else 0.0,
+                "max_execution_ms": self.max_execution * 1000,
+            }
+
+    def close(self):
+        for worker in self._workers:
+            with contextlib.suppress(OSError):
+                self._send(worker, None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
@@ -1,19 +1,25 @@
 import asyncio
+import itertools
 import logging
-from typing import List, Callable, Any, Optional
+import math
+from typing import List, Callable, Any, Optional, AsyncIterable, AsyncIterator, Iterable, Union
 from dataclasses import dataclass
 from enum import Enum
 import time
 
+from sql_graph.rate_limiter import AdaptiveLimiter, KeyedRateLimiter, backoff_delay, is_rate_limited, retry_after
+from sql_graph.telemetry import record_retry
+
 """“在Agent系统中，经常需要处理大量异步任务（如并行调用多个工具或模型）。请用你熟悉的语言（Python/Go/Java）伪代码实现一个简单的异步任务调度器，它可以并发执行多个任务，并收集所有结果。你会考虑哪些关键点来保证系统的健壮性和效率"""
 class TaskStatus(Enum):
     PENDING = "pending"
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
-@dataclass
+@dataclass(slots=True)  # __slots__ 去掉每个实例的 __dict__, 十万级任务时每个结果能省下不少内存
 class TaskResult:
     task_id: str
     status: TaskStatus
@@ -23,9 +29,24 @@ class TaskResult:
 
 
 class AsyncTaskScheduler:
-    def __init__(self, max_concurrent_tasks: int = 10, timeout: float = 30.0):
-        self.max_concurrent_tasks = max_concurrent_tasks
+    def __init__(self, max_concurrent_tasks: int = 10, timeout: float = 30.0, queue_size: Optional[int] = None,
+                 limiter: Optional[AdaptiveLimiter] = None, rate_limiter: Optional[KeyedRateLimiter] = None,
+                 rate_limit_key: str = "default", token_estimator: Optional[Callable[..., int]] = None,
+                 max_rate_limit_retries: int = 5):
+        # 传入 limiter 时由它按延迟和超时率自动调整并发数, max_concurrent_tasks 只作为上限
+        self.max_concurrent_tasks = limiter.max_limit if limiter else max_concurrent_tasks
         self.timeout = timeout
+        self.limiter = limiter
+        # 按 rate_limit_key 限制 请求数/秒 和 token数/分钟; token_estimator(*args, **kwargs) 估算一个任务消耗的 token 数
+        self.rate_limiter = rate_limiter
+        self.rate_limit_key = rate_limit_key
+        self.token_estimator = token_estimator
+        self.max_rate_limit_retries = max_rate_limit_retries  # 收到 429 时退避重试的次数, 不算作任务失败
+        # 工作池模式下等待执行的任务队列和结果队列的容量, 队列满了提交方就会等待(背压)
+        self.queue_size = queue_size or max_concurrent_tasks * 2
+        self._running: dict[str, asyncio.Task] = {}  # 工作池模式下正在执行的任务
+        self._queued: set[str] = set()  # 工作池模式下还在队列里排队的任务
+        self._cancelled: set[str] = set()  # 还在队列里就被取消的任务, 只会是 _queued 的子集
         #  创建信号量 # 控制并发数量  主要在使用协程时，限制并发数量，避免同时执行过多任务导致资源消耗过多，那这个信号量就起作用了，那这个max_concurrent_tasks参数就是用来控制并发数量，如果max_concurrent_tasks的值为10，则表示最多允许同时执行10个任务。
         # 这样可以防止系统过载，提高系统的稳定性和响应速度。
         # 信号量的作用是限制并发数量，当并发数量达到最大值时，新的任务会被阻塞，直到有任务完成或者超时。
@@ -35,7 +56,7 @@ class AsyncTaskScheduler:
         # 如果一个任务需要5秒才能完成，而系统资源有4个CPU核，则max_concurrent_tasks的值可以设置为4，这样最多只能同时执行4个任务。
         # 一般企业中例如豆包产品的max_concurrent_tasks的值设置为10-20之间，这样可以保证系统的稳定性和响应速度，同时也能满足大部分任务的处理需求。
         #
-        self.semaphore = asyncio.Semaphore(max_concurrent_tasks)
+        self.semaphore = asyncio.Semaphore(self.max_concurrent_tasks)
         self.logger = logging.getLogger(__name__)
 
     async def execute_task(self, task_id: str, task_func: Callable, *args, **kwargs) -> TaskResult:
@@ -43,22 +64,32 @@ class AsyncTaskScheduler:
         执行单个异步任务
         """
         start_time = time.time()
+        tokens = self.token_estimator(*args, **kwargs) if self.token_estimator else 0
+        attempt = 0
         try:
-            async with self.semaphore:  # 控制并发数量
-                self.logger.info(f"Starting task {task_id}")
-                # 设置任务超时
-                result = await asyncio.wait_for(
-                    task_func(*args, **kwargs),
-                    timeout=self.timeout
-                )
-                execution_time = time.time() - start_time
-                self.logger.info(f"Task {task_id} completed successfully")
-                return TaskResult(
-                    task_id=task_id,
-                    status=TaskStatus.COMPLETED,
-                    result=result,
-                    execution_time=execution_time
-                )
+            while True:
+                try:
+                    result = await self._run_attempt(task_id, task_func, tokens, args, kwargs)
+                    break
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt >= self.max_rate_limit_retries:
+                        raise
+                    # 被限流(429)时按 Retry-After 或者指数退避等待, 期间同一个 key 的其它任务也一起暂停
+                    delay = retry_after(e) or backoff_delay(attempt)
+                    attempt += 1
+                    record_retry("rate_limit")
+                    self.logger.warning(f"Task {task_id} rate limited, retrying in {delay:.1f}s (attempt {attempt})")
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.penalize(self.rate_limit_key, delay)
+                    await asyncio.sleep(delay)
+            execution_time = time.time() - start_time
+            self.logger.info(f"Task {task_id} completed successfully")
+            return TaskResult(
+                task_id=task_id,
+                status=TaskStatus.COMPLETED,
+                result=result,
+                execution_time=execution_time
+            )
         except asyncio.TimeoutError:
             execution_time = time.time() - start_time
             error = TimeoutError(f"Task {task_id} timed out after {self.timeout} seconds")
@@ -79,6 +110,30 @@ class AsyncTaskScheduler:
                 execution_time=execution_time
             )
 
+    async def _run_attempt(self, task_id: str, task_func: Callable, tokens: int, args: tuple, kwargs: dict):
+        """先等待速率配额, 再占用一个并发名额执行一次任务"""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(self.rate_limit_key, tokens)
+        if self.limiter is None:
+            async with self.semaphore:  # 控制并发数量
+                self.logger.info(f"Starting task {task_id}")
+                # 设置任务超时
+                return await asyncio.wait_for(task_func(*args, **kwargs), timeout=self.timeout)
+        await self.limiter.acquire()
+        self.logger.info(f"Starting task {task_id}")
+        start_time = time.perf_counter()
+        latency, overloaded = None, False
+        try:
+            result = await asyncio.wait_for(task_func(*args, **kwargs), timeout=self.timeout)
+            latency = time.perf_counter() - start_time
+            return result
+        except Exception as e:
+            # 只有超时和限流说明下游过载, 其它错误(比如SQL写错)和并发数无关
+            overloaded = isinstance(e, asyncio.TimeoutError) or is_rate_limited(e)
+            raise
+        finally:
+            self.limiter.release(latency, overloaded)
+
     async def schedule_tasks(self, tasks: List[tuple]) -> List[TaskResult]:
         """
         并发调度多个任务
@@ -109,6 +164,98 @@ class AsyncTaskScheduler:
 
         return processed_results
 
+    async def stream_tasks(self, tasks: Union[Iterable[tuple], AsyncIterable[tuple]]) -> AsyncIterator[TaskResult]:
+        """
+        工作池模式: max_concurrent_tasks 个 worker 从有界优先级队列里取任务执行, 按完成顺序逐个产出结果
+        tasks: (task_id, task_func, args, kwargs) 或 (task_id, task_func, args, kwargs, priority), 可以是生成器/异步生成器
+        priority 越小越先执行, 默认 0; 只在队列里排队的任务之间生效
+        任务是边消费边读取的, 内存里最多只有 queue_size 个排队任务和 max_concurrent_tasks 个执行中的任务;
+        提前退出迭代时用 contextlib.aclosing 包一层, 退出时会取消所有未完成的任务
+        """
+        pending: asyncio.PriorityQueue = asyncio.PriorityQueue(self.queue_size)
+        results: asyncio.Queue = asyncio.Queue(self.queue_size)
+        sequence = itertools.count()  # 同优先级按提交顺序执行, 也避免比较任务本身
+
+        async def put(task: tuple):
+            await pending.put(((task[4] if len(task) > 4 else 0), next(sequence), task[:4]))
+            self._queued.add(task[0])
+
+        async def feed():
+            error = None
+            try:
+                if isinstance(tasks, AsyncIterable):
+                    async for task in tasks:
+                        await put(task)
+                else:
+                    for task in tasks:
+                        await put(task)
+            except Exception as e:
+                error = e
+            # 排在所有任务之后, 通知 worker 退出; 被取消时 worker 也会一起被取消, 走不到这里
+            for _ in range(self.max_concurrent_tasks):
+                await pending.put((math.inf, next(sequence), None))
+            if error is not None:
+                raise error
+
+        async def work():
+            while True:
+                _, _, task = await pending.get()
+                if task is None:
+                    break
+                task_id, task_func, args, kwargs = task
+                await results.put(await self._run_queued(task_id, task_func, args, kwargs))
+            await results.put(None)
+
+        feeder = asyncio.create_task(feed())
+        workers = [asyncio.create_task(work()) for _ in range(self.max_concurrent_tasks)]
+        try:
+            finished_workers = 0
+            while finished_workers < len(workers):
+                result = await results.get()
+                if result is None:
+                    finished_workers += 1
+                else:
+                    yield result
+            await feeder  # 任务生成器本身出错时把异常抛给调用方
+        finally:
+            for worker in [feeder, *workers]:
+                worker.cancel()
+            await asyncio.gather(feeder, *workers, return_exceptions=True)
+            while not pending.empty():  # 提前退出时没有执行的任务
+                _, _, task = pending.get_nowait()
+                if task is not None:
+                    self._queued.discard(task[0])
+                    self._cancelled.discard(task[0])
+
+    async def _run_queued(self, task_id: str, task_func: Callable, args: tuple, kwargs: dict) -> TaskResult:
+        self._queued.discard(task_id)
+        if task_id in self._cancelled:
+            self._cancelled.discard(task_id)
+            return TaskResult(task_id=task_id, status=TaskStatus.CANCELLED)
+        start_time = time.time()
+        task = asyncio.create_task(self.execute_task(task_id, task_func, *args, **kwargs))
+        self._running[task_id] = task
+        try:
+            await asyncio.wait([task])  # 任务被单独取消时不会抛到 worker 里
+        finally:
+            self._running.pop(task_id, None)
+            task.cancel()  # worker 自己被取消时连带取消任务, 任务已经结束时没有影响
+        if task.cancelled():
+            self.logger.info(f"Task {task_id} cancelled")
+            return TaskResult(task_id=task_id, status=TaskStatus.CANCELLED, execution_time=time.time() - start_time)
+        return task.result()
+
+    def cancel(self, task_id: str) -> bool:
+        """取消工作池模式下的任务: 执行中的立即取消, 还在排队的在轮到它时直接跳过; 两种情况都会产出 CANCELLED 结果。
+        不认识或者已经结束的任务返回 False, 不做记录"""
+        task = self._running.get(task_id)
+        if task is not None:
+            return task.cancel()
+        if task_id not in self._queued:
+            return False
+        self._cancelled.add(task_id)
+        return True
+
 
 # 使用示例
 async def sample_task(name: str, duration: float) -> str:
@@ -138,6 +285,11 @@ async def main():
         else:
             print(f"Task {result.task_id}: Failed - {result.error}")
 
+    # 工作池模式: 任务可以是生成器, 结果按完成顺序产出, 第五个元素是优先级(越小越先执行)
+    streaming_tasks = ((f"stream_{i}", sample_task, (f"Stream{i}", 0.1 * (i % 3)), {}, -i) for i in range(6))
+    async for result in scheduler.stream_tasks(streaming_tasks):
+        print(f"Task {result.task_id}: {result.status.value} - {result.result}")
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -1,55 +1,159 @@
-# 添加新的节点用于处理多个查询
-def execute_multiple_queries_parallel(state: SQLState):
-    """
-    并行执行多个 SQL 查询的节点
-    """
-    # 从状态中获取多个查询
-    queries = extract_multiple_queries_from_state(state)
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Optional
 
-    # 使用 AsyncTaskScheduler 并行执行
-    scheduler = AsyncTaskScheduler(max_concurrent_tasks=3)
+from langchain_core.messages import AIMessage, ToolMessage
 
-    tasks = [
-        (f"execute_query_{i}", execute_single_db_query, (query,), {})
-        for i, query in enumerate(queries)
-    ]
+from mcpserver.db_pool import QueryInterrupted, QueryLimits, ReadOnlyPool, fetch_page, format_rows
+from sql_graph.asyncTask import AsyncTaskScheduler, TaskStatus
+from sql_graph.env_utils import (MULTI_QUERY_MAX_ROWS, MULTI_QUERY_MAX_VM_STEPS, MULTI_QUERY_POOL_SIZE,
+                                 MULTI_QUERY_TIMEOUT, SQLITE_DB_PATH)
+from sql_graph.sql_state import SQLState
+from sql_graph.telemetry import record_retry
 
-    # 异步执行所有查询
-    results = await scheduler.schedule_tasks(tasks)
+"""多查询并行执行节点：大模型把复合问题（例如 "对比2012年和2013年各流派的销售额"）拆成多个相互独立的 db_query_tool 调用，
+这里用 AsyncTaskScheduler 把它们放到只读连接池的多个线程里同时执行，总耗时约等于最慢的那个子查询。
+每个子查询在自己的读事务里执行；通过 PRAGMA data_version 确认所有读事务建立之前和之后都没有写入提交，
+也就保证了所有子查询看到的是同一个数据库快照，否则重新执行一次。
+超时(包括调度器超时取消)或者超过VM指令数上限的子查询由连接池中断, 返回结构化的 limit_exceeded 报错。"""
 
-    # 处理结果并返回
-    return process_multiple_query_results(results)
+MAX_SNAPSHOT_RETRIES = 2  # 执行期间有写入时最多重新执行几次
+QUERY_LIMITS = QueryLimits(timeout=MULTI_QUERY_TIMEOUT, max_vm_steps=MULTI_QUERY_MAX_VM_STEPS)
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_query_pool() -> ReadOnlyPool:
+    """多查询节点专用的只读连接池; 工作流这一侧只读数据库, 不修改 journal_mode"""
+    return ReadOnlyPool(SQLITE_DB_PATH, max_workers=MULTI_QUERY_POOL_SIZE, enable_wal=False)
+
+
+class SnapshotBarrier:
+    """记录所有子查询的读事务都建立之后数据库的 data_version, 和开始前的比较就知道中间有没有写入提交"""
+
+    def __init__(self, db_path: str, count: int):
+        self.count = count
+        self.established = 0
+        self._lock = threading.Lock()
+        # data_version 只有其它连接提交时才会变化, 所以用一个单独的、从不写入的连接来读
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.before = self._data_version()
+        self.after: Optional[int] = None
+
+    def _data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def arrive(self):
+        with self._lock:
+            self.established += 1
+            if self.established == self.count:
+                self.after = self._data_version()
+
+    @property
+    def consistent(self) -> bool:
+        """有子查询没能建立读事务(比如排队超时)时 after 为空, 这时没有可比较的快照, 不算作数据变化"""
+        return self.after is None or self.after == self.before
 
+    def close(self):
+        self._conn.close()
 
-async def execute_single_db_query(query):
+
+def extract_multiple_queries_from_state(state: SQLState) -> list[dict]:
+    """最后一条AI消息里所有 db_query_tool 工具调用"""
+    message = state["messages"][-1]
+    if not isinstance(message, AIMessage):
+        return []
+    return [tool_call for tool_call in message.tool_calls
+            if tool_call["name"] == "db_query_tool" and tool_call["args"].get("query")]
+
+
+def query_in_snapshot(conn: sqlite3.Connection, query: str, barrier: SnapshotBarrier, max_rows: int) -> str:
+    """在读事务里执行一个子查询; 读事务的快照在第一次读取时建立"""
+    conn.execute("BEGIN")
+    try:
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        barrier.arrive()
+        page = fetch_page(conn, query, 0, max_rows)
+    finally:
+        if conn.in_transaction:  # 查询被中断时读事务可能已经结束
+            conn.execute("COMMIT")
+    if isinstance(page, str):
+        return page
+    rows, has_more = page
+    result = format_rows(rows)
+    if has_more:
+        result += f"\n[结果较多, 只返回了前 {len(rows)} 行]"
+    return result
+
+
+async def execute_single_db_query(query: str, barrier: SnapshotBarrier) -> dict:
     """
     执行单个数据库查询
     """
-    # 可以使用从 MCP 获取的 db_query_tool
-    # 或者直接使用数据库连接执行查询
-    result = db.run_no_throw(query)
+    result, timing = await get_query_pool().run(query_in_snapshot, query, barrier, MULTI_QUERY_MAX_ROWS,
+                                                limits=QUERY_LIMITS)
     return {
         "query": query,
         "result": result,
-        "status": "success" if result else "error"
+        "status": "error" if result.startswith("Error") else "success",
+        "execution_time": timing.execution,
     }
 
 
-def process_multiple_query_results(results):
+async def execute_multiple_queries_parallel(state: SQLState):
     """
-    处理多个查询的结果
+    并行执行多个 SQL 查询的节点
     """
-    # 聚合所有查询结果
-    aggregated_result = {
-        "results": results,
-        "total_queries": len(results),
-        "successful_queries": len([r for r in results if r["status"] == "success"])
-    }
+    # 从状态中获取多个查询
+    tool_calls = extract_multiple_queries_from_state(state)
+
+    # 使用 AsyncTaskScheduler 并行执行
+    scheduler = AsyncTaskScheduler(max_concurrent_tasks=MULTI_QUERY_POOL_SIZE, timeout=MULTI_QUERY_TIMEOUT)
+    for attempt in range(MAX_SNAPSHOT_RETRIES + 1):
+        barrier = SnapshotBarrier(get_query_pool().db_path, len(tool_calls))
+        try:
+            tasks = [
+                (tool_call["id"], execute_single_db_query, (tool_call["args"]["query"], barrier), {})
+                for tool_call in tool_calls
+            ]
+            # 异步执行所有查询
+            results = await scheduler.schedule_tasks(tasks)
+        finally:
+            barrier.close()
+        if barrier.consistent:
+            break
+        record_retry("snapshot")
+        logger.info(f"Data changed while running {len(tool_calls)} queries, retrying (attempt {attempt + 1})")
 
-    # 创建响应消息
-    response_message = AIMessage(
-        content=f"执行了 {len(results)} 个查询，成功 {aggregated_result['successful_queries']} 个",
-        additional_kwargs=aggregated_result
-    )
+    # 处理结果并返回
+    return process_multiple_query_results(tool_calls, results, barrier.consistent)
 
-    return {"messages": [response_message]}
+
+def process_multiple_query_results(tool_calls: list[dict], results, consistent: bool):
+    """
+    处理多个查询的结果: 每个工具调用对应一条 ToolMessage, 汇总信息放在 artifact 里, 由 generate_sql_query 合并成最终回答
+    """
+    messages = []
+    successful = 0
+    for tool_call, result in zip(tool_calls, results):
+        if result.status == TaskStatus.COMPLETED:
+            content = result.result["result"]
+        elif isinstance(result.error, TimeoutError):
+            # 调度器超时取消了等待, 连接池随即中断了语句; 和连接池自己检查到超时时一样返回 limit_exceeded 报错
+            content = QueryInterrupted("timeout", MULTI_QUERY_TIMEOUT).message(tool_call["args"]["query"])
+        else:
+            content = f"Error: {result.error}"
+        if not content.startswith("Error"):
+            successful += 1
+        if not consistent:
+            content += "\n[注意: 执行期间数据库有写入, 各子查询的结果可能不是同一时刻的数据]"
+        messages.append(ToolMessage(
+            content=content, name=tool_call["name"], tool_call_id=tool_call["id"],
+            status="error" if content.startswith("Error") else "success",
+            artifact={"execution_time": result.execution_time, "snapshot_consistent": consistent},
+        ))
+    logger.info(f"Executed {len(tool_calls)} queries in parallel, {successful} succeeded, "
+                f"slowest {max((r.execution_time for r in results), default=0):.3f}s")
+    return {"messages": messages}
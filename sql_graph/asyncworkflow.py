@@ -1,3 +1,8 @@
+from typing import Literal
+
+from sql_graph.asyncTaskScheduler import extract_multiple_queries_from_state
+from sql_graph.sql_state import SQLState
+
 """异步工作流定义"""
 """优势
 使用 AsyncTaskScheduler 的优势包括：
@@ -6,30 +11,14 @@
 错误处理：单个查询失败不会影响其他查询的执行
 统一管理：所有异步任务都在同一个调度器中管理
 可扩展性：容易添加新的任务类型"""
+"""接入 text2sql_graph.build_graph 的方式:
+generate_sql_query -> check_query -> guard_query -> route_single_or_multiple_queries
+    一个 db_query_tool 调用:  run_sql_query (经过MCP服务执行) -> cache_validated_sql -> generate_sql_query
+    多个 db_query_tool 调用:  execute_multiple_queries (本地只读连接池并行执行, 同一个快照) -> generate_sql_query"""
 
-@asynccontextmanager
-async def make_graph_context():
-    # ... 现有代码 ...
-
-    # 添加处理多个查询的节点
-    handle_multiple_queries_node = ToolNode([multiple_queries_handler_tool])
-    execute_multiple_queries_node = execute_multiple_queries_parallel  # 新的执行节点
-
-    # 在工作流中添加新节点
-    workflow.add_node("handle_multiple_queries", handle_multiple_queries_node)
-    workflow.add_node("execute_multiple_queries", execute_multiple_queries_node)
-
-    # 添加条件边来处理单个或多个查询
-    workflow.add_conditional_edges(
-        "generate_sql_query",
-        route_single_or_multiple_queries,
-        {
-            "single_query": "check_query",
-            "multiple_queries": "handle_multiple_queries",
-            END: END
-        }
-    )
 
-    # 添加多查询执行流程的边
-    workflow.add_edge("handle_multiple_queries", "execute_multiple_queries")
-    workflow.add_edge("execute_multiple_queries", END)
+def route_single_or_multiple_queries(state: SQLState) -> Literal["run_sql_query", "execute_multiple_queries"]:
+    """大模型一次发起多个相互独立的查询时走并行执行节点, 否则走原来的 run_sql_query"""
+    if len(extract_multiple_queries_from_state(state)) > 1:
+        return "execute_multiple_queries"
+    return "run_sql_query"
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Iterator, Optional
+
+from langchain_core.messages import AIMessage, AnyMessage, ToolMessage
+
+from sql_graph.asyncTask import AsyncTaskScheduler, TaskStatus
+from sql_graph.rate_limiter import AdaptiveLimiter, KeyedRateLimiter
+from sql_graph.sql_state import find_tool_call, is_error_result, message_text
+from sql_graph.telemetry import start_metrics_server
+from sql_graph.text2sql_graph import graph_registry, make_graph_context
+
+"""批量模式：从 JSONL 文件中流式读取问题，用 AsyncTaskScheduler 的工作池模式并发地在同一个编译好的工作流上执行，
+每个问题完成后就把 问题/SQL/结果/耗时 追加写入输出 JSONL，内存占用和文件大小无关。
+输出文件里已经成功的问题在重新运行时会被跳过，所以中断后直接用同样的命令重跑就能续跑。
+用法: python -m sql_graph.batch_runner questions.jsonl results.jsonl --concurrency 16"""
+
+
+def read_questions(path: str, id_field: str = "id", question_field: str = "question") -> Iterator[tuple[str, str]]:
+    """逐行读取 (id, 问题); 没有 id 字段时用行号作为 id"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield str(record.get(id_field, line_no)), record[question_field]
+
+
+def completed_ids(path: str) -> set[str]:
+    """输出文件里已经成功的问题 id; 中断时可能写了半行, 解析不了的行直接忽略"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8", errors="replace") as f:  # 半行可能截断在一个中文字符的中间
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+
+def ends_with_newline(path: str) -> bool:
+    """文件为空或者最后一个字节是换行; 用二进制方式读, 最后一个字节可能是多字节字符的一部分"""
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def summarize_run(messages: list[AnyMessage]) -> dict:
+    """从一次执行的消息列表里取出最后一条成功执行的SQL、它的结果和最终回答"""
+    sql, result = None, None
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage) and message.name == "db_query_tool" and not is_error_result(message):
+            tool_call = find_tool_call(messages, message.tool_call_id)
+            sql = tool_call["args"].get("query") if tool_call else None
+            result = message_text(message)
+            break
+    last_message = messages[-1]
+    answer = message_text(last_message) if isinstance(last_message, AIMessage) and not last_message.tool_calls else None
+    return {"sql": sql, "result": result, "answer": answer}
+
+
+class BatchRunner:
+    def __init__(self, graph, concurrency: int = 16, timeout: float = 120.0, progress_every: int = 100,
+                 adaptive: bool = False, requests_per_second: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, tokens_per_question: int = 4000):
+        self.graph = graph
+        # adaptive 时 concurrency 是并发上限, 从四分之一开始按延迟和超时/429 自动调整
+        limiter = AdaptiveLimiter(initial_limit=max(1, concurrency // 4), max_limit=concurrency) if adaptive else None
+        rate_limiter = KeyedRateLimiter(requests_per_second, tokens_per_minute) \
+            if requests_per_second or tokens_per_minute else None
+        # 一个问题通常调用两次大模型, 提示词里带着相关表的DDL, 按固定的 token 数估算
+        self.scheduler = AsyncTaskScheduler(max_concurrent_tasks=concurrency, timeout=timeout, limiter=limiter,
+                                            rate_limiter=rate_limiter, rate_limit_key="llm",
+                                            token_estimator=lambda question: tokens_per_question)
+        self.progress_every = progress_every  # 每完成多少个问题打印一次进度
+        self.logger = logging.getLogger(__name__)
+
+    async def answer(self, question: str) -> dict:
+        # 每个问题一个独立的 thread_id, 问题之间不共享上下文
+        config = {"configurable": {"thread_id": uuid.uuid4().hex}}
+        state = await self.graph.ainvoke({"messages": [{"role": "user", "content": question}]}, config=config)
+        return summarize_run(state["messages"])
+
+    async def run(self, input_path: str, output_path: str, id_field: str = "id", question_field: str = "question",
+                  resume: bool = True) -> dict:
+        done = completed_ids(output_path) if resume else set()
+        questions: dict[str, str] = {}  # 已经提交、还没有写出结果的问题, 最多 queue_size + concurrency 个
+
+        def pending_tasks():
+            for qid, question in read_questions(input_path, id_field, question_field):
+                if qid in done:
+                    continue
+                done.add(qid)  # 输入里重复的 id 只执行第一次
+                questions[qid] = question
+                yield qid, self.answer, (question,), {}
+
+        stats = {"skipped": len(done), "ok": 0, "failed": 0}
+        start_time = time.perf_counter()
+        partial_line = resume and os.path.exists(output_path) and not ends_with_newline(output_path)
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+            if partial_line:
+                out.write("\n")  # 上次中断时写了半行, 先换行再追加
+            async with contextlib.aclosing(self.scheduler.stream_tasks(pending_tasks())) as results:
+                async for result in results:
+                    record = {"id": result.task_id, "question": questions.pop(result.task_id),
+                              "latency": round(result.execution_time, 4)}
+                    if result.status == TaskStatus.COMPLETED:
+                        record.update(status="ok", **result.result)
+                        stats["ok"] += 1
+                    else:
+                        record.update(status="error", error=str(result.error))
+                        stats["failed"] += 1
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()  # 逐条落盘, 中断后最多丢失正在执行的问题
+                    if (stats["ok"] + stats["failed"]) % self.progress_every == 0:
+                        self.logger.info(f"Progress: {stats}")
+        stats["elapsed"] = round(time.perf_counter() - start_time, 2)
+        return stats
+
+
+async def main(args: argparse.Namespace):
+    start_metrics_server()  # TELEMETRY_ENABLED=1 时在本地输出 /metrics
+    async with make_graph_context() as graph:
+        runner = BatchRunner(graph, concurrency=args.concurrency, timeout=args.timeout, adaptive=args.adaptive,
+                             requests_per_second=args.rps, tokens_per_minute=args.tpm,
+                             tokens_per_question=args.tokens_per_question)
+        stats = await runner.run(args.input, args.output, id_field=args.id_field, question_field=args.question_field,
+                                 resume=not args.no_resume)
+    await graph_registry.close()
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="批量把 JSONL 文件里的问题转换成SQL并执行")
+    parser.add_argument("input", help="输入 JSONL, 每行一个问题")
+    parser.add_argument("output", help="输出 JSONL, 每行一个问题的 SQL/结果/耗时")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时执行的问题数")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个问题的超时时间(秒)")
+    parser.add_argument("--adaptive", action="store_true", help="按延迟和超时/429 自动调整并发数, --concurrency 作为上限")
+    parser.add_argument("--rps", type=float, default=None, help="每秒最多开始的问题数")
+    parser.add_argument("--tpm", type=float, default=None, help="每分钟最多消耗的 token 数(按 --tokens-per-question 估算)")
+    parser.add_argument("--tokens-per-question", type=int, default=4000)
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有的输出文件, 从头开始")
+    asyncio.run(main(parser.parse_args()))
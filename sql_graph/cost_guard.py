@@ -0,0 +1,153 @@
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from sql_graph.env_utils import QUERY_AUTO_LIMIT_ROWS, QUERY_COST_ACTION, QUERY_MAX_COST
+from sql_graph.schema_catalog import SchemaSnapshot, get_schema_catalog
+from sql_graph.sql_linter import table_aliases, tokenize_sql
+
+"""执行前的代价检查：用 EXPLAIN QUERY PLAN 拿到执行计划，结合表的行数估算需要处理的行数。
+超过阈值时，能安全截断的查询自动加上 LIMIT，否则拒绝执行并把原因返回给 generate_sql_query 重新生成。"""
+
+_PLAN_RE = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (.*))?$")
+_INDEX_RE = re.compile(r"INDEX (\S+)")
+DEFAULT_SEARCH_ROWS = 10  # 没有 sqlite_stat1 统计信息时, 一次索引查找估算返回的行数
+
+
+@dataclass
+class PlanStep:
+    id: int
+    parent: int
+    detail: str
+    table: Optional[str] = None
+    estimated_rows: float = 1.0
+    full_scan: bool = False
+
+
+@dataclass
+class CostEstimate:
+    sql: str
+    cost: float = 0.0  # 估算需要处理的行数
+    steps: list[PlanStep] = field(default_factory=list)
+    reasons: list[str] = field(default_factory=list)
+    error: Optional[str] = None  # 执行计划都拿不到时的错误信息, 交给后面的执行节点报错
+    over_budget: bool = False
+    nested_full_scan: bool = False  # 有全表扫描的嵌套循环(笛卡尔积、相关子查询里的全表扫描), 多半缺少连接条件, 加 LIMIT 也不对
+
+
+class CostGuard:
+    def __init__(self, max_cost: float, auto_limit_rows: int = 1000, action: str = "auto"):
+        self.max_cost = max_cost
+        self.auto_limit_rows = auto_limit_rows
+        self.action = action  # auto: 能加 LIMIT 的加 LIMIT, 其余拒绝; reject: 一律拒绝
+        self._index_rows: dict[str, float] = {}
+        self._stats_version: Optional[int] = None
+
+    def _load_index_stats(self, conn: sqlite3.Connection, snapshot: SchemaSnapshot):
+        """sqlite_stat1 里第二个数字是每个索引键平均对应的行数, 用来估算 SEARCH 的返回行数"""
+        if self._stats_version == snapshot.version:
+            return
+        self._index_rows = {}
+        try:
+            for _, index, stat in conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"):
+                numbers = (stat or "").split()
+                if index and len(numbers) >= 2:
+                    self._index_rows[index] = float(numbers[1])
+        except sqlite3.Error:
+            pass  # 没有运行过 ANALYZE
+        self._stats_version = snapshot.version
+
+    def estimate(self, sql: str, snapshot: Optional[SchemaSnapshot] = None,
+                 conn: Optional[sqlite3.Connection] = None) -> CostEstimate:
+        catalog = get_schema_catalog()
+        snapshot = snapshot or catalog.get()
+        estimate = CostEstimate(sql=sql)
+        statement = sql.strip().rstrip(";")
+        own_conn = conn is None
+        conn = conn or catalog.connect()
+        try:
+            self._load_index_stats(conn, snapshot)
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        except sqlite3.Error as e:
+            estimate.error = str(e)
+            return estimate
+        finally:
+            if own_conn:
+                conn.close()
+
+        aliases = table_aliases(tokenize_sql(statement), snapshot)
+        for step_id, parent, _, detail in plan:
+            step = PlanStep(id=step_id, parent=parent, detail=detail)
+            match = _PLAN_RE.match(detail)
+            if match:
+                kind, name, using = match.groups()
+                step.table = aliases.get(name.lower(), name)
+                # CTE/子查询这类不认识的名字按最大的表估算, 宁可高估
+                table_rows = snapshot.row_counts.get(step.table, max(snapshot.row_counts.values(), default=1))
+                if kind == "SCAN":
+                    step.estimated_rows = table_rows
+                    step.full_scan = not using or "COVERING INDEX" not in using
+                elif using and "PRIMARY KEY" in using:
+                    step.estimated_rows = 1
+                else:
+                    index = _INDEX_RE.search(using or "")
+                    step.estimated_rows = min(table_rows, self._index_rows.get(index.group(1), DEFAULT_SEARCH_ROWS)
+                                              if index else DEFAULT_SEARCH_ROWS)
+            estimate.steps.append(step)
+
+        # 同一个父节点下的 SCAN/SEARCH 是嵌套循环, 代价相乘; 不同的循环组(子查询、UNION 的分支)代价相加。
+        # 相关子查询(CORRELATED ...)对外层循环的每一行都执行一次, 它下面的循环组再乘上外层在它之前的行数
+        groups: dict[int, list[PlanStep]] = {}
+        multipliers: dict[int, float] = {}
+        for step in estimate.steps:
+            if step.table is not None:
+                groups.setdefault(step.parent, []).append(step)
+            else:
+                factor = 1.0
+                if step.detail.startswith("CORRELATED"):
+                    for outer in groups.get(step.parent, []):
+                        factor *= max(outer.estimated_rows, 1)
+                multipliers[step.id] = multipliers.get(step.parent, 1.0) * factor
+        for parent, steps in groups.items():
+            cost = multipliers.get(parent, 1.0)
+            for step in steps:
+                cost *= max(step.estimated_rows, 1)
+            estimate.cost += cost
+            scans = [s for s in steps if s.full_scan and s.estimated_rows > 1]
+            if len(scans) >= 2:
+                estimate.nested_full_scan = True
+                estimate.reasons.append(
+                    f"{' x '.join(s.table for s in scans)} 之间是全表扫描的嵌套循环(可能缺少连接条件, 形成笛卡尔积)")
+            elif scans and multipliers.get(parent, 1.0) > 1:
+                estimate.nested_full_scan = True
+                estimate.reasons.append(f"相关子查询对外层的每一行都全表扫描一次 {scans[0].table}(可能缺少关联条件上的索引或者连接条件)")
+        if estimate.cost > self.max_cost:
+            estimate.over_budget = True
+            estimate.reasons.append(f"预估需要处理约 {int(estimate.cost)} 行, 超过阈值 {int(self.max_cost)}")
+        return estimate
+
+    def can_add_limit(self, sql: str, estimate: Optional[CostEstimate] = None) -> bool:
+        """没有聚合、排序、去重和已有 LIMIT 的单纯大表扫描, 加上 LIMIT 之后 sqlite 可以提前结束扫描;
+        全表扫描的嵌套循环(笛卡尔积、缺少连接条件)加了 LIMIT 也不对, 必须拒绝后重新生成"""
+        if estimate is not None and estimate.nested_full_scan:
+            return False
+        words = {t.value for t in tokenize_sql(sql) if t.kind == "word"}
+        blocking = {"limit", "order", "group", "distinct", "count", "sum", "avg", "min", "max", "total",
+                    "group_concat", "union", "except", "intersect"}
+        return self.action == "auto" and not words & blocking
+
+    def add_limit(self, sql: str) -> str:
+        """在最后一个有效 token 后面加 LIMIT; 末尾的注释和分号一起去掉, 否则 LIMIT 会落进 -- 注释里"""
+        tokens = tokenize_sql(sql)
+        while tokens and tokens[-1].text == ";":
+            tokens.pop()
+        end = tokens[-1].start + len(tokens[-1].text) if tokens else len(sql)
+        return f"{sql[:end].rstrip()} LIMIT {self.auto_limit_rows}"
+
+
+@lru_cache(maxsize=1)
+def get_cost_guard() -> CostGuard:
+    """进程内共享的代价检查器"""
+    return CostGuard(max_cost=QUERY_MAX_COST, auto_limit_rows=QUERY_AUTO_LIMIT_ROWS, action=QUERY_COST_ACTION)
@@ -8,3 +8,51 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 ZHIPU_API_KEY = os.getenv('ZHIPU_API_KEY')
 
+
+# sqlite数据库文件路径, 默认使用仓库根目录下的 chinook.db
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chinook.db'))
+# 预先构建的schema快照文件(DDL、样例数据、行数), 存在时启动直接加载; 设置为空字符串表示不使用
+SCHEMA_SNAPSHOT_PATH = os.getenv('SCHEMA_SNAPSHOT_PATH', f'{SQLITE_DB_PATH}.schema.json') or None
+
+# 问题 -> SQL 缓存配置, QUESTION_CACHE_PATH 为空时只缓存在内存中
+QUESTION_CACHE_PATH = os.getenv('QUESTION_CACHE_PATH') or None
+QUESTION_CACHE_MAX_SIZE = int(os.getenv('QUESTION_CACHE_MAX_SIZE', '1024'))
+QUESTION_CACHE_TTL = float(os.getenv('QUESTION_CACHE_TTL', '86400'))
+
+# 执行前代价检查: 预估处理行数超过 QUERY_MAX_COST 时, auto 模式下能加 LIMIT 的查询自动加 LIMIT, 其余拒绝; reject 模式一律拒绝
+QUERY_MAX_COST = float(os.getenv('QUERY_MAX_COST', '5000000'))
+QUERY_COST_ACTION = os.getenv('QUERY_COST_ACTION', 'auto')
+QUERY_AUTO_LIMIT_ROWS = int(os.getenv('QUERY_AUTO_LIMIT_ROWS', '1000'))
+# 索引建议: 同一个全表扫描谓词出现多少次后给出建议, 以及是否自动创建索引(需要数据库写权限)
+INDEX_ADVISOR_MIN_COUNT = int(os.getenv('INDEX_ADVISOR_MIN_COUNT', '3'))
+INDEX_ADVISOR_AUTO_CREATE = os.getenv('INDEX_ADVISOR_AUTO_CREATE', '0') == '1'
+# 多查询并行执行: 只读连接池大小、每个子查询的超时时间(秒)和最多返回的行数
+MULTI_QUERY_POOL_SIZE = int(os.getenv('MULTI_QUERY_POOL_SIZE', '4'))
+MULTI_QUERY_TIMEOUT = float(os.getenv('MULTI_QUERY_TIMEOUT', '30'))
+MULTI_QUERY_MAX_ROWS = int(os.getenv('MULTI_QUERY_MAX_ROWS', '200'))
+# 多查询节点每个子查询最多执行的VM指令数(0 表示不限制), 超时或者超过上限时连接池中断查询, 不会继续占着工作线程
+MULTI_QUERY_MAX_VM_STEPS = int(os.getenv('MULTI_QUERY_MAX_VM_STEPS', '2000000000'))
+# 模型路由: 问题涉及的表不超过 ROUTER_SMALL_MAX_TABLES 个且长度不超过 ROUTER_SMALL_MAX_QUESTION_CHARS 时用小模型生成SQL,
+# 多表连接、长问题和修复出错的SQL用大模型; MODEL_ROUTING=0 时所有步骤都用大模型
+MODEL_ROUTING = os.getenv('MODEL_ROUTING', '1') == '1'
+ROUTER_SMALL_MAX_TABLES = int(os.getenv('ROUTER_SMALL_MAX_TABLES', '2'))
+ROUTER_SMALL_MAX_QUESTION_CHARS = int(os.getenv('ROUTER_SMALL_MAX_QUESTION_CHARS', '60'))
+# 发送给大模型的消息历史的 token 预算; 单个查询结果最多保留的 token 数; 计数用的 tiktoken 编码
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+TOOL_RESULT_MAX_TOKENS = int(os.getenv('TOOL_RESULT_MAX_TOKENS', '800'))
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'cl100k_base')
+# 执行出错后的修复: 每个问题最多修复几次、最多执行几轮查询(成功的也算), 以及每个问题的耗时预算(秒), 超过后放弃并告知用户
+MAX_REPAIR_ATTEMPTS = int(os.getenv('MAX_REPAIR_ATTEMPTS', '3'))
+MAX_QUERY_ROUNDS = int(os.getenv('MAX_QUERY_ROUNDS', '8'))
+REPAIR_LATENCY_BUDGET = float(os.getenv('REPAIR_LATENCY_BUDGET', '60'))
+# 埋点: TELEMETRY_ENABLED=1 时记录每个节点、大模型调用和工具调用的耗时、token数、重试次数和缓存命中, 关闭时不挂任何回调;
+# METRICS_PORT 是本地 /metrics 接口的端口(0 表示不启动), TELEMETRY_TRACE_PATH 指定时每个span写一行JSON
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', '0') == '1'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+TELEMETRY_TRACE_PATH = os.getenv('TELEMETRY_TRACE_PATH') or None
+# SQL工具的传输方式: auto(MCP服务地址是本机时在进程内直接调用 mcpserver.mcp_tools, 否则用 SSE) / inprocess / stdio(启动子进程) / sse
+MCP_TRANSPORT = os.getenv('MCP_TRANSPORT', 'auto')
+MCP_SERVER_URL = os.getenv('MCP_SERVER_URL', 'http://localhost:8000/sse')
+# stdio / sse 传输时, 同时发出的多个 db_query_tool 调用合并成一次 db_query_batch_tool 调用, 每批最多的查询数
+MCP_BATCH_MAX_SIZE = int(os.getenv('MCP_BATCH_MAX_SIZE', '16'))
@@ -1,29 +1,58 @@
 import asyncio
+import sys
+import uuid
 from logging import exception
 from typing import TypedDict
 
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.utilities import SQLDatabase
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
 
-from sql_graph.text2sql_graph import make_graph_context
+from sql_graph.sql_state import message_text
+from sql_graph.telemetry import start_metrics_server
+from sql_graph.text2sql_graph import graph_registry, make_graph_context
 
 
 #工作流执行节点上下文的状态
 # class nodestate(TypedDict):
 #   message: Annotated[str, "The message to send to the model"]
 
-async def execute_graph():
-  """执行SQL数据库查询的工作流"""
-  async with make_graph_context() as graph:
+async def print_tokens(graph, inputs, config):
+  """stream_mode="messages": 大模型每生成一个token就打印出来, 包括工具调用里正在生成的SQL, 不用等整条消息生成完"""
+  async for message, metadata in graph.astream(inputs, config=config, stream_mode="messages"):
+    if isinstance(message, AIMessageChunk):
+      print(message_text(message), end="", flush=True)
+      for tool_call_chunk in message.tool_call_chunks:
+        if tool_call_chunk.get("name"):
+          print(f"\n[{metadata['langgraph_node']}] {tool_call_chunk['name']}: ", end="", flush=True)
+        print(tool_call_chunk.get("args") or "", end="", flush=True)
+    elif isinstance(message, AIMessage):
+      # 不经过大模型的节点(比如命中缓存的SQL)直接产出完整消息
+      for tool_call in message.tool_calls:
+        print(f"\n[{metadata['langgraph_node']}] {tool_call['name']}: {tool_call['args']}")
+    elif isinstance(message, ToolMessage):
+      print(f"\n[{message.name}] {str(message.content)[:200]}")
+  print()
+
+
+async def execute_graph(stream_tokens: bool = True):
+  """执行SQL数据库查询的工作流; stream_tokens=False 时和以前一样每个节点结束后打印完整消息"""
+  config = {"configurable": {"thread_id": uuid.uuid4().hex}}  # 一次对话一个 thread_id, 多轮对话共享上下文
+  start_metrics_server()  # TELEMETRY_ENABLED=1 时在本地输出 /metrics
+  async with make_graph_context(checkpointer=MemorySaver()) as graph:
     while True:
-      user_input = input("用户: ")
+      user_input = await asyncio.to_thread(input, "用户: ")  # 在线程里等待输入, 不阻塞事件循环
       if user_input.lower() in ['q', 'exit', 'quit']:
         print('对话结束，拜拜！')
         break
+      inputs = {"messages": [{"role": "user", "content": user_input}]}
+      if stream_tokens:
+        await print_tokens(graph, inputs, config)
       else:
-        async for event in graph.astream({"messages": [{"role": "user", "content": user_input}]},
-                                         stream_mode="values"):
+        async for event in graph.astream(inputs, config=config, stream_mode="values"):
           event["messages"][-1].pretty_print()
+  await graph_registry.close()  # 退出前关闭共享的MCP会话
 
 
 #
@@ -42,4 +71,4 @@ if __name__ == "__main__":
   # result = list_of_tables.invoke("") # 空字符串表示使用默认参数
   #
   # print(result)
-  asyncio.run(execute_graph())
\ No newline at end of file
+  asyncio.run(execute_graph(stream_tokens="--values" not in sys.argv))
\ No newline at end of file
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Optional
+
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from sql_graph.mcp_transport import batch_query_tools, load_inprocess_tools, resolve_transport, stdio_connection
+from sql_graph.telemetry import get_telemetry
+
+"""进程级的工作流注册表：启动时建立一个持久的MCP会话、加载一次工具、编译一次工作流，之后所有请求共享。
+以前每次进入 make_graph_context 都会新建 MultiServerMCPClient、重新 get_tools() 并重新编译 StateGraph，
+而且 get_tools() 返回的工具每次调用都会重新建立一次MCP连接。"""
+
+
+class GraphRegistry:
+    def __init__(self, connections: dict[str, dict], builder: Callable[..., Any]):
+        self.connections = connections
+        self.builder = builder  # builder(tools, checkpointer) -> 编译好的工作流
+        self.tools: Optional[list[BaseTool]] = None
+        self.setup_time = 0.0  # 第一次建立会话、加载工具和编译工作流的耗时
+        self._graphs: dict[int, Any] = {}  # id(checkpointer) -> 编译好的工作流
+        self._checkpointers: dict[int, Optional[BaseCheckpointSaver]] = {}  # 保持引用, 避免 id 被复用
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.logger = logging.getLogger(__name__)
+
+    async def _load_tools(self) -> list[BaseTool]:
+        """按 MCP_TRANSPORT 加载工具: 同一台机器上直接在进程内调用; stdio / sse 为每个MCP服务建立一个持久会话, 工具调用都复用这个会话"""
+        tools, remote = [], {}
+        for server_name, connection in self.connections.items():
+            transport = resolve_transport(connection)
+            self.logger.info(f"Loading tools of {server_name} over {transport}")
+            if transport == "inprocess":
+                tools.extend(load_inprocess_tools())
+            else:
+                remote[server_name] = stdio_connection() if transport == "stdio" else connection
+        if not remote:
+            return tools
+        client = MultiServerMCPClient(remote)
+        self._exit_stack = AsyncExitStack()
+        interceptors = get_telemetry().tool_interceptors()  # 打开埋点时记录每次MCP调用的传输时间和数据库时间
+        for server_name in remote:
+            session = await self._exit_stack.enter_async_context(client.session(server_name))
+            # 同时发出的多个查询合并成一次往返
+            tools.extend(batch_query_tools(
+                await load_mcp_tools(session, tool_interceptors=interceptors, server_name=server_name)))
+        return tools
+
+    async def get_graph(self, checkpointer: Optional[BaseCheckpointSaver] = None):
+        """返回共享的已编译工作流; 第一次调用时完成初始化, 并发的第一次调用只会初始化一次"""
+        key = id(checkpointer)
+        graph = self._graphs.get(key)
+        if graph is not None:
+            return graph
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if key not in self._graphs:
+                start_time = time.perf_counter()
+                if self.tools is None:
+                    self.tools = await self._load_tools()
+                self._graphs[key] = self.builder(self.tools, checkpointer)
+                self._checkpointers[key] = checkpointer
+                elapsed = time.perf_counter() - start_time
+                self.setup_time += elapsed
+                self.logger.info(f"Compiled graph in {elapsed * 1000:.1f}ms")
+            return self._graphs[key]
+
+    async def close(self):
+        """关闭MCP会话; 需要在打开会话的同一个任务里调用(通常是进程退出前的主任务)"""
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self._exit_stack = None
+        self.tools = None
+        self._graphs.clear()
+        self._checkpointers.clear()
@@ -0,0 +1,95 @@
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from sql_graph.cost_guard import CostEstimate
+from sql_graph.env_utils import INDEX_ADVISOR_MIN_COUNT
+from sql_graph.schema_catalog import SchemaSnapshot
+from sql_graph.sql_linter import resolve_column, table_aliases, tokenize_sql
+
+"""索引建议：记录查询日志里反复出现的全表扫描谓词（SCAN 的表上用于过滤/连接的列），
+出现次数达到阈值后给出覆盖索引建议，也可以选择直接在数据库上创建。"""
+
+_PREDICATE_OPS = {"=", "==", "<>", "!=", "<", ">", "<=", ">=", "like", "in", "between", "is", "glob"}
+MAX_INDEX_COLUMNS = 4  # 覆盖索引最多包含的列数, 太宽的索引写入代价太高
+
+
+class IndexAdvisor:
+    def __init__(self, min_count: int = 3):
+        self.min_count = min_count
+        # (表, 谓词列) -> 出现次数; (表, 谓词列) -> 查询里还引用到的这张表的其它列
+        self.scan_predicates: Counter[tuple[str, tuple[str, ...]]] = Counter()
+        self.referenced_columns: dict[tuple[str, tuple[str, ...]], Counter[str]] = {}
+        self.created: set[str] = set()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, estimate: CostEstimate, snapshot: SchemaSnapshot):
+        """记录一次执行计划里全表扫描的表以及作用在它上面的谓词列"""
+        scanned = {step.table for step in estimate.steps if step.full_scan and step.table in snapshot.columns}
+        if not scanned:
+            return
+        tokens = tokenize_sql(estimate.sql)
+        aliases = table_aliases(tokens, snapshot)
+        predicates: dict[str, set[str]] = {table: set() for table in scanned}
+        referenced: dict[str, set[str]] = {table: set() for table in scanned}
+        for i, token in enumerate(tokens):
+            column = resolve_column(tokens, i, aliases, snapshot)
+            if column is None or column[0] not in scanned:
+                continue
+            referenced[column[0]].add(column[1])
+            next_token = tokens[i + 1].value if i + 1 < len(tokens) else ""
+            prev_token = tokens[i - 1].value if i > 0 else ""
+            if next_token in _PREDICATE_OPS or next_token == "not" or prev_token in _PREDICATE_OPS - {"in"}:
+                predicates[column[0]].add(column[1])
+        with self._lock:
+            for table, columns in predicates.items():
+                if not columns:
+                    continue
+                key = (table, tuple(sorted(columns)))
+                self.scan_predicates[key] += 1
+                self.referenced_columns.setdefault(key, Counter()).update(referenced[table] - columns)
+
+    def proposals(self) -> list[str]:
+        """出现次数达到阈值的扫描谓词对应的 CREATE INDEX 语句: 谓词列在前, 再补上查询用到的其它列做成覆盖索引"""
+        statements = []
+        with self._lock:
+            for (table, columns), count in self.scan_predicates.most_common():
+                if count < self.min_count:
+                    break
+                extra = [c for c, _ in self.referenced_columns.get((table, columns), Counter()).most_common()]
+                index_columns = (list(columns) + extra)[:MAX_INDEX_COLUMNS]
+                name = f"idx_advisor_{table}_{'_'.join(index_columns)}"
+                quoted = ", ".join(f'"{c}"' for c in index_columns)
+                statements.append(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({quoted})')
+        return statements
+
+    def create_indexes(self, db_path: str) -> list[str]:
+        """在数据库上创建建议的索引(需要写权限), 返回本次新建的语句; 建索引会改变 schema_version, 相关缓存会自动失效"""
+        created = []
+        statements = [s for s in self.proposals() if s not in self.created]
+        if not statements:
+            return created
+        conn = sqlite3.connect(db_path)
+        try:
+            for statement in statements:
+                try:
+                    conn.execute(statement)
+                    conn.commit()
+                except sqlite3.Error as e:
+                    self.logger.warning(f"Failed to create index: {statement}: {e}")
+                    continue
+                self.created.add(statement)
+                created.append(statement)
+                self.logger.info(f"Created index: {statement}")
+        finally:
+            conn.close()
+        return created
+
+
+@lru_cache(maxsize=1)
+def get_index_advisor() -> IndexAdvisor:
+    """进程内共享的索引建议器"""
+    return IndexAdvisor(min_count=INDEX_ADVISOR_MIN_COUNT)
@@ -0,0 +1,158 @@
+import asyncio
+import importlib.util
+import inspect
+import json
+import os
+import sys
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from sql_graph.env_utils import MCP_BATCH_MAX_SIZE, MCP_TRANSPORT
+
+"""SQL工具的传输方式：
+- inprocess: MCP服务和工作流在同一台机器上时, 直接调用 mcpserver.mcp_tools 里注册的函数, 没有 HTTP、JSON-RPC 和 SSE 分帧的开销
+- stdio: 把 mcpserver.start_server 作为子进程启动, 通过标准输入输出通信
+- sse: 远程部署时连接 MCP_SERVER_URL
+MCP_TRANSPORT=auto 时, 服务地址是本机就用 inprocess, 否则按连接配置。stdio / sse 下同时发出的多个 db_query_tool 调用
+合并成一次 db_query_batch_tool 调用, 多条查询只有一次往返。各传输方式的单次调用开销见 benchmarks/transport_overhead_bench.py"""
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def resolve_transport(connection: dict, transport: str = MCP_TRANSPORT) -> str:
+    """返回 inprocess / stdio / sse(或者连接配置里的其它传输方式)"""
+    if transport != "auto":
+        return transport
+    host = urlparse(connection.get("url", "")).hostname
+    if host in LOCAL_HOSTS and importlib.util.find_spec("mcpserver") is not None:
+        return "inprocess"
+    return connection.get("transport", "sse")
+
+
+def stdio_connection() -> dict:
+    """以子进程方式启动MCP服务的连接配置, 子进程只输出警告以上的日志"""
+    return {"transport": "stdio", "command": sys.executable, "args": ["-m", "mcpserver.start_server", "stdio"],
+            "cwd": ROOT, "env": {**os.environ, "MCP_LOG_LEVEL": "WARNING"}}
+
+
+def load_inprocess_tools() -> list[BaseTool]:
+    """把 FastMCP 里注册的工具包装成 LangChain 工具, 名字、描述和参数 schema 和通过MCP加载的一样"""
+    # 只有进程内调用时才导入 FastMCP; 它在导入时会配置根日志, 没有单独指定时只输出警告以上的日志
+    os.environ.setdefault("MCP_LOG_LEVEL", "WARNING")
+    from mcpserver.mcp_tools import mcp_server
+
+    tools = []
+    for tool in mcp_server._tool_manager.list_tools():
+        fn = inspect.unwrap(tool.fn)  # 去掉 report_db_time 包装, 直接返回文本
+        tools.append(StructuredTool(name=tool.name, description=tool.description or "", args_schema=tool.parameters,
+                                    coroutine=fn if tool.is_async else None, func=None if tool.is_async else fn))
+    return tools
+
+
+def _text(content: Any) -> str:
+    """MCP工具返回的内容块列表拼接成字符串"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+class QueryBatcher:
+    """合并同时发出的查询: 没有请求在途时直接在调用方的任务里发送, 不增加延迟, 取消调用方会取消MCP请求;
+    有请求在途时后来的查询先排队, 上一次往返结束后一起通过 db_query_batch_tool 发送, 一批的调用方都取消后这次发送也会取消"""
+
+    def __init__(self, query_tool: BaseTool, batch_tool: BaseTool, max_batch_size: int = MCP_BATCH_MAX_SIZE):
+        self.query_tool = query_tool
+        self.batch_tool = batch_tool
+        self.max_batch_size = max_batch_size
+        self.queries = 0
+        self.round_trips = 0
+        self._busy = False  # 有请求在途
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._batch: list[tuple[str, asyncio.Future]] = []  # 正在发送的一批
+        self._batch_task: Optional[asyncio.Task] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    async def query(self, query: str) -> str:
+        self.queries += 1
+        if not self._busy:
+            self._busy = True
+            try:
+                return (await self._send([query]))[0]
+            finally:
+                self._busy = False
+                if self._pending:
+                    self._start_sender()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, future))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if any(f is future for _, f in self._batch) and all(f.done() for _, f in self._batch):
+                self._batch_task.cancel()
+            raise
+
+    def _start_sender(self):
+        self._busy = True
+        self._sender = asyncio.create_task(self._send_pending())
+
+    async def _send_pending(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+                batch = [(query, future) for query, future in batch if not future.done()]  # 排队时已经取消的
+                if not batch:
+                    continue
+                self._batch, self._batch_task = batch, asyncio.create_task(self._send([query for query, _ in batch]))
+                await asyncio.wait([self._batch_task])
+                if self._batch_task.cancelled():  # 这一批的调用方都取消了
+                    continue
+                error = self._batch_task.exception()
+                results = [error] * len(batch) if error is not None else self._batch_task.result()
+                for (_, future), result in zip(batch, results):
+                    if future.done():  # 调用方已经取消
+                        continue
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            if self._batch_task is not None:
+                self._batch_task.cancel()
+            for _, future in self._batch + self._pending:
+                future.cancel()  # 发送任务自己被取消(事件循环关闭)时, 不让调用方一直等
+            self._batch, self._batch_task, self._pending = [], None, []
+            self._busy = False
+
+    async def _send(self, queries: list[str]) -> list[str]:
+        self.round_trips += 1
+        if len(queries) == 1:
+            return [_text(await self.query_tool.ainvoke({"query": queries[0]}))]
+        text = _text(await self.batch_tool.ainvoke({"queries": queries}))
+        if text.startswith("Error"):
+            return [text] * len(queries)
+        return json.loads(text)
+
+    def stats(self) -> dict:
+        return {"queries": self.queries, "round_trips": self.round_trips}
+
+
+def batch_query_tools(tools: list[BaseTool]) -> list[BaseTool]:
+    """把 db_query_tool 换成合并发送的版本, 名字、描述和参数不变; 分页、流式调用仍然单独发送"""
+    by_name = {tool.name: tool for tool in tools}
+    query_tool, batch_tool = by_name.get("db_query_tool"), by_name.get("db_query_batch_tool")
+    if query_tool is None or batch_tool is None:
+        return tools  # 旧版本的MCP服务没有批量工具
+    batcher = QueryBatcher(query_tool, batch_tool)
+
+    async def db_query_tool(query: str, **kwargs) -> str:
+        if not any(kwargs.get(key) for key in ("limit", "cursor", "stream")):
+            return await batcher.query(query)
+        return _text(await query_tool.ainvoke({"query": query, **kwargs}))
+
+    batched = StructuredTool(name=query_tool.name, description=query_tool.description,
+                             args_schema=query_tool.args_schema, coroutine=db_query_tool,
+                             metadata={**(query_tool.metadata or {}), "batcher": batcher})
+    return [batched if tool is query_tool else tool for tool in tools]
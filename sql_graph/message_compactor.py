@@ -0,0 +1,140 @@
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import Optional
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+
+from sql_graph.env_utils import PROMPT_TOKEN_BUDGET, TOKENIZER_ENCODING, TOOL_RESULT_MAX_TOKENS
+from sql_graph.sql_state import is_error_result, message_text
+
+"""发送给大模型之前压缩消息历史：状态里的 messages 只会追加, run_sql_query -> generate_sql_query 的循环和多轮对话
+会让 schema、每一次的查询结果和失败的SQL越积越多。这里只改变发送给模型的内容, 状态(checkpoint)里仍然保存完整的历史:
+- schema(sql_db_schema / get_list_table_tool 的结果)只保留最新的一份
+- 被后面的尝试取代的失败SQL, 连同它的报错折叠成一条简短说明
+- 查询结果超过 TOOL_RESULT_MAX_TOKENS 时截断
+- 之前几轮对话只保留问题和最终回答, 超出预算时从最早的一轮开始丢弃
+token 数用 tiktoken 计算(编码文件需要提前下载到 TIKTOKEN_CACHE_DIR), 不可用时按字符数估算。"""
+
+SCHEMA_TOOLS = ("sql_db_schema", "get_list_table_tool")
+_CJK_RE = re.compile(r"[　-鿿가-힯＀-￯]")
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """加载一次 tiktoken 编码; 没有安装或者离线下载不到编码文件时返回 None, 改用估算"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.info(f"tiktoken encoding {TOKENIZER_ENCODING} unavailable, estimating token counts: {e!r}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """同一段文本(比如schema)在每次调用里都会出现, 结果缓存起来"""
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算: 中日韩字符大约一个字一个token, 其它字符大约四个一个token
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: AnyMessage) -> int:
+    tokens = 4 + count_tokens(message_text(message))  # 4: 角色等格式开销
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(tool_call["name"]) + count_tokens(json.dumps(tool_call["args"], ensure_ascii=False))
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    keep = text[:int(len(text) * max_tokens / total)]
+    if "\n" in keep:
+        keep = keep[:keep.rindex("\n")]  # 按行截断, 不留半行结果
+    return f"{keep}\n[结果已截断, 原始结果约 {total} tokens]"
+
+
+def _blocks(messages: list[AnyMessage]) -> list[list[AnyMessage]]:
+    """带工具调用的AI消息和它的 ToolMessage 是一个整体, 只能一起保留或者一起去掉, 否则接口会报错"""
+    blocks, pending = [], set()
+    for message in messages:
+        if isinstance(message, ToolMessage) and message.tool_call_id in pending:
+            blocks[-1].append(message)
+            pending.discard(message.tool_call_id)
+            continue
+        blocks.append([message])
+        pending = {tool_call["id"] for tool_call in getattr(message, "tool_calls", None) or []}
+    return blocks
+
+
+def _tool_names(block: list[AnyMessage]) -> set[str]:
+    return {tool_call["name"] for tool_call in getattr(block[0], "tool_calls", None) or []}
+
+
+def _failed(block: list[AnyMessage]) -> bool:
+    results = [message for message in block[1:] if isinstance(message, ToolMessage)]
+    return bool(results) and all(is_error_result(message) for message in results)
+
+
+def _summarize_failure(block: list[AnyMessage]) -> AIMessage:
+    lines = []
+    for tool_call, result in zip(block[0].tool_calls, block[1:]):
+        error = message_text(result).strip().splitlines()[0][:200] if message_text(result).strip() else "Error"
+        lines.append(f"{tool_call['args'].get('query', '')} -> {error}")
+    return AIMessage(content="之前的尝试失败了(已被后面的查询取代):\n" + "\n".join(lines), id=block[0].id)
+
+
+def _truncate_results(block: list[AnyMessage], max_tokens: int) -> list[AnyMessage]:
+    return [block[0]] + [
+        message.model_copy(update={"content": truncate_to_tokens(message_text(message), max_tokens)})
+        if isinstance(message, ToolMessage) else message
+        for message in block[1:]
+    ]
+
+
+def compact_messages(messages: list[AnyMessage], budget: Optional[int] = None,
+                     tool_result_tokens: Optional[int] = None) -> list[AnyMessage]:
+    """返回发送给模型的消息列表, 总 token 数尽量不超过 budget"""
+    budget = budget or PROMPT_TOKEN_BUDGET
+    tool_result_tokens = tool_result_tokens or TOOL_RESULT_MAX_TOKENS
+    blocks = _blocks(messages)
+    turn_start = max((i for i, block in enumerate(blocks) if isinstance(block[0], HumanMessage)), default=0)
+    latest_schema = {}  # 每个schema工具最新结果所在的块
+    for i, block in enumerate(blocks):
+        for name in _tool_names(block) & set(SCHEMA_TOOLS):
+            latest_schema[name] = i
+    last_query = max((i for i, block in enumerate(blocks) if "db_query_tool" in _tool_names(block)), default=-1)
+
+    kept: list[tuple[int, list[AnyMessage]]] = []
+    for i, block in enumerate(blocks):
+        names = _tool_names(block)
+        if names & set(SCHEMA_TOOLS):
+            if i in latest_schema.values():
+                kept.append((i, block))
+        elif not names:
+            kept.append((i, block))  # 问题和不带工具调用的回答
+        elif i < turn_start:
+            continue  # 之前几轮的查询过程, 结论已经在那一轮的回答里
+        elif _failed(block) and i != last_query:
+            kept.append((i, [_summarize_failure(block)]))
+        else:
+            kept.append((i, _truncate_results(block, tool_result_tokens)))
+
+    # 超出预算时从最早的一轮开始丢弃, 本轮的消息和最新的schema始终保留
+    total = sum(message_tokens(message) for _, block in kept for message in block)
+    while total > budget:
+        removable = next((k for k, (i, block) in enumerate(kept)
+                          if i < turn_start and i not in latest_schema.values()), None)
+        if removable is None:
+            break
+        total -= sum(message_tokens(message) for message in kept.pop(removable)[1])
+    if total > budget:
+        logger.debug(f"Compacted prompt still has {total} tokens, budget {budget}")
+    return [message for _, block in kept for message in block]
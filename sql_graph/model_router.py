@@ -0,0 +1,75 @@
+import logging
+from collections import Counter
+from functools import lru_cache
+
+from langchain_core.messages import ToolMessage
+
+from sql_graph.env_utils import MODEL_ROUTING, ROUTER_SMALL_MAX_QUESTION_CHARS, ROUTER_SMALL_MAX_TABLES
+from sql_graph.sql_linter import LintResult
+from sql_graph.sql_state import SQLState, is_error_result, latest_question
+from sql_graph.table_retriever import get_table_retriever
+
+"""模型路由：大部分问题只涉及一两张表, 用小模型生成SQL就够了, 又快又便宜;
+多表连接、很长的问题、以及SQL执行出错后的修复才交给大模型。判断只用本地的启发式规则(涉及的表数、问题长度), 不额外调用模型。"""
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    def __init__(self, enabled: bool = True, small_max_tables: int = 2, small_max_question_chars: int = 60,
+                 table_score_ratio: float = 0.5):
+        self.enabled = enabled
+        self.small_max_tables = small_max_tables
+        self.small_max_question_chars = small_max_question_chars
+        # 检索得分不低于最高分的这个比例的表算作问题涉及的表
+        self.table_score_ratio = table_score_ratio
+        self.counts: Counter = Counter()
+
+    def involved_tables(self, question: str) -> list[str]:
+        retriever = get_table_retriever()
+        scores = retriever.scores(question)
+        top = float(scores.max()) if len(scores) else 0.0
+        if top <= 0:
+            return []
+        return [table for table, score in zip(retriever.tables, scores) if score >= top * self.table_score_ratio]
+
+    def _choose(self, llm_type: str, reason: str) -> str:
+        self.counts[llm_type] += 1
+        logger.debug(f"Routing to {llm_type} model: {reason}")
+        return llm_type
+
+    def route_generate(self, state: SQLState) -> str:
+        """generate_sql_query 使用的模型"""
+        if not self.enabled:
+            return self._choose("basic", "routing disabled")
+        last_message = state["messages"][-1]
+        if isinstance(last_message, ToolMessage):
+            if is_error_result(last_message):
+                return self._choose("basic", "repairing a failed query")
+            # 第一次生成前的最后一条消息是 sql_db_schema 的结果, 要按问题本身判断, 只有查询结果才是总结
+            if last_message.name == "db_query_tool":
+                return self._choose("small", "summarizing query results")
+        question = latest_question(state["messages"])
+        if len(question) > self.small_max_question_chars:
+            return self._choose("basic", f"long question ({len(question)} chars)")
+        tables = self.involved_tables(question)
+        if not tables:
+            return self._choose("basic", "no table matched the question")
+        if len(tables) > self.small_max_tables:
+            return self._choose("basic", f"{len(tables)} tables involved")
+        return self._choose("small", f"simple question on {', '.join(tables)}")
+
+    def route_check(self, lint_results: list[LintResult]) -> str:
+        """check_query 使用的模型: 规则命中只需要小模型改写; SQL 编译失败相当于修复, 用大模型"""
+        if self.enabled and all(lint_result.parse_ok for lint_result in lint_results):
+            return self._choose("small", "query check")
+        return self._choose("basic", "query does not compile")
+
+    def stats(self) -> dict:
+        return dict(self.counts)
+
+
+@lru_cache(maxsize=1)
+def get_model_router() -> ModelRouter:
+    return ModelRouter(enabled=MODEL_ROUTING, small_max_tables=ROUTER_SMALL_MAX_TABLES,
+                       small_max_question_chars=ROUTER_SMALL_MAX_QUESTION_CHARS)
@@ -1,11 +1,28 @@
-from langchain_openai import ChatOpenAI
-
-
-from zhipuai import ZhipuAI
+from functools import lru_cache
 
 #from sql_graph.env_utils import ZHIPU_API_KEY
 ZHIPU_API_KEY='xxxx'
-zhipuai_client = ZhipuAI(api_key=ZHIPU_API_KEY)
 
-llm = ChatOpenAI(model_name="glm-4-air-250414", temperature=0,
-                 api_key=ZHIPU_API_KEY, base_url="https://open.bigmodel.cn/api/paas/v4/")
\ No newline at end of file
+"""大模型客户端都在第一次使用时才创建: 导入 openai/zhipuai SDK 和构造客户端都比较慢, 不应该算在导入模块的时间里。
+聊天模型由 llm/config.yaml 配置, basic 是大模型, small 是用于简单步骤的小模型(见 sql_graph.model_router)。
+旧代码里的 from sql_graph.my_llm import llm / zhipuai_client 仍然可用, 会在第一次访问时创建。"""
+
+
+@lru_cache(maxsize=1)
+def get_zhipuai_client():
+    from zhipuai import ZhipuAI
+    return ZhipuAI(api_key=ZHIPU_API_KEY)
+
+
+def get_llm(llm_type: str = "basic"):
+    from llm.llm import get_llm_by_type
+    return get_llm_by_type(llm_type)  # 按类型缓存, 每种模型只创建一次
+
+
+def __getattr__(name):
+    # 模块级的延迟属性 (PEP 562)
+    if name == "llm":
+        return get_llm()
+    if name == "zhipuai_client":
+        return get_zhipuai_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
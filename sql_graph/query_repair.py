@@ -0,0 +1,282 @@
+import difflib
+import logging
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Literal, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.constants import END
+
+from mcpserver.db_pool import interrupt_reason
+from sql_graph.env_utils import MAX_QUERY_ROUNDS, MAX_REPAIR_ATTEMPTS, REPAIR_LATENCY_BUDGET
+from sql_graph.schema_catalog import SchemaSnapshot, get_schema_catalog
+from sql_graph.sql_linter import Token, lint_sql, table_aliases, tokenize_sql
+from sql_graph.sql_state import SQLState, find_tool_call, is_error_result, message_text
+from sql_graph.telemetry import record_retry
+
+"""执行出错后的修复阶段：先给 db_query_tool 的报错分类, 标识符拼错、列名有歧义这类简单错误对照缓存的schema在本地直接改好,
+不再调用大模型; 其余的把报错压缩成简短的说明(去掉SQL回显, 附上相近的表名/列名)再交给 generate_sql_query。
+每个问题最多修复 MAX_REPAIR_ATTEMPTS 次、最多执行 MAX_QUERY_ROUNDS 轮查询, 超过次数或者超过 REPAIR_LATENCY_BUDGET 秒就放弃;
+执行成功和失败之后都会检查, 不管是反复出错还是执行成功后又不断重新生成查询, 都不会无限循环。"""
+
+_ERROR_PATTERNS = [
+    ("unknown_column", re.compile(r"no such column: ([\w.$]+)")),
+    ("unknown_table", re.compile(r"no such table: ([\w.$]+)")),
+    ("ambiguous_column", re.compile(r"ambiguous column name: ([\w.$]+)")),
+    ("syntax", re.compile(r'near "(.*?)": syntax error')),
+    ("syntax", re.compile(r"(incomplete input)")),
+]
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryError:
+    kind: str  # unknown_column / unknown_table / ambiguous_column / syntax / rejected / limit_exceeded / cancelled / other
+    message: str  # 去掉异常类型和SQL回显之后的报错
+    identifier: Optional[str] = None
+    suggestions: list[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        text = f"Error: {self.message} [{self.kind}]"
+        if self.suggestions:
+            text += f"; 相近的名称: {', '.join(self.suggestions)}"
+        return text
+
+
+def classify_error(text: str) -> QueryError:
+    first_line = text.strip().splitlines()[0] if text.strip() else "Error"
+    message = re.sub(r"^Error:\s*(\([\w.]+\)\s*)?", "", first_line)
+    if "代价检查" in message or message.startswith("未执行"):
+        return QueryError("rejected", message)
+    reason = interrupt_reason(first_line)
+    if reason is not None:
+        # 超过了执行时间、VM指令数、行数或者结果大小的上限: 本地改不了, 报错里已经带着缩小查询范围的提示, 交给大模型重写
+        return QueryError("cancelled" if reason == "cancelled" else "limit_exceeded", message, reason)
+    for kind, pattern in _ERROR_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return QueryError(kind, message, match.group(1))
+    return QueryError("other", message)
+
+
+def _ratio(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a.lower(), b.lower()).ratio()
+
+
+def close_matches(name: str, candidates: list[str], n: int = 3, cutoff: float = 0.5) -> list[str]:
+    lowered = {candidate.lower(): candidate for candidate in candidates}
+    return [lowered[match] for match in difflib.get_close_matches(name.lower(), list(lowered), n=n, cutoff=cutoff)]
+
+
+def _unique_match(name: str, candidates: list[str], cutoff: float = 0.7) -> Optional[str]:
+    """只有一个足够接近的候选时才自动替换, 两个候选一样接近时交给大模型判断"""
+    matches = close_matches(name, candidates, n=2, cutoff=cutoff)
+    if not matches or (len(matches) == 2 and _ratio(name, matches[0]) == _ratio(name, matches[1])):
+        return None
+    return matches[0]
+
+
+def _replace(sql: str, tokens: list[Token], indexes: list[int], new_text: str) -> str:
+    for i in sorted(indexes, reverse=True):
+        token = tokens[i]
+        text = f'"{new_text}"' if token.kind == "qident" else new_text
+        sql = sql[:token.start] + text + sql[token.start + len(token.text):]
+    return sql
+
+
+def _in_using(tokens: list[Token], i: int) -> bool:
+    """JOIN ... USING (col) 里的列不能加表名前缀"""
+    j = i - 1
+    while j >= 0 and tokens[j].text not in ("(", ")"):
+        j -= 1
+    return j >= 1 and tokens[j].text == "(" and tokens[j - 1].value == "using"
+
+
+def _identifier_tokens(tokens: list[Token], name: str, qualifier: Optional[str]) -> list[int]:
+    indexes = []
+    for i, token in enumerate(tokens):
+        if token.kind not in ("word", "qident") or token.value.lower() != name.lower():
+            continue
+        qualified = i >= 2 and tokens[i - 1].text == "."
+        if qualifier is None and not qualified:
+            indexes.append(i)
+        elif qualifier is not None and qualified and tokens[i - 2].value.lower() == qualifier.lower():
+            indexes.append(i)
+    return indexes
+
+
+def fix_locally(sql: str, error: QueryError, snapshot: SchemaSnapshot, max_steps: int = 3) -> Optional[tuple[str, str]]:
+    """能在本地修好时返回 (修正后的SQL, 修改说明); 修改后的SQL必须能通过编译, 否则仍然交给大模型。
+    一条SQL里可能有好几处拼写错误, sqlite 每次只报告第一处, 所以改完一处后用编译错误继续修, 最多 max_steps 处"""
+    changes = []
+    for _ in range(max_steps):
+        step = _fix_once(sql, error, snapshot)
+        if step is None:
+            return None
+        sql, change = step
+        changes.append(change)
+        compile_errors = [issue.message for issue in lint_sql(sql, snapshot).issues if issue.rule == "compile"]
+        if not compile_errors:
+            return sql, "; ".join(changes)
+        error = classify_error(compile_errors[0])
+    return None
+
+
+def _equi_joined(tokens: list[Token], aliases: dict[str, str], name: str, tables: list[str]) -> bool:
+    """tables 里的表是否都通过 a.name = b.name 这样的等值条件连接在一起"""
+    groups = {table: {table} for table in tables}
+    for i in range(3, len(tokens) - 3):
+        left, right = tokens[i - 3:i], tokens[i + 1:i + 4]
+        if tokens[i].text != "=" or left[1].text != "." or right[1].text != ".":
+            continue
+        if left[2].value.lower() != name.lower() or right[2].value.lower() != name.lower():
+            continue
+        a, b = aliases.get(left[0].value.lower()), aliases.get(right[0].value.lower())
+        if a in groups and b in groups and groups[a] is not groups[b]:
+            merged = groups[a] | groups[b]
+            for table in merged:
+                groups[table] = merged
+    return len(groups[tables[0]]) == len(tables)
+
+
+def _fix_once(sql: str, error: QueryError, snapshot: SchemaSnapshot) -> Optional[tuple[str, str]]:
+    tokens = tokenize_sql(sql)
+    aliases = table_aliases(tokens, snapshot)
+    fixed = None
+    if error.kind == "unknown_column":
+        qualifier, _, name = error.identifier.rpartition(".")
+        qualifier = qualifier or None
+        tables = [aliases[qualifier.lower()]] if qualifier and qualifier.lower() in aliases \
+            else list(dict.fromkeys(aliases.values()))
+        candidates = [column for table in tables for column in snapshot.columns.get(table, [])]
+        error.suggestions = close_matches(name, candidates)
+        new_name = _unique_match(name, candidates)
+        indexes = _identifier_tokens(tokens, name, qualifier)
+        if new_name and indexes:
+            fixed, change = _replace(sql, tokens, indexes, new_name), f"{error.identifier} -> {new_name}"
+    elif error.kind == "unknown_table":
+        error.suggestions = close_matches(error.identifier, snapshot.tables)
+        new_name = _unique_match(error.identifier, snapshot.tables)
+        indexes = [i for i, token in enumerate(tokens)
+                   if token.kind in ("word", "qident") and token.value.lower() == error.identifier.lower()]
+        if new_name and indexes:
+            fixed, change = _replace(sql, tokens, indexes, new_name), f"{error.identifier} -> {new_name}"
+    elif error.kind == "ambiguous_column":
+        name = error.identifier
+        tables = [table for table in dict.fromkeys(aliases.values())
+                  if any(column.lower() == name.lower() for column in snapshot.columns.get(table, []))]
+        if tables and _equi_joined(tokens, aliases, name, tables):
+            # 所有同名列都是用 = 连接起来的连接键, 值一定相同, 取 FROM 里第一张表; 表有别名时必须用别名。
+            # 其它情况(比如 customers 和 employees 都有的 FirstName)取哪张表的列是语义问题, 交给大模型
+            table = tables[0]
+            alias = next((alias for alias, t in aliases.items() if t == table and alias != table.lower()), table)
+            indexes = [i for i in _identifier_tokens(tokens, name, None)
+                       if not _in_using(tokens, i) and not (i + 1 < len(tokens) and tokens[i + 1].text == ".")]
+            if indexes:
+                fixed, change = _replace(sql, tokens, indexes, f"{alias}.{name}"), f"{name} -> {alias}.{name}"
+    if fixed is None or fixed == sql:
+        return None
+    return fixed, change
+
+
+def _current_turn(messages: list) -> list:
+    start = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=0)
+    return messages[start:]
+
+
+def failed_attempts(messages: list) -> int:
+    """本轮执行失败的次数: 同一条AI消息里的多个查询失败只算一次"""
+    attempts = set()
+    turn = _current_turn(messages)
+    for message in turn:
+        if isinstance(message, ToolMessage) and message.name == "db_query_tool" and is_error_result(message):
+            attempts.add(next((m.id for m in reversed(turn) if isinstance(m, AIMessage) and any(
+                tool_call["id"] == message.tool_call_id for tool_call in m.tool_calls)), message.tool_call_id))
+    return len(attempts)
+
+
+def query_rounds(messages: list) -> int:
+    """本轮发起了几次 db_query_tool 调用(同一条AI消息里的多个查询算一次)"""
+    return sum(1 for message in _current_turn(messages) if isinstance(message, AIMessage) and any(
+        tool_call["name"] == "db_query_tool" for tool_call in message.tool_calls))
+
+
+def budget_exhausted(state: SQLState) -> bool:
+    """修复次数、查询轮数或者耗时超过了预算"""
+    messages = state["messages"]
+    attempts, rounds = failed_attempts(messages), query_rounds(messages)
+    elapsed = time.time() - state.get("turn_started_at", time.time())
+    if attempts > MAX_REPAIR_ATTEMPTS or rounds > MAX_QUERY_ROUNDS or elapsed > REPAIR_LATENCY_BUDGET:
+        logger.info(f"Giving up after {rounds} query rounds ({attempts} failed) in {elapsed:.1f}s")
+        return True
+    return False
+
+
+def give_up(state: SQLState):
+    """超过预算时结束本轮, 告诉用户最后一次的错误"""
+    messages = state["messages"]
+    errors = [message for message in _trailing_results(messages) if is_error_result(message)]
+    last_error = classify_error(message_text(errors[-1])).message if errors else ""
+    content = f"抱歉，尝试了 {query_rounds(messages)} 次仍然没有得到正确的查询结果，请换一种方式描述问题。"
+    if last_error:
+        content += f"最后一次错误: {last_error}"
+    return {"messages": [AIMessage(content=content)]}
+
+
+def _trailing_results(messages: list) -> list[ToolMessage]:
+    results = []
+    for message in reversed(messages):
+        if not isinstance(message, ToolMessage):
+            break
+        results.append(message)
+    return results[::-1]
+
+
+def begin_turn(state: SQLState):
+    """每个问题开始时记录时间, 修复阶段按它计算已经用掉的时间"""
+    return {"turn_started_at": time.time()}
+
+
+def route_after_execution(state: SQLState) -> Literal["give_up", "repair_query", "generate_sql_query"]:
+    """超过预算时结束; 执行结果里有错误时先进入修复阶段, 否则生成回答"""
+    if budget_exhausted(state):
+        return "give_up"
+    if any(is_error_result(message) for message in _trailing_results(state["messages"])):
+        return "repair_query"
+    return "generate_sql_query"
+
+
+def repair_query(state: SQLState):
+    messages = state["messages"]
+    results = _trailing_results(messages)
+    errors = [message for message in results if is_error_result(message)]
+    if budget_exhausted(state):  # 代价检查拒绝执行时不经过 route_after_execution, 这里再检查一次
+        return give_up(state)
+
+    snapshot = get_schema_catalog().get()
+    described = []
+    for message in errors:
+        error = classify_error(message_text(message))
+        tool_call = find_tool_call(messages, message.tool_call_id)
+        sql = tool_call["args"].get("query", "") if tool_call else ""
+        fix = fix_locally(sql, error, snapshot) if sql and len(results) == 1 else None
+        if fix is not None:
+            # 单个查询的简单错误: 直接生成修正后的工具调用, 重新经过代价检查后执行
+            fixed_sql, change = fix
+            logger.info(f"Fixed {error.kind} locally: {change}")
+            record_retry("repair_local")
+            return {"messages": [AIMessage(content=f"自动修正: {change}", tool_calls=[{
+                "name": "db_query_tool", "args": {"query": fixed_sql}, "id": uuid.uuid4().hex, "type": "tool_call"}])]}
+        # 使用相同的消息ID替换原来的报错, 发送给大模型的只有简短说明
+        described.append(message.model_copy(update={"content": error.describe()}))
+    record_retry("repair_llm")
+    return {"messages": described}
+
+
+def route_after_repair(state: SQLState) -> Literal["guard_query", "generate_sql_query", END]:
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage):
+        return "guard_query" if last_message.tool_calls else END
+    return "generate_sql_query"
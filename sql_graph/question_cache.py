@@ -0,0 +1,158 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from sql_graph.env_utils import QUESTION_CACHE_MAX_SIZE, QUESTION_CACHE_PATH, QUESTION_CACHE_TTL
+
+"""问题 -> SQL 缓存：把用户问题归一化（大小写、空白、数字写法、标点）后查找之前已经验证过的SQL。
+验证过指的是这条SQL已经通过 run_sql_query 成功执行。缓存按 schema_version 区分，LRU + TTL 淘汰，可以持久化到本地sqlite文件。"""
+
+_EN_NUMBERS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90, "hundred": 100,
+}
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_NUMBER_RE = re.compile(r"[零一二两三四五六七八九十百]+")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+# 去掉标点之前先把会改变问题含义的符号换成单词, 否则 "total > 10" 和 "total < 10"、"-5" 和 "5"、
+# "2012-2013" 和 "2012 2013" 归一化之后完全一样, 缓存会返回另一个问题的SQL
+_SYMBOLS = [
+    (re.compile(r"(\d)\s*[-~–—]\s*(?=\d)"), r"\1 to "),  # 数字范围
+    (re.compile(r"(?<![\w.])-(?=\d)"), " minus "),  # 负数
+    (re.compile(r">="), " ge "),
+    (re.compile(r"<="), " le "),
+    (re.compile(r"!=|<>"), " ne "),
+    (re.compile(r"=+"), " eq "),
+    (re.compile(r">"), " gt "),
+    (re.compile(r"<"), " lt "),
+    (re.compile(r"!(?=\w)"), " not "),  # 紧跟单词的 ! 是取反, 句末的感叹号按标点去掉
+    (re.compile(r"%"), " percent "),
+]
+
+
+def _cn_to_int(text: str) -> Optional[int]:
+    """把 "十" "二十五" "一百" 这类中文数字转成整数, 无法识别时返回 None"""
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        elif ch == "十":
+            total += (current or 1) * 10
+            current = 0
+        elif ch == "百":
+            total += (current or 1) * 100
+            current = 0
+        else:
+            return None
+    return total + current
+
+
+def _replace_cn_number(match: re.Match) -> str:
+    value = _cn_to_int(match.group())
+    return match.group() if value is None else str(value)
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本, "Top 10 artists by sales" 和 "top ten artists, by sales?" 得到相同的结果"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = _CN_NUMBER_RE.sub(_replace_cn_number, text)
+    for pattern, replacement in _SYMBOLS:
+        text = pattern.sub(replacement, text)
+    text = _PUNCT_RE.sub(" ", text)
+    words = [str(_EN_NUMBERS[w]) if w in _EN_NUMBERS else w for w in text.split()]
+    return " ".join(words)
+
+
+class QuestionSQLCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 86400.0, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[int, str], tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        """打开持久化文件, 并把未过期的条目按时间顺序加载到内存"""
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS question_sql_cache ("
+            "schema_version INTEGER, question TEXT, sql TEXT, created_at REAL, "
+            "PRIMARY KEY (schema_version, question))"
+        )
+        self._conn.execute("DELETE FROM question_sql_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT schema_version, question, sql, created_at FROM question_sql_cache "
+            "ORDER BY created_at DESC LIMIT ?", (self.max_size,)
+        ).fetchall()
+        for version, question, sql, created_at in reversed(rows):
+            self._entries[(version, question)] = (sql, created_at)
+
+    def get(self, schema_version: int, question: str) -> Optional[str]:
+        key = (schema_version, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._delete(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, schema_version: int, question: str) -> Optional[str]:
+        """只读查看, 不计入命中统计也不调整LRU顺序"""
+        entry = self._entries.get((schema_version, normalize_question(question)))
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def put(self, schema_version: int, question: str, sql: str):
+        key = (schema_version, normalize_question(question))
+        created_at = time.time()
+        with self._lock:
+            self._entries[key] = (sql, created_at)
+            self._entries.move_to_end(key)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO question_sql_cache VALUES (?, ?, ?, ?)",
+                                   (key[0], key[1], sql, created_at))
+                self._conn.commit()
+            while len(self._entries) > self.max_size:
+                self._delete(next(iter(self._entries)))
+
+    def _delete(self, key: tuple[int, str]):
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM question_sql_cache WHERE schema_version = ? AND question = ?", key)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """命中/未命中计数, 用来评估缓存大小是否合适"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_question_cache() -> QuestionSQLCache:
+    """进程内共享的问题 -> SQL 缓存"""
+    return QuestionSQLCache(max_size=QUESTION_CACHE_MAX_SIZE, ttl=QUESTION_CACHE_TTL, path=QUESTION_CACHE_PATH)
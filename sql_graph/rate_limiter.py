@@ -0,0 +1,187 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+"""AsyncTaskScheduler 用到的限流组件：
+- AdaptiveLimiter: 按观察到的延迟和超时/429 自动调整并发数 (AIMD: 正常时每个延迟周期加一, 拥塞时乘以 backoff_ratio)
+- KeyedRateLimiter: 按 key(比如模型服务商)的令牌桶, 同时限制 请求数/秒 和 token数/分钟, 收到 429 时整个 key 暂停一段时间"""
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 100, backoff_ratio: float = 0.7,
+                 latency_tolerance: float = 2.0, baseline_window: int = 1000):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        # 短期平均延迟超过基线的多少倍视为排队变长(拥塞)
+        self.latency_tolerance = latency_tolerance
+        self.baseline_window = baseline_window
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None  # 最近几次请求的延迟 (EWMA)
+        # 基线: 短期平均延迟的最小值, 近似没有排队时的延迟; 每 baseline_window 个样本换成这个窗口里的最小值,
+        # 任务本身变慢时基线也能跟上, 又不会像长期平均值那样被逐渐变长的排队时间带着一起上涨
+        self.baseline_latency: Optional[float] = None
+        self._window_min: Optional[float] = None
+        self._window_samples = 0
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    self._wake()  # 已经被唤醒却取消了, 把名额让给下一个
+                raise
+        self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """释放一个并发名额; latency 为本次执行耗时, overloaded 表示超时或者被限流(429)"""
+        self.in_flight -= 1
+        self._update(latency, overloaded)
+        self._wake()
+
+    def _wake(self):
+        for _ in range(max(int(self.limit) - self.in_flight, 0)):
+            if not self._waiters:
+                break
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _update(self, latency: Optional[float], overloaded: bool):
+        if latency is not None:
+            self.short_latency = latency if self.short_latency is None else 0.7 * self.short_latency + 0.3 * latency
+            self._window_min = min(self._window_min or self.short_latency, self.short_latency)
+            self.baseline_latency = min(self.baseline_latency or self.short_latency, self.short_latency)
+            self._window_samples += 1
+            if self._window_samples >= self.baseline_window:
+                self.baseline_latency, self._window_min, self._window_samples = self._window_min, None, 0
+        congested = overloaded or (self.short_latency is not None and
+                                   self.short_latency > self.baseline_latency * self.latency_tolerance)
+        now = time.monotonic()
+        if congested:
+            # 一个延迟周期内只减一次, 同一波超时不会把并发数连续砍到最低
+            if now - self._last_decrease >= (self.short_latency or 0):
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+                self._last_decrease = now
+                self.decreases += 1
+        elif self.in_flight + 1 >= int(self.limit):
+            # 名额真的用满了才增加, 每完成 limit 个任务大约加一
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.increases += 1
+
+    def stats(self) -> dict:
+        return {"limit": int(self.limit), "in_flight": self.in_flight, "waiting": len(self._waiters),
+                "short_latency": self.short_latency, "baseline_latency": self.baseline_latency,
+                "increases": self.increases, "decreases": self.decreases}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # 每秒补充的数量
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """还需要等待多少秒才能取出 amount; 超过桶容量的请求按桶容量算, 否则永远等不到"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+@dataclass
+class _KeyLimits:
+    requests: Optional[TokenBucket]
+    tokens: Optional[TokenBucket]
+    paused_until: float = 0.0  # 收到 429 之后暂停到这个时间点
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # 同一个 key 的请求按到达顺序排队
+
+
+class KeyedRateLimiter:
+    def __init__(self, requests_per_second: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 limits: Optional[dict[str, tuple[Optional[float], Optional[float]]]] = None):
+        """requests_per_second / tokens_per_minute 是默认配额, limits 可以按 key 单独配置 (请求数/秒, token数/分钟), None 表示不限制"""
+        self.default_limits = (requests_per_second, tokens_per_minute)
+        self.key_limits = limits or {}
+        self._keys: dict[str, _KeyLimits] = {}
+        self.throttled = 0  # 因为限流等待过的次数
+        self.rate_limited = 0  # 收到 429 的次数
+
+    def _limits(self, key: str) -> _KeyLimits:
+        limits = self._keys.get(key)
+        if limits is None:
+            rps, tpm = self.key_limits.get(key, self.default_limits)
+            limits = _KeyLimits(requests=TokenBucket(rps, max(1.0, rps)) if rps else None,
+                                tokens=TokenBucket(tpm / 60, tpm) if tpm else None)
+            self._keys[key] = limits
+        return limits
+
+    async def acquire(self, key: str = "default", tokens: float = 0):
+        """等到 key 的请求数和 token 数配额都够用, 然后一起扣除"""
+        limits = self._limits(key)
+        async with limits.lock:
+            throttled = False
+            while True:
+                now = time.monotonic()
+                delay = max(limits.paused_until - now,
+                            limits.requests.delay(1, now) if limits.requests else 0,
+                            limits.tokens.delay(tokens, now) if limits.tokens and tokens else 0)
+                if delay <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(delay)
+            if limits.requests:
+                limits.requests.consume(1)
+            if limits.tokens and tokens:
+                limits.tokens.consume(tokens)
+            self.throttled += throttled
+
+    def penalize(self, key: str, delay: float):
+        """收到 429 后让这个 key 的所有请求暂停 delay 秒"""
+        limits = self._limits(key)
+        limits.paused_until = max(limits.paused_until, time.monotonic() + delay)
+        self.rate_limited += 1
+
+    def stats(self) -> dict:
+        return {"throttled": self.throttled, "rate_limited": self.rate_limited,
+                "paused": [key for key, limits in self._keys.items() if limits.paused_until > time.monotonic()]}
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """openai/zhipuai/httpx 的限流异常都带有 status_code=429 (或者 response.status_code=429)"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """从异常附带的响应头里读取 Retry-After (秒)"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, max_delay: float = 60.0) -> float:
+    """指数退避加随机抖动, 避免所有任务在同一时刻重试"""
+    return min(max_delay, base * 2 ** attempt) * random.uniform(0.5, 1.5)
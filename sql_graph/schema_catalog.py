@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from sql_graph.env_utils import SCHEMA_SNAPSHOT_PATH, SQLITE_DB_PATH
+
+"""schema目录服务：一次性构建表列表和每张表的DDL，并以 PRAGMA schema_version 作为版本号缓存。
+只要数据库结构没有变化（schema_version 不变），工作流就可以直接使用缓存的schema，
+跳过 list_of_tables_command -> list_tables_tool -> call_get_schema_tool -> get_schema_node 这四个节点。
+快照可以预先构建成文件(python -m sql_graph.schema_catalog), 服务启动时直接加载, 不用现场统计行数和读取样例数据。"""
+
+
+@dataclass
+class SchemaSnapshot:
+    """某个 schema_version 下的数据库结构快照"""
+    version: int
+    tables: list[str]
+    ddl: dict[str, str]  # 表名 -> CREATE TABLE 语句
+    sample_rows: dict[str, str] = field(default_factory=dict)  # 表名 -> 样例数据（格式和 sql_db_schema 工具的输出一致）
+    columns: dict[str, list[str]] = field(default_factory=dict)  # 表名 -> 列名列表
+    column_types: dict[str, dict[str, str]] = field(default_factory=dict)  # 表名 -> {列名: 声明的类型}
+    foreign_keys: dict[str, list[tuple[str, str, str]]] = field(default_factory=dict)  # 表名 -> [(列, 引用表, 引用列)]
+    row_counts: dict[str, int] = field(default_factory=dict)  # 表名 -> 行数, 构建快照时统计, 只作为代价估算的参考
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SchemaSnapshot":
+        data = dict(data)
+        data["foreign_keys"] = {table: [tuple(fk) for fk in fks] for table, fks in data.get("foreign_keys", {}).items()}
+        return cls(**data)
+
+    def neighbors(self, table: str) -> set[str]:
+        """通过外键直接相连的表（两个方向都算）"""
+        result = {ref_table for _, ref_table, _ in self.foreign_keys.get(table, [])}
+        result.update(t for t, fks in self.foreign_keys.items() if any(ref == table for _, ref, _ in fks))
+        result.discard(table)
+        return result
+
+    def render(self, table_names: Optional[list[str]] = None) -> str:
+        """把指定表（默认全部表）的DDL和样例数据拼接成和 sql_db_schema 工具一样的文本"""
+        names = [t for t in (table_names or self.tables) if t in self.ddl]
+        parts = []
+        for name in names:
+            part = f"\n{self.ddl[name]}\n"
+            if self.sample_rows.get(name):
+                part += f"\n/*\n{self.sample_rows[name]}\n*/"
+            parts.append(part)
+        return "\n\n".join(parts)
+
+
+class SchemaCatalog:
+    def __init__(self, db_path: str = SQLITE_DB_PATH, sample_rows_in_table_info: int = 3,
+                 snapshot_path: Optional[str] = SCHEMA_SNAPSHOT_PATH):
+        self.db_path = db_path
+        self.sample_rows_in_table_info = sample_rows_in_table_info
+        self.snapshot_path = snapshot_path  # 预先构建的快照文件, 为空或者文件不存在时现场读取数据库
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def connect(self) -> sqlite3.Connection:
+        # 只读方式打开，避免路径写错时 sqlite 自动创建一个空数据库
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def current_version(self) -> int:
+        """读取数据库当前的 schema_version, 任何 DDL 变更都会让它加一"""
+        conn = self.connect()
+        try:
+            return conn.execute("PRAGMA schema_version").fetchone()[0]
+        finally:
+            conn.close()
+
+    def is_fresh(self) -> bool:
+        """缓存存在且和数据库当前的 schema_version 一致; 内存里还没有快照时先加载快照文件, 新进程第一个问题就能走快路径"""
+        if self._snapshot is None and self.snapshot_path:
+            self.load()
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot.version == self.current_version()
+
+    def get(self) -> SchemaSnapshot:
+        """获取schema快照(优先加载快照文件), 版本变化时自动重建"""
+        if not self.is_fresh():
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> SchemaSnapshot:
+        """重新读取表列表、DDL和样例数据"""
+        with self._lock:
+            conn = self.connect()
+            try:
+                version = conn.execute("PRAGMA schema_version").fetchone()[0]
+                if self._snapshot is not None and self._snapshot.version == version:
+                    return self._snapshot
+                rows = conn.execute(
+                    "SELECT name, sql FROM sqlite_master "
+                    "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                ).fetchall()
+                ddl = {name: sql for name, sql in rows}
+                sample_rows = {name: self._sample_rows(conn, name) for name in ddl}
+                column_types = {name: {r[1]: (r[2] or "").upper() for r in conn.execute(f'PRAGMA table_info("{name}")')}
+                                for name in ddl}
+                columns = {name: list(types) for name, types in column_types.items()}
+                foreign_keys = {name: [(r[3], r[2], r[4]) for r in conn.execute(f'PRAGMA foreign_key_list("{name}")')]
+                                for name in ddl}
+                row_counts = {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] for name in ddl}
+            finally:
+                conn.close()
+            self._snapshot = SchemaSnapshot(version=version, tables=list(ddl), ddl=ddl, sample_rows=sample_rows,
+                                            columns=columns, column_types=column_types, foreign_keys=foreign_keys,
+                                            row_counts=row_counts)
+            return self._snapshot
+
+    def load(self, path: Optional[str] = None) -> Optional[SchemaSnapshot]:
+        """加载快照文件; 文件不存在、格式不对或者采样行数配置不同时返回 None, schema_version 过期的快照会在 get() 里被重建"""
+        path = path or self.snapshot_path
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("sample_rows_in_table_info") != self.sample_rows_in_table_info:
+                return None
+            snapshot = SchemaSnapshot.from_dict(data["snapshot"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"Ignoring schema snapshot file {path}: {e}")
+            return None
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = snapshot
+        return snapshot
+
+    def save(self, path: Optional[str] = None) -> str:
+        """把当前快照写入文件(先写临时文件再替换, 读的一方不会看到写了一半的文件)"""
+        path = path or self.snapshot_path
+        data = {"sample_rows_in_table_info": self.sample_rows_in_table_info, "snapshot": asdict(self.get())}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+    def _sample_rows(self, conn: sqlite3.Connection, table: str) -> str:
+        if self.sample_rows_in_table_info <= 0:
+            return ""
+        cursor = conn.execute(f'SELECT * FROM "{table}" LIMIT {self.sample_rows_in_table_info}')
+        columns = [d[0] for d in cursor.description]
+        lines = ["\t".join(str(v)[:100] for v in row) for row in cursor.fetchall()]
+        return f"{self.sample_rows_in_table_info} rows from {table} table:\n" + "\n".join(["\t".join(columns)] + lines)
+
+
+@lru_cache(maxsize=1)
+def get_schema_catalog() -> SchemaCatalog:
+    """进程内共享的schema目录"""
+    return SchemaCatalog()
+
+
+if __name__ == "__main__":
+    # 构建快照文件, 一般在打镜像或者数据库结构变更后执行: python -m sql_graph.schema_catalog [输出路径]
+    catalog = SchemaCatalog(snapshot_path=sys.argv[1] if len(sys.argv) > 1 else SCHEMA_SNAPSHOT_PATH)
+    catalog.refresh()
+    print(f"schema_version {catalog.get().version} 的快照已写入 {catalog.save()}")
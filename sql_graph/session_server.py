@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+
+from langchain_core.messages import AIMessageChunk
+from langgraph.checkpoint.memory import MemorySaver
+
+from sql_graph.sql_state import message_text
+from sql_graph.telemetry import start_metrics_server
+from sql_graph.text2sql_graph import graph_registry, make_graph_context
+
+"""服务模式：一个进程里只编译一次工作流，多个会话（每个会话一个 thread_id）并发地在同一个工作流上执行。
+所有大模型节点都是异步的，吞吐量会随并发数增长，直到触达模型服务商的限流。"""
+
+
+class GraphSessionServer:
+    def __init__(self, graph, max_concurrent_sessions: int = 32):
+        self.graph = graph
+        self.max_concurrent_sessions = max_concurrent_sessions
+        self.semaphore = asyncio.Semaphore(max_concurrent_sessions)  # 控制同时执行的会话数量
+        self.logger = logging.getLogger(__name__)
+
+    async def ask(self, thread_id: str, question: str) -> dict:
+        """在指定会话里回答一个问题, 同一个 thread_id 的多轮对话共享上下文"""
+        config = {"configurable": {"thread_id": thread_id}}
+        async with self.semaphore:
+            start_time = time.perf_counter()
+            state = await self.graph.ainvoke({"messages": [{"role": "user", "content": question}]}, config=config)
+            latency = time.perf_counter() - start_time
+        self.logger.info(f"Session {thread_id} answered in {latency:.2f}s")
+        return {"thread_id": thread_id, "question": question, "answer": message_text(state["messages"][-1]),
+                "latency": latency}
+
+    async def ask_stream(self, thread_id: str, question: str) -> AsyncIterator[str]:
+        """和 ask 一样, 但是用 stream_mode="messages" 逐个产出回答的token, 用户等待的是首个token而不是整个回答"""
+        config = {"configurable": {"thread_id": thread_id}}
+        async with self.semaphore:
+            start_time = time.perf_counter()
+            first_token = None
+            async for message, metadata in self.graph.astream(
+                    {"messages": [{"role": "user", "content": question}]}, config=config, stream_mode="messages"):
+                if not isinstance(message, AIMessageChunk) or metadata.get("langgraph_node") != "generate_sql_query":
+                    continue
+                text = message_text(message)
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start_time
+                    yield text
+            latency = time.perf_counter() - start_time
+        self.logger.info(f"Session {thread_id} first token in {first_token or latency:.2f}s, answered in {latency:.2f}s")
+
+    async def ask_many(self, requests: Iterable[tuple[str, str]]) -> list[dict]:
+        """并发处理多个 (thread_id, question)"""
+        return await asyncio.gather(*(self.ask(thread_id, question) for thread_id, question in requests))
+
+
+@asynccontextmanager
+async def serve_graph(max_concurrent_sessions: int = 32):
+    """创建带内存checkpointer的工作流, 并包装成可以并发服务多个会话的 GraphSessionServer"""
+    start_metrics_server()  # TELEMETRY_ENABLED=1 时在本地输出 /metrics
+    async with make_graph_context(checkpointer=MemorySaver()) as graph:
+        yield GraphSessionServer(graph, max_concurrent_sessions=max_concurrent_sessions)
+
+
+async def main(questions: list[str], sessions: int):
+    async with serve_graph(max_concurrent_sessions=sessions) as server:
+        start_time = time.perf_counter()
+        results = await server.ask_many((uuid.uuid4().hex, q) for q in questions * sessions)
+        elapsed = time.perf_counter() - start_time
+    await graph_registry.close()  # 退出前关闭共享的MCP会话
+    for result in results:
+        print(f"[{result['thread_id'][:8]}] {result['latency']:.2f}s {result['question']} -> {result['answer'][:80]}")
+    print(f"{len(results)} 个会话共耗时 {elapsed:.2f}s, 吞吐量 {len(results) / elapsed:.2f} 问/秒")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # 用法: python -m sql_graph.session_server <并发会话数> <问题1> [问题2 ...]
+    asyncio.run(main(sys.argv[2:] or ["有多少个艺术家?"], int(sys.argv[1]) if len(sys.argv) > 1 else 4))
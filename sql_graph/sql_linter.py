@@ -0,0 +1,280 @@
+import asyncio
+import re
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from sql_graph.schema_catalog import SchemaSnapshot, get_schema_catalog
+
+"""本地规则SQL检查器：先用 sqlite 的 EXPLAIN 编译语句（不执行），再对照缓存的schema校验标识符，
+并逐条检查 query_check_system 里列出的常见错误。只有规则命中或者编译失败时才需要再让大模型检查。"""
+
+_TOKEN_RE = re.compile(
+    r"""(?P<string>'(?:[^']|'')*')|(?P<qident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(?P<comment>--[^\n]*|/\*.*?\*/)"""
+    r"""|(?P<number>\d+(?:\.\d*)?)|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)|(?P<op><>|!=|<=|>=|\|\||\S)|\s+""",
+    re.S,
+)
+_COMPARISON_OPS = {"=", "==", "<>", "!=", "<", ">", "<=", ">="}
+_NUMERIC_TYPES = ("INT", "REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL")
+_SQLITE_CAST_TYPES = ("INT", "CHAR", "CLOB", "TEXT", "BLOB", "REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL", "BOOLEAN")
+# FROM/JOIN 之后出现这些关键字说明没有别名
+_CLAUSE_KEYWORDS = {"where", "group", "order", "limit", "join", "inner", "left", "right", "full", "cross", "natural",
+                    "on", "using", "union", "except", "intersect", "having", "window", "as", "outer"}
+
+
+@dataclass
+class Token:
+    kind: str  # string / qident / number / word / op
+    text: str
+    start: int = 0  # 在原SQL里的位置, 自动修正时按位置替换
+
+    @property
+    def value(self) -> str:
+        """标识符去掉引号, 关键字统一小写, 方便比较"""
+        if self.kind == "qident":
+            return self.text[1:-1]
+        return self.text.lower() if self.kind == "word" else self.text
+
+
+@dataclass
+class LintIssue:
+    rule: str
+    message: str
+
+
+@dataclass
+class LintResult:
+    sql: str
+    parse_ok: bool = True
+    issues: list[LintIssue] = field(default_factory=list)
+
+    @property
+    def needs_llm_check(self) -> bool:
+        """编译失败或者有规则命中时才需要大模型再检查一遍"""
+        return not self.parse_ok or bool(self.issues)
+
+    def describe(self) -> str:
+        return "\n".join(f"- [{issue.rule}] {issue.message}" for issue in self.issues)
+
+
+def tokenize_sql(sql: str) -> list[Token]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind and kind != "comment":
+            tokens.append(Token(kind, match.group(), match.start()))
+    return tokens
+
+
+def table_aliases(tokens: list[Token], snapshot: SchemaSnapshot) -> dict[str, str]:
+    """解析 FROM/JOIN 后面(包括 FROM a, b 这种逗号连接)的 表名 [AS] 别名, 返回 别名(小写) -> 表名; 表名本身也可以当别名用"""
+    tables = {t.lower(): t for t in snapshot.tables}
+    aliases = {}
+    in_from = False
+    for i, token in enumerate(tokens):
+        if token.value == "from":
+            in_from = True
+        elif token.value in _CLAUSE_KEYWORDS - {"as", "join", "inner", "left", "right", "full", "cross", "natural",
+                                                "outer"} or token.text in ("(", ")"):
+            in_from = False
+        starts_item = token.value in ("from", "join") or (in_from and token.text == ",")
+        if not starts_item or i + 1 >= len(tokens):
+            continue
+        table = tables.get(tokens[i + 1].value.lower())
+        if table is None:
+            continue
+        aliases[table.lower()] = table
+        j = i + 2
+        if j < len(tokens) and tokens[j].value == "as":
+            j += 1
+        if j < len(tokens) and tokens[j].kind in ("word", "qident") and tokens[j].value.lower() not in _CLAUSE_KEYWORDS:
+            aliases[tokens[j].value.lower()] = table
+    return aliases
+
+
+def resolve_column(tokens: list[Token], i: int, aliases: dict[str, str],
+                    snapshot: SchemaSnapshot) -> Optional[tuple[str, str]]:
+    """tokens[i] 是列名时返回 (表名, 列名); 支持 alias.col 和不带前缀的写法"""
+    token = tokens[i]
+    if token.kind not in ("word", "qident"):
+        return None
+    if i >= 2 and tokens[i - 1].text == "." and tokens[i - 2].value.lower() in aliases:
+        candidates = [aliases[tokens[i - 2].value.lower()]]
+    else:
+        candidates = list(dict.fromkeys(aliases.values()))
+    for table in candidates:
+        for column in snapshot.columns.get(table, []):
+            if column.lower() == token.value.lower():
+                return table, column
+    return None
+
+
+def _compile(sql: str, conn: sqlite3.Connection) -> Optional[str]:
+    """用 EXPLAIN 编译但不执行, 可以发现语法错误、不存在的表/列、函数参数个数错误等; 返回错误信息"""
+    try:
+        conn.execute(f"EXPLAIN {sql}").fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        return str(e)
+    return None
+
+
+def lint_sql(sql: str, snapshot: Optional[SchemaSnapshot] = None, conn: Optional[sqlite3.Connection] = None) -> LintResult:
+    catalog = get_schema_catalog()
+    snapshot = snapshot or catalog.get()
+    result = LintResult(sql=sql)
+    statement = sql.strip().rstrip(";")
+
+    own_conn = conn is None
+    conn = conn or catalog.connect()
+    try:
+        error = _compile(statement, conn)
+    finally:
+        if own_conn:
+            conn.close()
+    if error:
+        result.parse_ok = False
+        result.issues.append(LintIssue("compile", error))
+
+    tokens = tokenize_sql(statement)
+    aliases = table_aliases(tokens, snapshot)
+    if not tokens or tokens[0].value not in ("select", "with", "values"):
+        result.issues.append(LintIssue("read_only", "只允许执行查询语句"))
+    _check_identifiers(tokens, aliases, snapshot, result)
+    _check_not_in(tokens, result)
+    _check_union(tokens, result)
+    _check_between(tokens, result)
+    _check_type_mismatch(tokens, aliases, snapshot, result)
+    _check_cast(tokens, result)
+    _check_join_columns(tokens, aliases, snapshot, result)
+    return result
+
+
+class LintPrefetcher:
+    """流式生成时, 某个工具调用的SQL参数一完整就在线程里开始检查, check_query 直接取结果, 不用等整个回复生成完再检查"""
+
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._pending: OrderedDict[str, asyncio.Task] = OrderedDict()
+        self.hits = 0
+
+    def start(self, sql: str):
+        if sql in self._pending:
+            return
+        self._pending[sql] = asyncio.ensure_future(asyncio.to_thread(lint_sql, sql))
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)  # 生成了却没走到 check_query 的结果, 丢弃最早的
+
+    async def result(self, sql: str) -> LintResult:
+        """预先检查过的直接返回(还没检查完就等它完成), 否则现在在线程里检查, EXPLAIN 不阻塞事件循环"""
+        task = self._pending.pop(sql, None)
+        if task is None:
+            return await asyncio.to_thread(lint_sql, sql)
+        self.hits += 1
+        return await task
+
+
+@lru_cache(maxsize=1)
+def get_lint_prefetcher() -> LintPrefetcher:
+    return LintPrefetcher()
+
+
+def _check_identifiers(tokens, aliases, snapshot, result):
+    """带前缀的列必须存在于对应的表; 双引号里的标识符如果不是表/列名, sqlite 会把它当成字符串, 属于引号用错"""
+    known = {t.lower() for t in snapshot.tables}
+    known.update(c.lower() for columns in snapshot.columns.values() for c in columns)
+    known.update(tokens[i + 1].value.lower() for i, t in enumerate(tokens[:-1]) if t.value == "as")  # 查询里定义的别名
+    for i, token in enumerate(tokens):
+        if i >= 2 and tokens[i - 1].text == "." and tokens[i - 2].value.lower() in aliases:
+            table = aliases[tokens[i - 2].value.lower()]
+            if token.text != "*" and resolve_column(tokens, i, aliases, snapshot) is None:
+                result.issues.append(LintIssue(
+                    "identifier", f"表 {table} 没有列 {token.text}, 可用的列: {', '.join(snapshot.columns[table])}"))
+        elif token.kind == "qident" and token.text.startswith('"') and token.value.lower() not in known:
+            next_token = tokens[i + 1].text if i + 1 < len(tokens) else ""
+            if next_token != ".":
+                result.issues.append(LintIssue(
+                    "quoting", f"{token.text} 不是已知的表名或列名, 字符串常量应该使用单引号"))
+
+
+def _check_not_in(tokens, result):
+    for i in range(len(tokens) - 3):
+        if tokens[i].value == "not" and tokens[i + 1].value == "in" and tokens[i + 2].text == "(" \
+                and tokens[i + 3].value == "select":
+            result.issues.append(LintIssue(
+                "not_in_null", "NOT IN (子查询) 在子查询结果包含 NULL 时会返回空结果, 考虑 NOT EXISTS 或过滤 NULL"))
+            return
+
+
+def _check_union(tokens, result):
+    for i, token in enumerate(tokens):
+        if token.value == "union" and (i + 1 >= len(tokens) or tokens[i + 1].value != "all"):
+            result.issues.append(LintIssue("union", "UNION 会去重, 确认是否应该使用 UNION ALL"))
+            return
+
+
+def _check_between(tokens, result):
+    if any(token.value == "between" for token in tokens):
+        result.issues.append(LintIssue("between", "BETWEEN 两端都是闭区间, 确认范围是否应该不包含端点"))
+
+
+def _check_type_mismatch(tokens, aliases, snapshot, result):
+    """数值列和字符串常量比较, 或者文本列和数字比较"""
+    for i, token in enumerate(tokens):
+        if token.text not in _COMPARISON_OPS or i == 0 or i + 1 >= len(tokens):
+            continue
+        column = resolve_column(tokens, i - 1, aliases, snapshot)
+        other = tokens[i + 1]
+        if column is None or other.kind not in ("string", "number"):
+            continue
+        column_type = snapshot.column_types.get(column[0], {}).get(column[1], "")
+        is_numeric = any(t in column_type for t in _NUMERIC_TYPES)
+        if is_numeric and other.kind == "string" or not is_numeric and column_type and other.kind == "number":
+            result.issues.append(LintIssue(
+                "type_mismatch", f"{column[0]}.{column[1]} 的类型是 {column_type}, 却和 {other.text} 比较"))
+
+
+def _check_cast(tokens, result):
+    for i in range(len(tokens) - 1):
+        if tokens[i].value == "as" and i >= 2 and _inside_cast(tokens, i):
+            type_name = tokens[i + 1].value.upper()
+            if not any(t in type_name for t in _SQLITE_CAST_TYPES):
+                result.issues.append(LintIssue(
+                    "cast", f"sqlite 没有 {type_name} 类型, CAST 会按 NUMERIC 处理; 日期请使用 date()/strftime()"))
+
+
+def _inside_cast(tokens, i) -> bool:
+    """tokens[i] 这个 AS 是不是 CAST( ... AS type) 里的 AS"""
+    depth = 0
+    for j in range(i - 1, -1, -1):
+        if tokens[j].text == ")":
+            depth += 1
+        elif tokens[j].text == "(":
+            if depth == 0:
+                return j > 0 and tokens[j - 1].value == "cast"
+            depth -= 1
+    return False
+
+
+def _check_join_columns(tokens, aliases, snapshot, result):
+    """JOIN ... ON a.x = b.y 的两列应该是外键关系或者同名列"""
+    related = set()
+    for table, fks in snapshot.foreign_keys.items():
+        for column, ref_table, ref_column in fks:
+            related.add(frozenset([(table, column), (ref_table, ref_column or column)]))
+    in_on = False
+    for i, token in enumerate(tokens):
+        if token.value == "on":
+            in_on = True
+        elif token.value in ("where", "group", "order", "limit", "join", "union"):
+            in_on = False
+        elif in_on and token.text in ("=", "==") and 0 < i < len(tokens) - 1:
+            left = resolve_column(tokens, i - 1, aliases, snapshot)
+            right = resolve_column(tokens, i + 1, aliases, snapshot) if i + 3 >= len(tokens) or tokens[i + 2].text != "." \
+                else resolve_column(tokens, i + 3, aliases, snapshot)
+            if left is None or right is None or left[1].lower() == right[1].lower():
+                continue
+            if frozenset([left, right]) not in related:
+                result.issues.append(LintIssue(
+                    "join_columns", f"{left[0]}.{left[1]} 和 {right[0]}.{right[1]} 之间没有外键关系, 确认连接列是否正确"))
@@ -1,5 +1,6 @@
-from typing import TypedDict, Annotated
-from langchain_core.messages import AnyMessage
+import json
+from typing import TypedDict, Annotated, NotRequired, Optional
+from langchain_core.messages import AIMessageChunk, AnyMessage, HumanMessage, ToolMessage
 from langgraph.graph import add_messages
 
 class SQLState(TypedDict):
@@ -10,5 +11,52 @@ class SQLState(TypedDict):
     """需要考虑什么时候覆盖，什么时候追加"""
 
     messages: Annotated[list[AnyMessage], add_messages] #每个节点输出的message添加到list 中,不管是#AI Message, HumanMessage, SystemMessage,toolMessage
+    turn_started_at: NotRequired[float]  # 本轮问题开始的时间, 修复阶段用来检查耗时预算
 
 
+def latest_question(messages: list[AnyMessage]) -> str:
+    """最近一条用户输入, 也就是本轮要回答的问题"""
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message_text(message)
+    return ""
+
+
+def message_text(message: AnyMessage) -> str:
+    """消息的纯文本内容, MCP工具返回的内容块列表会被拼接成字符串"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+def is_error_result(message: ToolMessage) -> bool:
+    """工具执行是否失败, db_query_tool 出错时返回以 Error 开头的文本"""
+    return message.status == "error" or message_text(message).lstrip().startswith("Error")
+
+
+def find_tool_call(messages: list[AnyMessage], tool_call_id: str) -> Optional[dict]:
+    """根据 tool_call_id 找到发起这次工具调用的 tool_call"""
+    for message in reversed(messages):
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            if tool_call["id"] == tool_call_id:
+                return tool_call
+    return None
+
+
+def completed_queries(message: AnyMessage, tool_name: str = "db_query_tool") -> list[str]:
+    """流式生成过程中已经完整的SQL: 工具调用的参数片段拼成合法的JSON, 说明这个调用的参数已经生成完了"""
+    if not isinstance(message, AIMessageChunk):
+        return [tool_call["args"]["query"] for tool_call in getattr(message, "tool_calls", None) or []
+                if tool_call["name"] == tool_name and tool_call["args"].get("query")]
+    queries = []
+    for chunk in message.tool_call_chunks:
+        if chunk.get("name") != tool_name or not chunk.get("args"):
+            continue
+        try:
+            args = json.loads(chunk["args"])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(args, dict) and args.get("query"):
+            queries.append(args["query"])
+    return queries
@@ -0,0 +1,124 @@
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from sql_graph.schema_catalog import SchemaSnapshot, get_schema_catalog
+
+"""本地表检索索引：用 BM25 在表名、列名、外键和每列少量采样值上检索与问题相关的表，
+代替 call_get_schema_tool 中让大模型挑选表名的那一次调用，同时只把相关表的DDL发给模型。"""
+
+# 不同字段的权重，用重复词项的方式实现（表名最重要，其次是列名）
+TABLE_NAME_WEIGHT = 3
+COLUMN_WEIGHT = 2
+FOREIGN_KEY_WEIGHT = 1
+VALUE_WEIGHT = 1
+
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_WORD_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """切分驼峰/下划线命名, 英文做简单的复数还原, 中文按单字和相邻两字切分"""
+    tokens = []
+    for word in _WORD_RE.findall(_CAMEL_RE.sub(" ", str(text)).lower()):
+        if word[0] >= "一":
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            continue
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class TableRetriever:
+    def __init__(self, snapshot: SchemaSnapshot, sampled_values: Optional[dict[str, list[str]]] = None,
+                 k1: float = 1.5, b: float = 0.75):
+        self.snapshot = snapshot
+        self.tables = list(snapshot.tables)
+        docs = [self._document(table, (sampled_values or {}).get(table, [])) for table in self.tables]
+
+        self.vocab = {term: i for i, term in enumerate(sorted({t for doc in docs for t in doc}))}
+        tf = np.zeros((len(docs), len(self.vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for term, count in Counter(doc).items():
+                tf[row, self.vocab[term]] = count
+
+        # 预先算好每个 (表, 词) 的 BM25 权重, 查询时只需要一次矩阵乘法
+        doc_len = tf.sum(axis=1, keepdims=True)
+        avg_len = float(doc_len.mean()) if len(docs) else 1.0
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(docs) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.weights = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_len))
+
+    def _document(self, table: str, values: list[str]) -> list[str]:
+        doc = tokenize(table) * TABLE_NAME_WEIGHT
+        for column in self.snapshot.columns.get(table, []):
+            doc += tokenize(column) * COLUMN_WEIGHT
+        for column, ref_table, ref_column in self.snapshot.foreign_keys.get(table, []):
+            doc += tokenize(f"{ref_table} {ref_column}") * FOREIGN_KEY_WEIGHT
+        for value in values:
+            doc += tokenize(value) * VALUE_WEIGHT
+        return doc
+
+    def scores(self, question: str) -> np.ndarray:
+        query = np.zeros(len(self.vocab), dtype=np.float32)
+        for term in tokenize(question):
+            index = self.vocab.get(term)
+            if index is not None:
+                query[index] = 1.0
+        return self.weights @ query
+
+    def search(self, question: str, top_k: int = 3, with_neighbors: bool = True) -> list[str]:
+        """返回最相关的 top_k 张表及其外键相邻表; 一张都匹配不上时退回全部表, 保证不会漏掉schema"""
+        scores = self.scores(question)
+        ranked = [i for i in np.argsort(-scores, kind="stable")[:top_k] if scores[i] > 0]
+        if not ranked:
+            return list(self.tables)
+        selected = [self.tables[i] for i in ranked]
+        if with_neighbors:
+            for table in list(selected):
+                selected.extend(n for n in sorted(self.snapshot.neighbors(table)) if n not in selected)
+        return selected
+
+
+def sample_distinct_values(db_path: str, snapshot: SchemaSnapshot, per_column: int = 5) -> dict[str, list[str]]:
+    """每个文本列采样少量不同的取值, 让 "AC/DC 的专辑" 这类问题也能命中对应的表"""
+    values: dict[str, list[str]] = {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for table in snapshot.tables:
+            values[table] = []
+            for row in conn.execute(f'PRAGMA table_info("{table}")'):
+                column, column_type = row[1], (row[2] or "").upper()
+                if not any(t in column_type for t in ("CHAR", "TEXT", "CLOB")):
+                    continue
+                values[table].extend(
+                    str(v[0]) for v in conn.execute(
+                        f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT {per_column}'
+                    )
+                )
+    finally:
+        conn.close()
+    return values
+
+
+_retriever: Optional[TableRetriever] = None
+_retriever_lock = threading.Lock()
+
+
+def get_table_retriever() -> TableRetriever:
+    """进程内共享的检索索引, schema_version 变化时重建"""
+    global _retriever
+    catalog = get_schema_catalog()
+    snapshot = catalog.get()
+    with _retriever_lock:
+        if _retriever is None or _retriever.snapshot.version != snapshot.version:
+            _retriever = TableRetriever(snapshot, sample_distinct_values(catalog.db_path, snapshot))
+        return _retriever
@@ -0,0 +1,234 @@
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from mcpserver.metrics import CONTENT_TYPE, DB_TIME_META_KEY, MetricsRegistry
+from sql_graph.env_utils import METRICS_PORT, TELEMETRY_ENABLED, TELEMETRY_TRACE_PATH
+from sql_graph.message_compactor import message_tokens
+
+"""工作流的埋点：TELEMETRY_ENABLED=1 时通过 LangChain 回调记录
+- 每个 LangGraph 节点一个span(耗时、状态)
+- 每次大模型调用的耗时和 prompt/completion token 数(接口没有返回用量时用 message_compactor 估算)
+- 每次工具调用的耗时; MCP工具调用再按服务端 _meta 里返回的数据库耗时拆分成传输时间和数据库时间
+- 重试次数(限流重试、多查询快照重试、修复阶段)和缓存(问题->SQL、schema)的命中/未命中
+指标通过本地 http://127.0.0.1:METRICS_PORT/metrics 按 Prometheus 文本格式输出, 设置 TELEMETRY_TRACE_PATH 时每个span写一行JSON。
+关闭时不挂回调也不装工具拦截器, record_retry / record_cache 只判断一次开关, 开销接近于零。"""
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Run:
+    kind: str  # node / llm / tool
+    name: str
+    started_at: float  # 墙上时间, 写入trace
+    start: float  # perf_counter, 计算耗时
+    thread_id: Optional[str] = None
+    messages: list = field(default_factory=list)  # 大模型调用的输入, 没有返回用量时用来估算 prompt token 数
+
+
+class Telemetry:
+    def __init__(self, enabled: bool = False, trace_path: Optional[str] = None):
+        self.enabled = enabled
+        self.registry = MetricsRegistry()
+        self.node_seconds = self.registry.histogram("nl2sql_node_duration_seconds", "每个工作流节点的执行时间")
+        self.llm_seconds = self.registry.histogram("nl2sql_llm_duration_seconds", "每次大模型调用的时间")
+        self.llm_tokens = self.registry.counter("nl2sql_llm_tokens_total", "大模型调用的 prompt/completion token 数")
+        self.tool_seconds = self.registry.histogram("nl2sql_tool_duration_seconds", "每次工具调用的时间")
+        self.mcp_seconds = self.registry.histogram("nl2sql_mcp_call_seconds",
+                                                   "MCP工具调用的总时间, 以及拆分出的传输时间和服务端数据库时间")
+        self.retries = self.registry.counter("nl2sql_retries_total", "按来源统计的重试次数")
+        self.cache_requests = self.registry.counter("nl2sql_cache_requests_total", "缓存的命中和未命中次数")
+        self._trace = open(trace_path, "a", encoding="utf-8", buffering=1) if enabled and trace_path else None
+        self._trace_lock = threading.Lock()
+        self.callback_handler = TelemetryCallbackHandler(self)
+
+    def record_span(self, run: _Run, duration: float, status: str = "ok", **attrs):
+        if run.kind == "node":
+            self.node_seconds.observe(duration, node=run.name, status=status)
+        elif run.kind == "llm":
+            self.llm_seconds.observe(duration, model=run.name, status=status)
+        else:
+            self.tool_seconds.observe(duration, tool=run.name, status=status)
+        self.write_trace({"ts": round(run.started_at, 6), "kind": run.kind, "name": run.name,
+                          "duration_ms": round(duration * 1000, 3), "status": status, "thread_id": run.thread_id,
+                          **attrs})
+
+    def record_tokens(self, model: str, prompt_tokens: int, completion_tokens: int):
+        self.llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+        self.llm_tokens.inc(completion_tokens, model=model, type="completion")
+
+    def record_mcp_call(self, tool: str, total: float, db_seconds: Optional[float]):
+        self.mcp_seconds.observe(total, tool=tool, part="total")
+        attrs = {}
+        if db_seconds is not None:  # 服务端没有打开指标时结果里没有数据库耗时, 只记录总时间
+            transport = max(0.0, total - db_seconds)
+            self.mcp_seconds.observe(db_seconds, tool=tool, part="db")
+            self.mcp_seconds.observe(transport, tool=tool, part="transport")
+            attrs = {"db_ms": round(db_seconds * 1000, 3), "transport_ms": round(transport * 1000, 3)}
+        self.write_trace({"ts": round(time.time() - total, 6), "kind": "mcp", "name": tool,
+                          "duration_ms": round(total * 1000, 3), **attrs})
+
+    def write_trace(self, record: dict):
+        if self._trace is None:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._trace_lock:
+            self._trace.write(line + "\n")
+
+    def tool_interceptors(self) -> list:
+        """加载MCP工具时安装的拦截器, 关闭时为空"""
+        return [MCPTimingInterceptor(self)] if self.enabled else []
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """节点、大模型调用和工具调用的span; 节点的 run 名字和 metadata['langgraph_node'] 相同, 节点内部的子 runnable 不记录"""
+    run_inline = True
+
+    def __init__(self, telemetry: Telemetry):
+        self.telemetry = telemetry
+        self._runs: dict[UUID, _Run] = {}
+
+    def _start(self, run_id: UUID, kind: str, name: str, metadata: Optional[dict], messages: Optional[list] = None):
+        self._runs[run_id] = _Run(kind, name, time.time(), time.perf_counter(), (metadata or {}).get("thread_id"),
+                                  messages or [])
+
+    def _finish(self, run_id: UUID, status: str = "ok", **attrs) -> Optional[_Run]:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.telemetry.record_span(run, time.perf_counter() - run.start, status, **attrs)
+        return run
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start(run_id, "node", node, metadata)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "error", error=repr(error))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, "llm", model, metadata, messages[0] if messages else [])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        prompt_tokens, completion_tokens, estimated = self._usage(run, response)
+        self.telemetry.record_tokens(run.name, prompt_tokens, completion_tokens)
+        self._finish(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, estimated=estimated)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "error", error=repr(error))
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        self._start(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name") or "unknown", metadata)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._finish(run_id, "error", error=repr(error))
+
+    def on_retry(self, retry_state, *, run_id: UUID, **kwargs):
+        self.telemetry.retries.inc(source="runnable")
+
+    @staticmethod
+    def _usage(run: _Run, response: LLMResult) -> tuple[int, int, bool]:
+        """优先使用接口返回的用量, 流式调用没有返回用量时按消息估算"""
+        generations = [generation for batch in response.generations for generation in batch]
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0), False
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if token_usage:
+            return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0), False
+        completion_tokens = sum(message_tokens(generation.message) for generation in generations
+                                if getattr(generation, "message", None) is not None)
+        return sum(message_tokens(message) for message in run.messages), completion_tokens, True
+
+
+class MCPTimingInterceptor:
+    """MCP工具调用的拦截器: 记录一次调用的总时间, 用服务端在 _meta 里返回的数据库耗时拆分出传输时间"""
+
+    def __init__(self, telemetry: Telemetry):
+        self.telemetry = telemetry
+
+    async def __call__(self, request, handler):
+        start_time = time.perf_counter()
+        result = await handler(request)
+        meta = getattr(result, "meta", None) or {}
+        self.telemetry.record_mcp_call(request.name, time.perf_counter() - start_time, meta.get(DB_TIME_META_KEY))
+        return result
+
+
+@lru_cache(maxsize=1)
+def get_telemetry() -> Telemetry:
+    return Telemetry(TELEMETRY_ENABLED, TELEMETRY_TRACE_PATH)
+
+
+def instrument_graph(graph):
+    """打开埋点时给编译好的工作流挂上回调, 每次执行都会记录; 关闭时原样返回"""
+    telemetry = get_telemetry()
+    if not telemetry.enabled:
+        return graph
+    return graph.with_config(callbacks=[telemetry.callback_handler])
+
+
+def record_retry(source: str):
+    telemetry = get_telemetry()
+    if telemetry.enabled:
+        telemetry.retries.inc(source=source)
+
+
+def record_cache(cache: str, hit: bool):
+    telemetry = get_telemetry()
+    if telemetry.enabled:
+        telemetry.cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@lru_cache(maxsize=1)
+def start_metrics_server(host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """在后台线程里启动本地 /metrics 接口, 只启动一次; 没有打开埋点或者 METRICS_PORT=0 时不启动"""
+    telemetry = get_telemetry()
+    if not telemetry.enabled or not METRICS_PORT:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
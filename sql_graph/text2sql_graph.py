@@ -1,18 +1,34 @@
+import uuid
 from contextlib import asynccontextmanager
-from typing import Literal
+from typing import Literal, Optional
 
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage, message_chunk_to_message
+from langchain_core.tools import BaseTool
 from langgraph.prebuilt import ToolNode
 from langgraph.constants import START, END
 
-from sql_graph.my_llm import llm
-from sql_graph.sql_state import SQLState
+from sql_graph.asyncTaskScheduler import execute_multiple_queries_parallel, extract_multiple_queries_from_state
+from sql_graph.asyncworkflow import route_single_or_multiple_queries
+from sql_graph.cost_guard import get_cost_guard
+from sql_graph.env_utils import INDEX_ADVISOR_AUTO_CREATE, MCP_SERVER_URL
+from sql_graph.graph_registry import GraphRegistry
+from sql_graph.index_advisor import get_index_advisor
+from sql_graph.message_compactor import compact_messages
+from sql_graph.model_router import get_model_router
+from sql_graph.my_llm import get_llm
+from sql_graph.query_repair import begin_turn, give_up, repair_query, route_after_execution, route_after_repair
+from sql_graph.question_cache import get_question_cache
+from sql_graph.schema_catalog import get_schema_catalog
+from sql_graph.sql_linter import get_lint_prefetcher
+from sql_graph.sql_state import SQLState, completed_queries, find_tool_call, is_error_result, latest_question
+from sql_graph.table_retriever import get_table_retriever
+from sql_graph.telemetry import instrument_graph, record_cache
 from sql_graph.tool_node import call_get_schema_tool, get_schema_node
 
 mcp_server_config = {
-    "url": "http://localhost:8000/sse",
+    "url": MCP_SERVER_URL,
     "transport": "sse"
 }
 query_check_system = """您是一位注重细节的SQL专家。
@@ -41,15 +57,135 @@ def should_continue(state: SQLState) -> Literal[END, "check_query"]:  # Literal
         return "check_query"
 
 
-@asynccontextmanager  # 定义异步上下文管理器 它可以使得异步资源的获取和释放更加方便 后面可以使用 async with 语法来使用这个上下文管理器
-async def make_graph_context():
-    """定义并且编译工作流 """
-    client = MultiServerMCPClient({'sql_mcp': mcp_server_config})  # 创建一个MCP客户端, 并且传入配置信息 用与MCP服务器进行交互,
-    tools = await client.get_tools()
+def route_entry(state: SQLState) -> Literal["use_cached_sql", "use_cached_schema", "list_of_tables_command"]:
+    """入口条件路由: 问题->SQL缓存命中时直接去执行, 否则再判断走快/慢schema路径"""
+    hit = get_question_cache().get(get_schema_catalog().current_version(), latest_question(state["messages"])) is not None
+    record_cache("question", hit)
+    if hit:
+        return "use_cached_sql"
+    return route_schema(state)
+
+
+def use_cached_sql(state: SQLState):
+    """缓存命中节点: 直接生成执行缓存SQL的工具调用, 跳过 generate_sql_query 和 check_query;
+    路由之后缓存条目刚好过期或者被淘汰时不生成工具调用, 由 route_cached_sql 转到正常流程"""
+    sql = get_question_cache().peek(get_schema_catalog().current_version(), latest_question(state["messages"]))
+    if sql is None:
+        return {}
+    tool_call = {
+        "name": "db_query_tool",
+        "args": {"query": sql},
+        "id": uuid.uuid4().hex,
+        "type": "tool_call",
+    }
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+
+def route_cached_sql(state: SQLState) -> Literal["run_sql_query", "use_cached_schema", "list_of_tables_command"]:
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage) and last_message.tool_calls:
+        return "run_sql_query"
+    return route_schema(state)
+
+
+def cache_validated_sql(state: SQLState):
+    """run_sql_query 执行成功后, 把这条SQL记入问题->SQL缓存"""
+    tool_message = state["messages"][-1]
+    if isinstance(tool_message, ToolMessage) and not is_error_result(tool_message):
+        tool_call = find_tool_call(state["messages"], tool_message.tool_call_id)
+        if tool_call and tool_call["args"].get("query"):
+            get_question_cache().put(get_schema_catalog().current_version(), latest_question(state["messages"]),
+                                     tool_call["args"]["query"])
+    return {}
+
+
+def guard_query(state: SQLState):
+    """执行前的代价检查节点: 用 EXPLAIN QUERY PLAN 估算代价, 超过阈值时自动加 LIMIT 或者拒绝执行, 同时把扫描谓词记入索引建议"""
+    message = state["messages"][-1]
+    guard = get_cost_guard()
+    advisor = get_index_advisor()
+    snapshot = get_schema_catalog().get()
+    tool_calls, rejections = [], {}
+    for tool_call in message.tool_calls:
+        sql = tool_call["args"].get("query")
+        if tool_call["name"] != "db_query_tool" or not sql:
+            tool_calls.append(tool_call)
+            continue
+        estimate = guard.estimate(sql, snapshot)
+        if estimate.error is None:
+            advisor.record(estimate, snapshot)
+        if not estimate.over_budget:
+            tool_calls.append(tool_call)
+        elif guard.can_add_limit(sql, estimate):  # 全表扫描的嵌套循环不会加 LIMIT, 带着原因拒绝
+            tool_calls.append({**tool_call, "args": {**tool_call["args"], "query": guard.add_limit(sql)}})
+        else:
+            rejections[tool_call["id"]] = "; ".join(estimate.reasons)
+    if INDEX_ADVISOR_AUTO_CREATE:
+        advisor.create_indexes(get_schema_catalog().db_path)
+
+    if rejections:
+        # 每个工具调用都要有对应的 ToolMessage, 被拒绝的说明原因, 其余的标记为未执行, 然后回到 generate_sql_query 重新生成
+        return {"messages": [
+            ToolMessage(
+                content=f"Error: 查询被执行前的代价检查拒绝: {rejections[tool_call['id']]}。"
+                        f"请添加过滤条件、检查连接条件或者改写为聚合查询后重新生成" if tool_call["id"] in rejections
+                else "Error: 未执行, 同一批次中的其它查询被代价检查拒绝",
+                name=tool_call["name"], tool_call_id=tool_call["id"], status="error",
+            )
+            for tool_call in message.tool_calls
+        ]}
+    if tool_calls != message.tool_calls:
+        # 使用相同的消息ID替换原来的工具调用
+        return {"messages": [AIMessage(content=message.content, tool_calls=tool_calls, id=message.id)]}
+    return {}
+
+
+def route_after_guard(state: SQLState) -> Literal["run_sql_query", "execute_multiple_queries", "repair_query"]:
+    """代价检查拒绝时进入修复阶段(计入修复次数), 否则按查询个数选择执行节点"""
+    if isinstance(state["messages"][-1], ToolMessage):
+        return "repair_query"
+    return route_single_or_multiple_queries(state)
+
+
+def route_schema(state: SQLState) -> Literal["use_cached_schema", "list_of_tables_command"]:
+    """入口条件路由: schema_version 没有变化时直接走缓存的schema, 否则走原来的四个schema节点"""
+    catalog = get_schema_catalog()
+    fresh = catalog.is_fresh()
+    record_cache("schema", fresh)
+    if fresh:
+        return "use_cached_schema"
+    catalog.refresh()  # 版本变化(或第一次运行), 重建缓存后走慢路径
+    return "list_of_tables_command"
+
+
+def use_cached_schema(state: SQLState):
+    """快速路径节点: 用缓存的schema伪造一次 sql_db_schema 工具调用及其结果, 后续节点看到的消息和慢路径一致"""
+    snapshot = get_schema_catalog().get()
+    table_names = get_table_retriever().search(latest_question(state["messages"]))  # 只发送相关表的DDL
+    tool_call = {
+        "name": "sql_db_schema",
+        "args": {"table_names": ", ".join(table_names)},
+        "id": uuid.uuid4().hex,
+        "type": "tool_call",
+    }
+    tool_call_message = AIMessage(content="", tool_calls=[tool_call])
+    tool_message = ToolMessage(content=snapshot.render(table_names), name="sql_db_schema", tool_call_id=tool_call["id"])
+    return {"messages": [tool_call_message, tool_message]}
+
+
+def build_graph(tools: list[BaseTool], checkpointer: Optional[BaseCheckpointSaver] = None):
+    """定义并且编译工作流; 工具的 bind_tools 在这里只做一次, 所有请求共享预先绑定好的 runnable"""
     # 获取数据库中的所有表的工具
     get_list_table_tool = next(tool for tool in tools if tool.name == 'get_list_table_tool')
     # 执行sql查询的工具
     db_query_tool = next(tool for tool in tools if tool.name == 'db_query_tool')
+    # 通过 bind_tools，可以将外部工具的功能与 LLM 结合，使模型能够根据输入内容决定是否需要调用某个工具。
+    # 大模型(basic)和小模型(small)各绑定一次, 每一步由 model_router 决定用哪一个
+    router = get_model_router()
+    llms = {llm_type: get_llm(llm_type) for llm_type in ("basic", "small")}
+    llm_with_query_tool = {llm_type: llm.bind_tools([db_query_tool]) for llm_type, llm in llms.items()}
+    llm_with_required_query_tool = {  # 绑定工具，并且设置为必须使用工具
+        llm_type: llm.bind_tools([db_query_tool], tool_choice='any') for llm_type, llm in llms.items()}
 
     # 生成一个调用工具的指令
     def list_of_tables_command(state: SQLState):
@@ -71,20 +207,32 @@ async def make_graph_context():
      # 第二个节点
     list_tables_tool = ToolNode([get_list_table_tool], name="list_tables_tool")
 
-    def generate_sql_query(state: SQLState):
+    async def generate_sql_query(state: SQLState):
         """第四个节点，根据用户的输入生成sql查询语句，并且返回 json格式的数据,格式为：{sql: 'sql查询语句'},可以查看system message 里面的prompt要求"""
         system_message = {
             "role": "system",
-            "content": "你是一个数据库查询助手，你需要根据用户的输入生成一个sql查询语句，你需要返回一个json格式的数据，格式为：{sql: 'sql查询语句'}",
+            "content": "你是一个数据库查询助手，你需要根据用户的输入生成一个sql查询语句，你需要返回一个json格式的数据，格式为：{sql: 'sql查询语句'}。"
+                       "如果问题包含多个可以独立查询的部分（例如对比2012年和2013年各流派的销售额），"
+                       "请在一次回复中同时发起多个 db_query_tool 调用，每个调用只查询其中一部分，它们会被并行执行",
         }
-        # 通过 bind_tools，可以将外部工具的功能与 LLM 结合，使模型能够根据输入内容决定是否需要调用某个工具。
         # 工具调用：绑定后的模型可以在生成响应时自动或手动触发工具调用，执行特定任务（如查询数据库、获取外部数据等）。
-        llm_with_tools = llm.bind_tools([db_query_tool])
-        response = llm_with_tools.invoke([system_message] + state['messages'])
+        # 流式调用: stream_mode="messages" 时token逐个推给调用方; 某个SQL参数一完整就开始本地检查, 不等剩下的工具调用生成完
+        prefetcher = get_lint_prefetcher()
+        response = None
+        model = llm_with_query_tool[router.route_generate(state)]
+        # 只保留最新的schema、折叠失败的尝试、截断大结果, 每次调用的 prompt 大小不随会话变长而增长
+        async for chunk in model.astream([system_message] + compact_messages(state['messages'])):
+            response = chunk if response is None else response + chunk
+            if isinstance(chunk, AIMessageChunk) and not chunk.tool_call_chunks:
+                continue
+            for sql in completed_queries(response):
+                prefetcher.start(sql)
+        if isinstance(response, AIMessageChunk):
+            response = message_chunk_to_message(response)  # 状态里保存完整的 AIMessage, 和非流式调用一致
 
         return {'messages': [response]}
 
-    def check_query(state: SQLState):
+    async def check_query(state: SQLState):
         """第五个节点，检查生成的sql查询语句是否正确，并且返回json格式的数据,格式为：{result: '查询结果'},可以查看system message 里面的prompt要求"""
         system_message = {
             "role": "system",
@@ -92,12 +240,17 @@ async def make_graph_context():
         }
         # 获取上一个节点生成的sql查询语句,而不需要整个消息列表
 
-        tool_call = state["messages"][-1].tool_calls[0]  # -1 获取最后一个消息 -1, -2 获取倒数第二个消息
-        sql_query = tool_call["args"]["query"]  # 这个才是真正要执行的sqL查询语句
-        sqlquery_message = {"role": "user", "content": sql_query}
-        llm_with_tools = llm.bind_tools([db_query_tool], tool_choice='any')  # 绑定工具，并且设置为必须使用工具
-
-        response = llm_with_tools.invoke([system_message, sqlquery_message])
+        # 先做本地规则检查, 大部分生成的sql都是干净的, 不需要再调用一次大模型; 拆分出的多个子查询逐个检查
+        sql_queries = [tool_call["args"]["query"] for tool_call in extract_multiple_queries_from_state(state)]
+        prefetcher = get_lint_prefetcher()
+        lint_results = [await prefetcher.result(sql_query) for sql_query in sql_queries]
+        if not any(lint_result.needs_llm_check for lint_result in lint_results):
+            return {'messages': []}  # 直接执行上一个节点生成的工具调用
+        sqlquery_message = {"role": "user", "content": "\n\n".join(
+            f"{lint_result.sql}\n\n本地检查发现以下问题:\n{lint_result.describe()}" if lint_result.needs_llm_check
+            else lint_result.sql for lint_result in lint_results)}
+        model = llm_with_required_query_tool[router.route_check(lint_results)]
+        response = await model.ainvoke([system_message, sqlquery_message])
         response.id = state["messages"][
             -1].id  # 保持消息ID一致，便于追踪,保证同一个sql查询语句的id一致,它和上个节点生成sql一致，如果执行有问题， 又会回到上一个节点去重新生成sql查询语句
 
@@ -111,22 +264,48 @@ async def make_graph_context():
     # 创建一个workflow state
     workflow = StateGraph(SQLState)
     # 添加工具
+    workflow.add_node(begin_turn)
+    workflow.add_node(use_cached_sql)
+    workflow.add_node(use_cached_schema)
     workflow.add_node(list_of_tables_command)
     workflow.add_node(list_tables_tool)
     workflow.add_node(call_get_schema_tool)
     workflow.add_node(get_schema_node)
     workflow.add_node(generate_sql_query)
     workflow.add_node(check_query)
+    workflow.add_node(guard_query)
     workflow.add_node(run_query_node)
+    workflow.add_node(cache_validated_sql)
+    workflow.add_node("execute_multiple_queries", execute_multiple_queries_parallel)  # 多个子查询在本地只读连接池里并行执行
+    workflow.add_node(repair_query)
+    workflow.add_node(give_up)
 
     # 添加边 定义节点之间的连接关系
-    workflow.add_edge(START, "list_of_tables_command")
+    workflow.add_edge(START, "begin_turn")
+    workflow.add_conditional_edges("begin_turn", route_entry)  # 问题缓存命中直接执行, schema没有变化时跳过四个schema节点
+    workflow.add_conditional_edges("use_cached_sql", route_cached_sql)
+    workflow.add_edge("use_cached_schema", "generate_sql_query")
     workflow.add_edge("list_of_tables_command", "list_tables_tool")
     workflow.add_edge("list_tables_tool", "call_get_schema_tool")
     workflow.add_edge("call_get_schema_tool", "get_schema_node")
     workflow.add_edge("get_schema_node", "generate_sql_query")
     workflow.add_conditional_edges("generate_sql_query", should_continue)
-    workflow.add_edge("check_query", "run_sql_query")
-    workflow.add_edge("run_sql_query", "generate_sql_query")  # 如果执行sql查询有问题，就回到生成sql查询语句的节点，重新生成sql查询语句
-    graph = workflow.compile() # 编译工作流
-    yield graph # 返回工作流
+    workflow.add_edge("check_query", "guard_query")
+    workflow.add_conditional_edges("guard_query", route_after_guard)
+    workflow.add_edge("run_sql_query", "cache_validated_sql")
+    # 执行成功就生成回答; 出错先进入修复阶段, 简单错误在本地改好后重新执行, 其余的带着简短说明回到 generate_sql_query 重新生成
+    workflow.add_conditional_edges("cache_validated_sql", route_after_execution)
+    workflow.add_conditional_edges("execute_multiple_queries", route_after_execution)  # 合并多个子查询的结果生成最终回答
+    workflow.add_conditional_edges("repair_query", route_after_repair)  # 超过修复次数或者耗时预算时结束
+    workflow.add_edge("give_up", END)  # 执行成功或失败之后超过查询轮数、修复次数或者耗时预算时结束
+    return instrument_graph(workflow.compile(checkpointer=checkpointer))  # 编译工作流, 打开埋点时挂上回调
+
+
+# 进程级的工作流注册表: MCP会话、工具和编译好的工作流都只创建一次
+graph_registry = GraphRegistry({'sql_mcp': mcp_server_config}, build_graph)
+
+
+@asynccontextmanager  # 定义异步上下文管理器 它可以使得异步资源的获取和释放更加方便 后面可以使用 async with 语法来使用这个上下文管理器
+async def make_graph_context(checkpointer: Optional[BaseCheckpointSaver] = None):
+    """获取共享的已编译工作流, 传入 checkpointer 后同一个编译好的工作流可以按 thread_id 同时服务多个会话"""
+    yield await graph_registry.get_graph(checkpointer) # 返回工作流
@@ -1,31 +1,41 @@
-from sql_graph.my_llm import llm
-from sql_graph.sql_state import SQLState
+import uuid
 
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_community.utilities import SQLDatabase
-from langgraph.prebuilt import ToolNode
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from sql_graph.schema_catalog import get_schema_catalog
+from sql_graph.sql_state import SQLState, latest_question
+from sql_graph.table_retriever import get_table_retriever
 
-db = SQLDatabase.from_uri('sqlite:///../chinook.db')
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+from langgraph.prebuilt import ToolNode
 
-tools = toolkit.get_tools()
 
-get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
+# 以前用 SQLDatabaseToolkit 的 sql_db_schema 工具, 导入这个模块时就要反射所有表并查询样例数据;
+# 现在直接从schema目录的快照里渲染, 输出格式不变, 第一次调用时才读取快照
+@tool("sql_db_schema")
+def get_schema_tool(table_names: str) -> str:
+    """Input to this tool is a comma-separated list of tables, output is the schema and sample rows for those tables.
+    Be sure that the tables actually exist by calling get_list_table_tool first!
+    Example Input: table1, table2, table3"""
+    snapshot = get_schema_catalog().get()
+    names = [name.strip() for name in table_names.split(",") if name.strip()]
+    missing = set(names) - set(snapshot.tables)
+    if missing:
+        return f"Error: table_names {missing} not found in database"
+    return snapshot.render(names)
 
 
-# 生成 call get schema tool 的指令/prompt with llm
+# 生成 call get schema tool 的指令, 由本地检索索引挑选相关的表, 不再调用大模型
 def call_get_schema_tool(state: SQLState):
-    # 这里使用大模型生成， bind tool
-    llm_with_bind_tool = llm.bind_tools(
-        [get_schema_tool], tool_choice="any"
-    )
+    table_names = get_table_retriever().search(latest_question(state["messages"]))
+    tool_call = {
+        "name": get_schema_tool.name,
+        "args": {"table_names": ", ".join(table_names)},
+        "id": uuid.uuid4().hex,
+        "type": "tool_call",
+    }
     #这个指令会调用 get_schema_tool
-    response = llm_with_bind_tool.invoke(state["messages"])
-    return {"messages": response}
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
 
 #第三个节点，调用 get_schema_tool 工具
 get_schema_node = ToolNode([get_schema_tool],name="get_schema_node") # 使用langgraph 创建节点toolnode直接调用tool
-
-
-
-
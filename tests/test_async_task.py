@@ -0,0 +1,50 @@
+import asyncio
+import contextlib
+
+from sql_graph.asyncTask import AsyncTaskScheduler, TaskStatus
+
+
+async def _sleep(seconds: float) -> float:
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+def test_cancel_unknown_or_finished_task_is_not_recorded():
+    async def run():
+        scheduler = AsyncTaskScheduler(max_concurrent_tasks=1)
+        results = [result async for result in scheduler.stream_tasks([("a", _sleep, (0,), {})])]
+        assert results[0].status == TaskStatus.COMPLETED
+        assert scheduler.cancel("a") is False
+        assert scheduler.cancel("never-submitted") is False
+        assert not scheduler._cancelled
+
+    asyncio.run(run())
+
+
+def test_cancel_queued_task_is_skipped_and_forgotten():
+    async def run():
+        scheduler = AsyncTaskScheduler(max_concurrent_tasks=1)
+        tasks = [("slow", _sleep, (0.05,), {}), ("queued", _sleep, (0,), {})]
+        stream = scheduler.stream_tasks(tasks)
+        async with contextlib.aclosing(stream):
+            first = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.01)  # slow 正在执行, queued 在排队
+            assert scheduler.cancel("queued") is True
+            results = [await first] + [result async for result in stream]
+        assert {r.task_id: r.status for r in results} == {"slow": TaskStatus.COMPLETED,
+                                                          "queued": TaskStatus.CANCELLED}
+        assert not scheduler._cancelled and not scheduler._queued
+
+    asyncio.run(run())
+
+
+def test_early_exit_forgets_queued_tasks():
+    async def run():
+        scheduler = AsyncTaskScheduler(max_concurrent_tasks=1)
+        tasks = [(f"t{i}", _sleep, (0,), {}) for i in range(5)]
+        async with contextlib.aclosing(scheduler.stream_tasks(tasks)) as stream:
+            async for _ in stream:
+                break
+        assert not scheduler._queued and not scheduler._cancelled
+
+    asyncio.run(run())
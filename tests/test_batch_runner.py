@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage
+
+from sql_graph.batch_runner import BatchRunner
+
+
+class _FakeGraph:
+    def __init__(self):
+        self.questions = []
+
+    async def ainvoke(self, state, config=None):
+        question = state["messages"][0]["content"]
+        self.questions.append(question)
+        return {"messages": [AIMessage(content=f"回答: {question}")]}
+
+
+def test_resume_after_partial_multibyte_line_and_duplicate_ids(tmp_path):
+    input_path, output_path = tmp_path / "questions.jsonl", tmp_path / "results.jsonl"
+    questions = [("1", "一共有多少首曲目"), ("2", "哪个艺术家的专辑最多"), ("2", "哪个艺术家的专辑最多"), ("3", "销售额最高的国家")]
+    input_path.write_text("".join(json.dumps({"id": qid, "question": q}, ensure_ascii=False) + "\n"
+                                  for qid, q in questions), encoding="utf-8")
+    done = json.dumps({"id": "1", "question": questions[0][1], "status": "ok"}, ensure_ascii=False) + "\n"
+    partial = json.dumps({"id": "2", "question": questions[1][1], "status": "ok"}, ensure_ascii=False).encode()
+    # 中断时最后一个中文字符只写了一半
+    output_path.write_bytes(done.encode() + partial[:partial.index("艺".encode()) + 1])
+
+    graph = _FakeGraph()
+    stats = asyncio.run(BatchRunner(graph, concurrency=2).run(str(input_path), str(output_path)))
+
+    assert stats["ok"] == 2 and stats["failed"] == 0 and stats["skipped"] == 1
+    assert sorted(graph.questions) == sorted([questions[1][1], questions[3][1]])
+    lines = output_path.read_bytes().split(b"\n")
+    assert lines[-1] == b""
+    records = [json.loads(line) for line in lines[2:-1]]
+    assert sorted(r["id"] for r in records) == ["2", "3"]
+    assert all(r["status"] == "ok" for r in records)
+
+
+def test_duplicate_ids_run_once(tmp_path):
+    input_path, output_path = tmp_path / "questions.jsonl", tmp_path / "results.jsonl"
+    input_path.write_text('{"id": 7, "question": "q"}\n{"id": 7, "question": "q"}\n', encoding="utf-8")
+    graph = _FakeGraph()
+    stats = asyncio.run(BatchRunner(graph, concurrency=2).run(str(input_path), str(output_path), resume=False))
+    assert stats["ok"] == 1 and graph.questions == ["q"]
+    assert [json.loads(line)["id"] for line in output_path.read_text(encoding="utf-8").splitlines()] == ["7"]
@@ -0,0 +1,52 @@
+from langchain_core.messages import AIMessage, ToolMessage
+
+from sql_graph import text2sql_graph
+from sql_graph.cost_guard import DEFAULT_SEARCH_ROWS, CostGuard
+from sql_graph.schema_catalog import get_schema_catalog
+
+CARTESIAN = "SELECT * FROM tracks, invoice_items"
+
+
+def test_correlated_subquery_cost_is_multiplied_by_outer_rows():
+    snapshot = get_schema_catalog().get()
+    tracks = snapshot.row_counts["tracks"]
+    estimate = CostGuard(max_cost=1e9).estimate(
+        "SELECT Name, (SELECT count(*) FROM invoice_items ii WHERE ii.UnitPrice = t.UnitPrice) FROM tracks t", snapshot)
+    assert estimate.cost == tracks + tracks * DEFAULT_SEARCH_ROWS
+
+
+def test_cartesian_product_is_not_limited():
+    guard = CostGuard(max_cost=5_000_000)
+    estimate = guard.estimate(CARTESIAN)
+    assert estimate.over_budget and estimate.nested_full_scan
+    assert not guard.can_add_limit(CARTESIAN, estimate)
+
+
+def test_plain_large_scan_can_be_limited():
+    guard = CostGuard(max_cost=100)
+    estimate = guard.estimate("SELECT * FROM tracks")
+    assert estimate.over_budget and not estimate.nested_full_scan
+    assert guard.can_add_limit("SELECT * FROM tracks", estimate)
+
+
+
+def test_add_limit_drops_trailing_comment():
+    guard = CostGuard(max_cost=100, auto_limit_rows=5)
+    assert guard.add_limit("SELECT * FROM tracks -- all tracks") == "SELECT * FROM tracks LIMIT 5"
+    assert guard.add_limit("SELECT * FROM tracks; /* all */\n") == "SELECT * FROM tracks LIMIT 5"
+    assert guard.add_limit("SELECT '--' AS x FROM tracks") == "SELECT '--' AS x FROM tracks LIMIT 5"
+    conn = get_schema_catalog().connect()
+    try:
+        assert len(conn.execute(guard.add_limit("SELECT * FROM tracks -- all tracks")).fetchall()) == 5
+    finally:
+        conn.close()
+
+def test_guard_query_rejects_cartesian_product(monkeypatch):
+    monkeypatch.setattr(text2sql_graph, "get_cost_guard", lambda: CostGuard(max_cost=5_000_000))
+    call = {"name": "db_query_tool", "args": {"query": CARTESIAN}, "id": "call-1", "type": "tool_call"}
+
+    update = text2sql_graph.guard_query({"messages": [AIMessage(content="", tool_calls=[call])]})
+
+    [message] = update["messages"]
+    assert isinstance(message, ToolMessage) and message.status == "error"
+    assert "笛卡尔积" in message.content
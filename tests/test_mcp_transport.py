@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from langchain_core.tools import StructuredTool
+
+from sql_graph.mcp_transport import QueryBatcher
+
+
+class _FakeServer:
+    """模拟MCP服务: 查询在 release 之前一直挂起, 记录哪些请求被取消"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = []
+        self.cancelled = []
+
+    async def _run(self, name: str, payload):
+        self.started.append((name, payload))
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append((name, payload))
+            raise
+
+    async def query(self, query: str) -> str:
+        await self._run("query", query)
+        return f"result of {query}"
+
+    async def batch(self, queries: list[str]) -> str:
+        await self._run("batch", queries)
+        return json.dumps([f"result of {query}" for query in queries])
+
+    def batcher(self) -> QueryBatcher:
+        return QueryBatcher(StructuredTool.from_function(coroutine=self.query, name="db_query_tool", description="q"),
+                            StructuredTool.from_function(coroutine=self.batch, name="db_query_batch_tool",
+                                                         description="b"))
+
+
+def test_queries_are_batched_behind_an_in_flight_query():
+    async def run():
+        server = _FakeServer()
+        batcher = server.batcher()
+        tasks = [asyncio.create_task(batcher.query(f"SELECT {i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        server.release.set()
+        assert await asyncio.gather(*tasks) == [f"result of SELECT {i}" for i in range(3)]
+        assert server.started == [("query", "SELECT 0"), ("batch", ["SELECT 1", "SELECT 2"])]
+        assert batcher.stats() == {"queries": 3, "round_trips": 2}
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_caller_cancels_the_request():
+    async def run():
+        server = _FakeServer()
+        batcher = server.batcher()
+        first = asyncio.create_task(batcher.query("SELECT 0"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert server.cancelled == [("query", "SELECT 0")]
+
+        # 排队的查询跟在一个在途的查询后面, 整批调用方都取消后批量请求也被取消
+        tasks = [asyncio.create_task(batcher.query(f"SELECT {i}")) for i in range(1, 4)]
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        await asyncio.sleep(0.01)
+        assert server.cancelled[-1] == ("query", "SELECT 1")
+        assert server.started[-1] == ("batch", ["SELECT 2", "SELECT 3"])
+        tasks[1].cancel()
+        await asyncio.sleep(0.01)
+        assert ("batch", ["SELECT 2", "SELECT 3"]) not in server.cancelled  # 还有调用方在等
+        tasks[2].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert server.cancelled[-1] == ("batch", ["SELECT 2", "SELECT 3"])
+        assert not batcher._busy and not batcher._pending
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from sql_graph.model_router import ModelRouter
+from sql_graph.text2sql_graph import use_cached_schema
+
+
+def _after_schema(question: str) -> list:
+    """图里第一次生成之前的消息: 问题 -> sql_db_schema 调用 -> schema 结果"""
+    messages = [HumanMessage(content=question)]
+    return messages + use_cached_schema({"messages": messages})["messages"]
+
+
+def test_multi_table_question_after_schema_uses_basic_model():
+    router = ModelRouter(small_max_question_chars=1000)  # 只看涉及的表数
+    question = "Show the names of all customers, their support rep, invoices, the tracks on each invoice and the album"
+    messages = _after_schema(question)
+    assert isinstance(messages[-1], ToolMessage) and messages[-1].name == "sql_db_schema"
+    assert len(router.involved_tables(question)) > router.small_max_tables
+    assert router.route_generate({"messages": messages}) == "basic"
+
+
+def test_simple_question_after_schema_uses_small_model():
+    assert ModelRouter().route_generate({"messages": _after_schema("How many employees?")}) == "small"
+
+
+def test_query_result_and_error_routing():
+    router = ModelRouter(small_max_question_chars=1000)
+    question = "Show the names of all customers, their support rep, invoices, the tracks on each invoice and the album"
+    call = {"name": "db_query_tool", "args": {"query": "SELECT 1"}, "id": "call-1", "type": "tool_call"}
+    messages = _after_schema(question) + [AIMessage(content="", tool_calls=[call])]
+    result = ToolMessage(content="[(1,)]", name="db_query_tool", tool_call_id="call-1")
+    error = ToolMessage(content="Error: (sqlite3.OperationalError) no such column: x", name="db_query_tool",
+                        tool_call_id="call-1", status="error")
+    assert router.route_generate({"messages": messages + [result]}) == "small"
+    assert router.route_generate({"messages": messages + [error]}) == "basic"
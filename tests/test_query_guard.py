@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+from mcpserver import worker_pool
+from mcpserver.db_pool import QueryInterrupted, QueryLimits, ReadOnlyPool, fetch_page, interrupt_reason, run_query
+from mcpserver.worker_pool import ProcessQueryPool
+from sql_graph.env_utils import SQLITE_DB_PATH
+from sql_graph.query_repair import classify_error
+
+# 不读任何表、永远不会结束的查询, 只能靠 QueryGuard 中断
+ENDLESS = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+
+
+def _stall(conn, seconds: float):
+    """不执行 sqlite 语句, 进度回调和 interrupt() 都管不到, 只能结束工作进程"""
+    time.sleep(seconds)
+
+
+@pytest.fixture
+def pool():
+    pool = ReadOnlyPool(SQLITE_DB_PATH, max_workers=1, enable_wal=False)
+    yield pool
+    pool.close()
+
+
+def test_timeout_interrupts_query(pool):
+    result, timing = asyncio.run(pool.run(run_query, ENDLESS, limits=QueryLimits(timeout=0.2)))
+    assert result.startswith("Error: (limit_exceeded) timeout")
+    assert timing.execution < 5
+
+
+def test_fetch_page_max_rows(pool):
+    rows, has_more = asyncio.run(pool.run(fetch_page, "SELECT TrackId FROM tracks", 0, 3,
+                                          limits=QueryLimits(max_rows=5)))[0]
+    assert len(rows) == 3 and has_more
+    # 分页时跳过的行也算读取的行
+    result = asyncio.run(pool.run(fetch_page, "SELECT TrackId FROM tracks", 10, 3, limits=QueryLimits(max_rows=5)))[0]
+    assert result.startswith("Error: (limit_exceeded) rows")
+
+
+def test_cancel_frees_worker_thread(pool):
+    async def run():
+        endless = asyncio.create_task(pool.run(run_query, ENDLESS))
+        await asyncio.sleep(0.2)
+        endless.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await endless
+        # 只有一个工作线程, 被取消的查询不让出线程的话这里会一直排队
+        result, _ = await asyncio.wait_for(pool.run(run_query, "SELECT 1"), timeout=5)
+        assert result == "[(1,)]"
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("reason, limit", [("timeout", 1.0), ("vm_steps", 1000), ("rows", 5), ("result_bytes", 100)])
+def test_interrupt_errors_are_classified_as_limit_exceeded(reason, limit):
+    text = QueryInterrupted(reason, limit).message("SELECT 1")
+    assert interrupt_reason(text) == reason
+    error = classify_error(text)
+    assert error.kind == "limit_exceeded" and error.identifier == reason
+
+
+def test_cancelled_error_is_not_a_limit():
+    text = QueryInterrupted("cancelled").message("SELECT 1")
+    assert interrupt_reason(text) == "cancelled"
+    assert classify_error(text).kind == "cancelled"
+    assert interrupt_reason("Error: (sqlite3.OperationalError) no such table: x") is None
+
+
+def test_process_pool_kills_stuck_worker(monkeypatch):
+    monkeypatch.setattr(worker_pool, "KILL_GRACE", 0.5)
+    pool = ProcessQueryPool(SQLITE_DB_PATH, processes=1)
+
+    async def run():
+        result, _ = await pool.run(run_query, ENDLESS, limits=QueryLimits(timeout=0.2))
+        assert result.startswith("Error: (limit_exceeded) timeout")  # 能中断的语句由工作进程自己中断
+        with pytest.raises(QueryInterrupted) as info:
+            await pool.run(_stall, 60, limits=QueryLimits(timeout=0.2))
+        assert info.value.reason == "timeout"
+        result, _ = await pool.run(run_query, "SELECT 1")  # 被结束的工作进程重新启动
+        assert result == "[(1,)]"
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.close()
@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from sql_graph.env_utils import MAX_QUERY_ROUNDS, SQLITE_DB_PATH
+from sql_graph.query_repair import classify_error, fix_locally, route_after_execution
+from sql_graph.schema_catalog import get_schema_catalog
+
+
+def _error(sql: str):
+    try:
+        sqlite3.connect(f"file:{SQLITE_DB_PATH}?mode=ro", uri=True).execute(sql)
+    except sqlite3.Error as e:
+        return classify_error(f"Error: (sqlite3.OperationalError) {e}")
+    raise AssertionError(f"expected {sql} to fail")
+
+
+def test_ambiguous_join_key_is_qualified_locally():
+    sql = "SELECT AlbumId, Title FROM albums a JOIN tracks t ON a.AlbumId = t.AlbumId"
+    fixed, _ = fix_locally(sql, _error(sql), get_schema_catalog().get())
+    assert fixed == "SELECT a.AlbumId, Title FROM albums a JOIN tracks t ON a.AlbumId = t.AlbumId"
+
+
+def test_ambiguous_non_key_column_is_left_to_the_model():
+    # customers 和 employees 都有 FirstName, 取哪一个是语义问题
+    sql = "SELECT FirstName FROM customers c JOIN employees e ON c.SupportRepId = e.EmployeeId"
+    assert fix_locally(sql, _error(sql), get_schema_catalog().get()) is None
+
+
+def _round(i: int, content: str = "[(1,)]") -> list:
+    call = {"name": "db_query_tool", "args": {"query": f"SELECT {i}"}, "id": f"call-{i}", "type": "tool_call"}
+    return [AIMessage(content="", tool_calls=[call]),
+            ToolMessage(content=content, name="db_query_tool", tool_call_id=f"call-{i}")]
+
+
+def test_successful_rounds_are_bounded():
+    messages = [HumanMessage(content="q")]
+    for i in range(MAX_QUERY_ROUNDS):
+        messages += _round(i)
+    assert route_after_execution({"messages": messages, "turn_started_at": time.time()}) == "generate_sql_query"
+    messages += _round(MAX_QUERY_ROUNDS)
+    assert route_after_execution({"messages": messages, "turn_started_at": time.time()}) == "give_up"
+
+
+def test_latency_budget_applies_to_successful_results():
+    state = {"messages": [HumanMessage(content="q")] + _round(0), "turn_started_at": time.time() - 3600}
+    assert route_after_execution(state) == "give_up"
@@ -0,0 +1,43 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from sql_graph import text2sql_graph
+from sql_graph.question_cache import QuestionSQLCache, normalize_question
+
+
+def test_equivalent_questions_share_a_key():
+    assert normalize_question("Top 10 artists by sales") == normalize_question("top ten artists, by sales?")
+    assert normalize_question("Top 10 artists by sales!") == normalize_question("top 10 artists by sales")
+
+
+@pytest.mark.parametrize("a, b", [
+    ("total > 10", "total < 10"),
+    ("total >= 10", "total > 10"),
+    ("total = 10", "total != 10"),
+    ("balance -5", "balance 5"),
+    ("sales 2012-2013", "sales 2012 2013"),
+    ("discount 10%", "discount 10"),
+])
+def test_symbols_that_change_meaning_do_not_collide(a, b):
+    assert normalize_question(a) != normalize_question(b)
+
+
+def test_different_questions_do_not_hit_each_other():
+    cache = QuestionSQLCache()
+    cache.put(1, "invoices with total > 10", "SELECT * FROM invoices WHERE Total > 10")
+    assert cache.get(1, "invoices with total < 10") is None
+    assert cache.get(1, "Invoices with total > 10?") == "SELECT * FROM invoices WHERE Total > 10"
+
+
+def test_use_cached_sql_falls_back_when_entry_is_gone(monkeypatch):
+    cache = QuestionSQLCache(ttl=0)  # 路由之后条目已经过期
+    cache.put(text2sql_graph.get_schema_catalog().current_version(), "有多少个艺术家?", "SELECT count(*) FROM artists")
+    monkeypatch.setattr(text2sql_graph, "get_question_cache", lambda: cache)
+    monkeypatch.setattr(text2sql_graph, "route_schema", lambda state: "list_of_tables_command")
+    state = {"messages": [HumanMessage(content="有多少个艺术家?")]}
+
+    update = text2sql_graph.use_cached_sql(state)
+
+    assert update == {}
+    assert text2sql_graph.route_cached_sql({"messages": state["messages"] + update.get("messages", [])}) \
+        == "list_of_tables_command"
@@ -0,0 +1,32 @@
+from langchain_core.messages import HumanMessage
+
+from sql_graph import text2sql_graph
+from sql_graph.env_utils import SQLITE_DB_PATH
+from sql_graph.schema_catalog import SchemaCatalog
+
+
+def test_new_process_with_snapshot_file_uses_cached_schema(tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / "schema.json")
+    SchemaCatalog(SQLITE_DB_PATH, snapshot_path=snapshot_path).save()
+
+    catalog = SchemaCatalog(SQLITE_DB_PATH, snapshot_path=snapshot_path)  # 新进程: 内存里还没有快照
+
+    def refresh():
+        raise AssertionError("snapshot file should be used instead of introspecting the database")
+
+    monkeypatch.setattr(catalog, "refresh", refresh)
+    monkeypatch.setattr(text2sql_graph, "get_schema_catalog", lambda: catalog)
+
+    assert text2sql_graph.route_schema({"messages": [HumanMessage(content="有多少个艺术家?")]}) == "use_cached_schema"
+    assert catalog.get().tables
+
+
+def test_stale_snapshot_file_is_rebuilt(tmp_path):
+    snapshot_path = str(tmp_path / "schema.json")
+    catalog = SchemaCatalog(SQLITE_DB_PATH, snapshot_path=snapshot_path)
+    catalog.save()
+    stale = SchemaCatalog(SQLITE_DB_PATH, snapshot_path=snapshot_path)
+    stale.load().version -= 1  # 模拟快照之后数据库执行过 DDL
+
+    assert not stale.is_fresh()
+    assert stale.get().version == catalog.current_version()